@@ -0,0 +1,400 @@
+"""
+Replay recorded ticks through the premium and threshold logic of Trader.monitor, with simulated exchanges.
+
+    python backtest.py ticks/ [--days 20261018 20261019] [--settings settings.json] [--interval 1]
+
+1. Tick files of every day are read through recorder.read_ticks memmaps in batches and put on the symbols of settings market_list.
+    Only one batch is in memory at a time, so months replay in the memory of a few minutes of ticks.
+2. Prices Trader would see at every monitor interval are found with searchsorted, one pass per stream and batch,
+    for chunk monitor times at a time. The last tick of every stream is carried to the next batch.
+3. Every decision runs PriceSnapshot.live_premium and the PREMIUM_RATIO threshold like Trader.monitor does.
+4. Trades go through MockBinance, MockUpbit and MockHuobi, which fill at the prices of the current monitor time
+    with fees and transfer delays. Trader waits for a whole cycle, so no decision is made until the cycle ends.
+"""
+import argparse
+import glob
+import json
+import logging
+import os
+import time
+
+import numpy as np
+
+from prices import PriceSnapshot
+from recorder import UPBIT, BINANCE, HUOBI, read_ticks, read_symbols
+
+log = logging.getLogger(__name__)
+
+STATE_NAMES = ("upbit", "upbit_event_ts", "upbit_recv_ts", "binance", "binance_event_ts", "binance_recv_ts")
+
+
+def tick_batches(directory, market_list, days=None, batch=1_000_000):
+    """
+    Ticks of days in batches of at most batch records sorted by receive time, with symbol ids as indexes of market_list.
+    Symbol id len(market_list) is USDT. Ticks of other symbols are dropped.
+    The recorder appends in receive order, so one batch follows on from the last.
+    """
+    if not days:
+        days = sorted(os.path.basename(path)[6:14] for path in glob.glob(os.path.join(directory, "ticks-*.json")))
+
+    index = {symbol: i for i, symbol in enumerate(market_list)}
+    index["USDT"] = len(market_list)
+
+    for day in days:
+        # Ids of a day are indexes of that day's symbol file. Map them to market_list.
+        symbols = read_symbols(directory, day)
+        remap = np.array([index.get(symbol, -1) for symbol in symbols], dtype=np.int32)
+
+        paths = glob.glob(os.path.join(directory, "ticks-" + day + ".bin"))
+        paths += sorted(glob.glob(os.path.join(directory, "ticks-" + day + "-*.bin")),
+                        key=lambda path: int(path[:-4].rsplit("-", 1)[1]))
+        for path in paths:
+            ticks = read_ticks(path)
+            for start in range(0, len(ticks), batch):
+                part = ticks[start:start + batch]
+                symbol = remap[part["symbol"]]
+                keep = symbol >= 0
+                chunk = np.array(part[keep])
+                if len(chunk):
+                    chunk["symbol"] = symbol[keep]
+                    yield chunk[np.argsort(chunk["recv_ts"], kind="stable")]
+
+
+class PriceGrid:
+    """
+    What PriceStore would hold at every monitor time, from batches of ticks.
+
+    replay() yields (times, state) with at most chunk monitor times. state holds arrays of shape (len(times), len(market_list))
+    named like PriceSnapshot fields, and usdt of shape (len(times), 3).
+    Memory is one batch of ticks and one chunk of state, whatever the length of the replay.
+    """
+    def __init__(self, market_list, interval=1.0, chunk=3600):
+        self.market_list = list(market_list)
+        self.interval = interval
+        self.chunk = chunk
+
+        # Last tick of every stream before the current batch.
+        n = len(self.market_list)
+        self.last = {name: np.zeros(n) for name in STATE_NAMES}
+        self.last_usdt = np.zeros(3)
+
+        self.ticks = 0
+        self.first_ts = None
+        self.last_ts = None
+
+    def replay(self, batches):
+        start = None
+        k = 0  # index of the next monitor time
+        for ticks in batches:
+            recv_ts = ticks["recv_ts"]
+            if start is None:
+                start = float(np.ceil(recv_ts[0]))
+                self.first_ts = float(recv_ts[0])
+            self.ticks += len(ticks)
+            self.last_ts = float(recv_ts[-1])
+
+            # Monitor times before the last tick of this batch. The rest wait for the next batch.
+            end_k = max(k, int(np.ceil((self.last_ts - start) / self.interval)))
+            streams = self.streams(ticks)
+            for chunk_k in range(k, end_k, self.chunk):
+                times = start + self.interval * np.arange(chunk_k, min(chunk_k + self.chunk, end_k))
+                yield times, self.state_at(streams, times)
+            k = end_k
+
+            # Carry the last tick of every stream.
+            for prefix, rows in streams[:2]:
+                for i, row in rows.items():
+                    self.last[prefix][i] = row["price"][-1]
+                    self.last[prefix + "_event_ts"][i] = row["event_ts"][-1]
+                    self.last[prefix + "_recv_ts"][i] = row["recv_ts"][-1]
+            usdt = streams[2]
+            if len(usdt):
+                self.last_usdt[:] = usdt["price"][-1], usdt["event_ts"][-1], usdt["recv_ts"][-1]
+
+        if start is None:
+            raise ValueError("No ticks to replay")
+
+    def streams(self, ticks):
+        """
+        ((upbit prefix, {symbol id: ticks}), (binance prefix, {symbol id: ticks}), usdt ticks), each in receive order.
+        """
+        exchange = ticks["exchange"]
+        n = len(self.market_list)
+        grouped = []
+        for ex, prefix in ((UPBIT, "upbit"), (BINANCE, "binance")):
+            sub = ticks[(exchange == ex) & (ticks["symbol"] < n)]
+            # Stable sort keeps receive order inside every symbol.
+            sub = sub[np.argsort(sub["symbol"], kind="stable")]
+            bounds = np.searchsorted(sub["symbol"], np.arange(n + 1))
+            grouped.append((prefix, {i: sub[bounds[i]:bounds[i + 1]] for i in range(n) if bounds[i + 1] > bounds[i]}))
+        grouped.append(ticks[exchange == HUOBI])
+        return grouped
+
+    def state_at(self, streams, times):
+        shape = (len(times), len(self.market_list))
+        state = {name: np.empty(shape) for name in STATE_NAMES}
+        for name in STATE_NAMES:
+            state[name][:] = self.last[name]
+
+        for prefix, rows in streams[:2]:
+            for i, row in rows.items():
+                j = np.searchsorted(row["recv_ts"], times, side="right") - 1
+                seen = j >= 0
+                j = j[seen]
+                state[prefix][seen, i] = row["price"][j]
+                state[prefix + "_event_ts"][seen, i] = row["event_ts"][j]
+                state[prefix + "_recv_ts"][seen, i] = row["recv_ts"][j]
+
+        usdt = np.empty((len(times), 3))
+        usdt[:] = self.last_usdt
+        row = streams[2]
+        if len(row):
+            j = np.searchsorted(row["recv_ts"], times, side="right") - 1
+            seen = j >= 0
+            j = j[seen]
+            usdt[seen, 0] = row["price"][j]
+            usdt[seen, 1] = row["event_ts"][j]
+            usdt[seen, 2] = row["recv_ts"][j]
+        state["usdt"] = usdt
+        return state
+
+
+class Market:
+    """
+    Prices of the current monitor time, a PriceSnapshot filled by Backtest.run.
+    """
+    def __init__(self, market_list):
+        self.market_list = list(market_list)
+        self.snapshot = PriceSnapshot(self.market_list)
+
+    def upbit(self, i):
+        return float(self.snapshot.upbit[i])
+
+    def binance(self, i):
+        return float(self.snapshot.binance[i])
+
+    def usdt(self):
+        return float(self.snapshot.usdt[0])
+
+
+class MockBinance:
+    """
+    Spot and futures account. Market orders fill at the last trade price times (1 + slippage) with taker fee.
+    """
+    def __init__(self, market, balance, settings):
+        self.market = market
+        self.spot_balance = balance
+        self.futures_balance = 0.0
+        self.fee = settings.get("binance_fee", 0.001)
+        self.futures_fee = settings.get("binance_futures_fee", 0.0004)
+        self.slippage = settings.get("slippage", 0.0005)
+        self.withdraw_fees = settings.get("withdraw_fees", {})  # symbol -> fee in coin
+        self.withdraw_fee_usdt = settings.get("withdraw_fee_usdt", 1.0)  # default fee for symbols not in withdraw_fees
+
+    def transfer_to_futures(self, amount):
+        self.spot_balance -= amount
+        self.futures_balance += amount
+
+    def market_buy(self, i, quantity):
+        price = self.market.binance(i) * (1 + self.slippage)
+        self.spot_balance -= price * quantity
+        return quantity * (1 - self.fee), price
+
+    def futures_short(self, i, quantity):
+        price = self.market.binance(i)
+        self.futures_balance -= price * quantity * self.futures_fee
+        return price
+
+    def futures_cover(self, i, quantity, entry_price):
+        price = self.market.binance(i) * (1 + self.slippage)
+        self.futures_balance += (entry_price - price) * quantity - price * quantity * self.futures_fee
+
+    def withdraw(self, i, quantity):
+        symbol = self.market.market_list[i]
+        fee = self.withdraw_fees.get(symbol, self.withdraw_fee_usdt / self.market.binance(i))
+        return quantity - fee
+
+
+class MockUpbit:
+    """
+    KRW account. Market sell fills at the last trade price times (1 - slippage) with fee.
+    """
+    def __init__(self, market, settings):
+        self.market = market
+        self.krw_balance = 0.0
+        self.fee = settings.get("upbit_fee", 0.0005)
+        self.slippage = settings.get("slippage", 0.0005)
+
+    def market_sell(self, i, quantity):
+        price = self.market.upbit(i) * (1 - self.slippage)
+        self.krw_balance += price * quantity * (1 - self.fee)
+        return price
+
+
+class MockHuobi:
+    """
+    Way back of KRW to Binance USDT. Upbit BTC to Huobi, EOS to Binance is taken as one conversion
+    at the Huobi USDT/KRW price with return_cost for the fees of those trades and withdraws.
+    """
+    def __init__(self, market, settings):
+        self.market = market
+        self.return_cost = settings.get("return_cost", 0.003)
+
+    def krw_to_usdt(self, krw):
+        return krw / self.market.usdt() * (1 - self.return_cost)
+
+
+class Backtest:
+    """
+    Trader.monitor decisions over recorded ticks.
+
+    batches is an iterable of tick arrays like tick_batches gives, read once.
+    settings uses the same keys as Trader, plus the fee and delay keys of the mock exchanges,
+    transfer_delay(seconds from withdraw to Upbit deposit), return_delay(seconds until KRW is back on Binance)
+    and initial_balance(USDT).
+    The deposit side of a trade fills at the first monitor time at or after transfer_delay.
+    """
+    def __init__(self, batches, settings, interval=1.0, chunk=3600):
+        self.PREMIUM_RATIO = settings.get("premium_ratio", 1.5)
+        self.BINANCE_MIN_BALANCE = settings.get("binance_min_balance", 400)
+        self.MAX_PRICE_AGE = settings.get("max_price_age", 30)
+
+        self.batches = batches
+        self.settings = settings
+        self.interval = interval
+        self.market_list = list(settings["market_list"])
+
+        self.grid = PriceGrid(self.market_list, interval, chunk)
+        self.market = Market(self.market_list)
+        self.binance = MockBinance(self.market, settings.get("initial_balance", 1000.0), settings)
+        self.upbit = MockUpbit(self.market, settings)
+        self.huobi = MockHuobi(self.market, settings)
+
+        self.transfer_delay = settings.get("transfer_delay", 600)
+        self.return_delay = settings.get("return_delay", 1800)
+
+        self.trades = []
+        self.decisions = 0
+
+    def run(self):
+        start = time.perf_counter()
+        snapshot = self.market.snapshot
+        busy_until = 0.0
+        pending = None  # trade waiting for its deposit
+        stopped = False
+
+        for times, state in self.grid.replay(self.batches):
+            if stopped:
+                continue  # Drain the batches, the report counts every tick.
+            for k, t in enumerate(times):
+                if t < busy_until and (pending is None or t < pending["deposit_at"]):
+                    continue
+
+                for name, values in state.items():
+                    getattr(snapshot, name)[:] = values[k]
+                if pending is not None:
+                    busy_until = self.settle_trade(pending) + self.return_delay
+                    pending = None
+                    continue
+                if not snapshot.ready():
+                    continue
+
+                # Same as Trader.monitor
+                self.decisions += 1
+                premium, stale = snapshot.live_premium(self.MAX_PRICE_AGE, now=t)
+                i_max = premium.argmax()
+                if premium[i_max] > self.PREMIUM_RATIO:
+                    if self.binance.spot_balance < self.BINANCE_MIN_BALANCE:
+                        log.info("Binance balance under BINANCE_MIN_BALANCE. Trader stops here.")
+                        stopped = True
+                        break
+                    pending = self.open_trade(int(i_max), float(premium[i_max]), t)
+                    busy_until = pending["deposit_at"]
+
+        elapsed = time.perf_counter() - start
+        return self.report(elapsed)
+
+    def open_trade(self, i, premium, t):
+        """
+        Binance side of cycle.ArbitrageCycle with the same ratios, at the prices of t.
+        """
+        start_balance = self.binance.spot_balance + self.binance.futures_balance
+
+        # 15% to futures for the hedge, buy with 99% of the rest.
+        self.binance.transfer_to_futures(self.binance.spot_balance * 0.15)
+        price = self.market.binance(i)
+        quantity = self.binance.spot_balance * 0.99 / price
+        bought, buy_price = self.binance.market_buy(i, quantity)
+        short_price = self.binance.futures_short(i, quantity)
+
+        return {
+            "i": i,
+            "time": float(t),
+            "premium": premium,
+            "start_balance": start_balance,
+            "quantity": quantity,
+            "arrived": self.binance.withdraw(i, bought),
+            "buy_price": buy_price,
+            "short_price": short_price,
+            "deposit_at": t + self.transfer_delay
+        }
+
+    def settle_trade(self, trade):
+        """
+        Upbit sell, hedge cover and the way back at the prices of the current monitor time. Returns that time.
+        """
+        i = trade["i"]
+        sell_price = self.upbit.market_sell(i, trade["arrived"])
+        self.binance.futures_cover(i, trade["quantity"], trade["short_price"])
+
+        # KRW back to Binance, futures balance back to spot.
+        krw, self.upbit.krw_balance = self.upbit.krw_balance, 0.0
+        self.binance.spot_balance += self.huobi.krw_to_usdt(krw) + self.binance.futures_balance
+        self.binance.futures_balance = 0.0
+
+        self.trades.append({
+            "time": trade["time"],
+            "symbol": self.market_list[i],
+            "premium": round(trade["premium"], 3),
+            "buy_price": trade["buy_price"],
+            "sell_price": sell_price,
+            "pnl": self.binance.spot_balance - trade["start_balance"]
+        })
+        return trade["deposit_at"]
+
+    def report(self, elapsed):
+        grid = self.grid
+        return {
+            "ticks": grid.ticks,
+            "seconds": round(elapsed, 3),
+            "ticks_per_sec": round(grid.ticks / elapsed) if elapsed else 0,
+            "replayed_seconds": round(grid.last_ts - grid.first_ts),
+            "decisions": self.decisions,
+            "trades": self.trades,
+            "pnl": sum(trade["pnl"] for trade in self.trades),
+            "balance": self.binance.spot_balance
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded ticks through Trader decision logic.")
+    parser.add_argument("directory", help="record_dir of the recorder")
+    parser.add_argument("--days", nargs="*", help="YYYYMMDD days to replay. Every day in directory by default.")
+    parser.add_argument("--settings", default="./settings.json")
+    parser.add_argument("--interval", type=float, default=1.0, help="Seconds between monitor calls")
+    args = parser.parse_args()
+
+    with open(args.settings) as f:
+        settings = json.load(f)
+
+    batches = tick_batches(args.directory, settings["market_list"], args.days)
+    report = Backtest(batches, settings, args.interval).run()
+
+    for trade in report.pop("trades"):
+        print(trade)
+    for key, value in report.items():
+        print(key, ":", value)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""
+Microbenchmark of feed message decoding. Prints messages/sec per exchange.
+
+    python bench_decode.py [-n 200000]
+
+old : json.loads of the whole message (gzip.decompress for Huobi) like ws.py used to do.
+new : decode.Decoder with each json backend, and with FieldExtractor (extract).
+"""
+import argparse
+import gzip
+import json
+import time
+
+from decode import Decoder, orjson, ujson
+
+UPBIT_TICKER = json.dumps({
+    "type": "ticker", "code": "KRW-ADA", "opening_price": 1480.0, "high_price": 1530.0, "low_price": 1455.0,
+    "trade_price": 1503.0, "prev_closing_price": 1480.0, "acc_trade_price": 112384024981.4386,
+    "change": "RISE", "change_price": 23.0, "signed_change_price": 23.0, "change_rate": 0.0155405405,
+    "signed_change_rate": 0.0155405405, "ask_bid": "BID", "trade_volume": 332.26246307,
+    "acc_trade_volume": 75097213.54519, "trade_date": "20210318", "trade_time": "051422",
+    "trade_timestamp": 1616044462000, "acc_ask_volume": 38178032.74652, "acc_bid_volume": 36919180.79867,
+    "highest_52_week_price": 1560.0, "highest_52_week_date": "2021-02-27", "lowest_52_week_price": 34.6,
+    "lowest_52_week_date": "2020-03-19", "trade_status": None, "market_state": "ACTIVE",
+    "market_state_for_ios": None, "is_trading_suspended": False, "delisting_date": None,
+    "market_warning": "NONE", "timestamp": 1616044462437, "acc_trade_price_24h": 245024187395.07935,
+    "acc_trade_volume_24h": 165112541.0563, "stream_type": "REALTIME"
+}, separators=(",", ":")).encode()
+
+BINANCE_AGG_TRADE = json.dumps({
+    "e": "aggTrade", "E": 1616044462437, "s": "ADAUSDT", "a": 123456789, "p": "1.23450000",
+    "q": "100.00000000", "f": 100, "l": 105, "T": 1616044462436, "m": True, "M": True
+}, separators=(",", ":"))
+
+HUOBI_TRADE_DETAIL = gzip.compress(json.dumps({
+    "ch": "market.usdtkrw.trade.detail", "ts": 1616044462437,
+    "tick": {"id": 1, "ts": 1616044462436, "data": [
+        {"id": 1, "ts": 1616044462436, "tradeId": 100, "amount": 12.5, "price": 1131.5, "direction": "buy"}
+    ]}
+}).encode())
+
+
+def bench(name, func, message, n):
+    start = time.perf_counter()
+    for _ in range(n):
+        func(message)
+    elapsed = time.perf_counter() - start
+    print("{:<32}{:>14,.0f} msg/s".format(name, n / elapsed))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", type=int, default=200000)
+    n = parser.parse_args().n
+
+    backends = ["json"] + [name for name, mod in (("ujson", ujson), ("orjson", orjson)) if mod]
+
+    print("Upbit ticker")
+    bench("  old json.loads", json.loads, UPBIT_TICKER, n)
+    for backend in backends:
+        bench("  new " + backend, Decoder(backend).decode, UPBIT_TICKER, n)
+    fields = ("code", "trade_price", "trade_timestamp")
+    bench("  new extract", Decoder(fields=fields, extract=True).decode, UPBIT_TICKER, n)
+
+    print("Binance aggTrade")
+    bench("  old json.loads", lambda m: float(json.loads(m)["p"]), BINANCE_AGG_TRADE, n)
+    for backend in backends:
+        bench("  new " + backend, lambda m, d=Decoder(backend): float(d.decode(m)["p"]), BINANCE_AGG_TRADE, n)
+    fields = ("s", "p", "T")
+    bench("  new extract", lambda m, d=Decoder(fields=fields, extract=True): float(d.decode(m)[1]), BINANCE_AGG_TRADE, n)
+
+    print("Huobi trade detail")
+    bench("  old gzip + json.loads", lambda m: json.loads(gzip.decompress(m)), HUOBI_TRADE_DETAIL, n)
+    for backend in backends:
+        bench("  new " + backend, Decoder(backend, gzip=True).decode, HUOBI_TRADE_DETAIL, n)
+
+
+if __name__ == '__main__':
+    main()
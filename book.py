@@ -0,0 +1,277 @@
+import logging
+import threading
+import time
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+
+class BookSide:
+    """
+    One side of an order book in sorted numpy arrays.
+
+    Levels are sorted by key, price for asks and -price for bids, so best price is always at 0.
+    Cumulative quantity and notional are cached and rebuilt lazily from the first changed level.
+    """
+    def __init__(self, is_bid, capacity):
+        self.sign = -1.0 if is_bid else 1.0
+        self.capacity = capacity
+        self.n = 0
+
+        self.keys = np.zeros(capacity)
+        self.price = np.zeros(capacity)
+        self.qty = np.zeros(capacity)
+        self.cum_qty = np.zeros(capacity)
+        self.cum_notional = np.zeros(capacity)
+        self.dirty_from = 0  # cumulative arrays are valid below this level
+
+    def replace(self, prices, qtys):
+        n = min(len(prices), self.capacity)
+        prices = np.asarray(prices[:n], dtype=float)
+        qtys = np.asarray(qtys[:n], dtype=float)
+
+        keys = prices * self.sign
+        order = np.argsort(keys, kind="stable")
+        self.keys[:n] = keys[order]
+        self.price[:n] = prices[order]
+        self.qty[:n] = qtys[order]
+        self.n = n
+        self.dirty_from = 0
+
+    def update(self, price, qty):
+        """
+        Set quantity of one price level. qty 0 removes the level.
+        """
+        key = price * self.sign
+        n = self.n
+        i = int(np.searchsorted(self.keys[:n], key))
+
+        if i < n and self.keys[i] == key:
+            if qty == 0:
+                self.keys[i:n-1] = self.keys[i+1:n]
+                self.price[i:n-1] = self.price[i+1:n]
+                self.qty[i:n-1] = self.qty[i+1:n]
+                self.n = n - 1
+            else:
+                self.qty[i] = qty
+        elif qty != 0:
+            if i >= self.capacity:
+                return  # Worse than every level we keep.
+            end = min(n, self.capacity - 1)
+            self.keys[i+1:end+1] = self.keys[i:end]
+            self.price[i+1:end+1] = self.price[i:end]
+            self.qty[i+1:end+1] = self.qty[i:end]
+            self.keys[i] = key
+            self.price[i] = price
+            self.qty[i] = qty
+            self.n = end + 1
+        else:
+            return
+
+        if i < self.dirty_from:
+            self.dirty_from = i
+
+    def cumulate(self):
+        n = self.n
+        start = self.dirty_from
+        if start >= n:
+            return
+
+        # Continue from the last valid level instead of summing from the top again.
+        base_qty = self.cum_qty[start-1] if start else 0.0
+        base_notional = self.cum_notional[start-1] if start else 0.0
+        np.cumsum(self.qty[start:n], out=self.cum_qty[start:n])
+        self.cum_qty[start:n] += base_qty
+        np.multiply(self.price[start:n], self.qty[start:n], out=self.cum_notional[start:n])
+        np.cumsum(self.cum_notional[start:n], out=self.cum_notional[start:n])
+        self.cum_notional[start:n] += base_notional
+        self.dirty_from = n
+
+    def best(self):
+        return self.price[0] if self.n else 0.0
+
+    def vwap_notional(self, notional):
+        """
+        (average price, quantity) to trade notional in quote currency. Average price is nan without enough depth.
+        """
+        self.cumulate()
+        n = self.n
+        i = int(np.searchsorted(self.cum_notional[:n], notional))
+        if i >= n:
+            return float("nan"), float(self.cum_qty[n-1]) if n else 0.0
+
+        prev_notional = self.cum_notional[i-1] if i else 0.0
+        prev_qty = self.cum_qty[i-1] if i else 0.0
+        qty = prev_qty + (notional - prev_notional) / self.price[i]
+        return notional / qty, qty
+
+    def vwap_qty(self, qty):
+        """
+        Average price to trade qty in base currency. nan without enough depth.
+        """
+        self.cumulate()
+        n = self.n
+        i = int(np.searchsorted(self.cum_qty[:n], qty))
+        if i >= n or qty <= 0:
+            return float("nan")
+
+        prev_notional = self.cum_notional[i-1] if i else 0.0
+        prev_qty = self.cum_qty[i-1] if i else 0.0
+        notional = prev_notional + (qty - prev_qty) * self.price[i]
+        return notional / qty
+
+
+class OrderBook:
+    def __init__(self, capacity=1000):
+        self.bids = BookSide(True, capacity)
+        self.asks = BookSide(False, capacity)
+        self.lock = threading.Lock()
+
+        # Binance diff depth sync. See BookStore.apply_binance.
+        self.last_update_id = 0
+        self.synced = False
+        self.buffer = []
+        self.fetching = False  # REST snapshot in flight
+        self.failures = 0  # failed snapshots in a row
+        self.retry_at = 0.0  # no new snapshot before this
+
+
+class BookStore:
+    """
+    Order books of every symbol in market_list for Upbit and Binance.
+
+    1. Upbit orderbook messages are full snapshots of 15 levels and replace the book.
+    2. Binance diff depth updates are applied level by level on top of a REST snapshot.
+        Updates are buffered until the snapshot is loaded, and a gap in update ids triggers a new snapshot.
+        One snapshot per symbol is in flight at a time. A failed one is tried again after a backoff
+        doubling from retry_delay up to max_retry_delay. A buffer over max_buffer updates is dropped.
+    3. Executable price for a size is a vwap query on cached cumulative depth.
+    """
+    def __init__(self, market_list, capacity=1000, fetch_snapshot=None, max_buffer=1000, retry_delay=1, max_retry_delay=60):
+        self.market_list = list(market_list)
+        self.upbit = {symbol: OrderBook(capacity) for symbol in self.market_list}
+        self.binance = {symbol: OrderBook(capacity) for symbol in self.market_list}
+        self.max_buffer = max_buffer
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+
+        # fetch_snapshot(symbol) is called on another thread.
+        # It calls load_binance_snapshot when done or snapshot_failed when the request fails.
+        self.fetch_snapshot = fetch_snapshot
+
+    def apply_upbit(self, data):
+        # ex) code = KRW-ADA
+        book = self.upbit.get(data["code"][4:])
+        if book is None:
+            return
+
+        units = data["orderbook_units"]
+        with book.lock:
+            book.asks.replace([u["ask_price"] for u in units], [u["ask_size"] for u in units])
+            book.bids.replace([u["bid_price"] for u in units], [u["bid_size"] for u in units])
+
+    def apply_binance(self, data):
+        # s is symbol ex) ADAUSDT, U is first update id, u is final update id, b and a are [price, qty]
+        book = self.binance.get(data["s"][:-4])
+        if book is None:
+            return
+
+        with book.lock:
+            if not book.synced:
+                if len(book.buffer) >= self.max_buffer:
+                    # The snapshot would be older than the first update kept anyway.
+                    log.warning("Binance depth buffer of " + data["s"] + " is full. Dropped.")
+                    book.buffer = []
+                book.buffer.append(data)
+                self._request_snapshot(book, data["s"][:-4])
+                return
+
+            if data["u"] <= book.last_update_id:
+                return
+            if data["U"] > book.last_update_id + 1:
+                log.warning("Binance depth gap in " + data["s"] + ". Resync.")
+                book.synced = False
+                book.buffer = [data]
+                self._request_snapshot(book, data["s"][:-4])
+                return
+
+            self._apply_binance_levels(book, data)
+
+    def _request_snapshot(self, book, symbol):
+        # Called with book.lock held.
+        if book.fetching or not self.fetch_snapshot or time.time() < book.retry_at:
+            return
+        book.fetching = True
+        self.fetch_snapshot(symbol)
+
+    def snapshot_failed(self, symbol, reason):
+        """
+        Called by fetch_snapshot when the request failed. Next update after the backoff asks again.
+        """
+        book = self.binance[symbol]
+        with book.lock:
+            self._retry_later(book)
+        log.error("Binance depth snapshot failed for " + symbol + " : " + reason + ". Retry in " +
+                  str(round(book.retry_at - time.time(), 1)) + "s")
+
+    def _retry_later(self, book):
+        book.fetching = False
+        book.failures += 1
+        book.retry_at = time.time() + min(self.retry_delay * 2 ** (book.failures - 1), self.max_retry_delay)
+
+    def load_binance_snapshot(self, symbol, snapshot):
+        """
+        snapshot is the response of GET /api/v3/depth.
+        The first buffered update after it has to bridge lastUpdateId, U <= lastUpdateId + 1 <= u,
+        and every next one has to follow on. Otherwise updates are missing and a new snapshot is asked for.
+        """
+        book = self.binance[symbol]
+        with book.lock:
+            last_update_id = snapshot["lastUpdateId"]
+            buffer = [data for data in book.buffer if data["u"] > last_update_id]
+            expected = last_update_id + 1
+            for k, data in enumerate(buffer):
+                if data["U"] > expected:
+                    # Keep what follows the gap for the next snapshot.
+                    log.warning("Binance depth snapshot of " + symbol + " doesn't bridge its updates. Resync.")
+                    book.buffer = buffer[k:]
+                    # Next update after the backoff asks again.
+                    self._retry_later(book)
+                    return
+                expected = data["u"] + 1
+
+            book.bids.replace([float(p) for p, q in snapshot["bids"]], [float(q) for p, q in snapshot["bids"]])
+            book.asks.replace([float(p) for p, q in snapshot["asks"]], [float(q) for p, q in snapshot["asks"]])
+            book.last_update_id = last_update_id
+            book.buffer = []
+            for data in buffer:
+                self._apply_binance_levels(book, data)
+            book.fetching = False
+            book.failures = 0
+            book.synced = True
+
+    def _apply_binance_levels(self, book, data):
+        for price, qty in data["b"]:
+            book.bids.update(float(price), float(qty))
+        for price, qty in data["a"]:
+            book.asks.update(float(price), float(qty))
+        book.last_update_id = data["u"]
+
+    def binance_buy(self, symbol, notional):
+        """
+        (average price, quantity) of buying notional USDT of symbol at Binance.
+        """
+        book = self.binance[symbol]
+        with book.lock:
+            if not book.synced:
+                return float("nan"), 0.0
+            return book.asks.vwap_notional(notional)
+
+    def upbit_sell(self, symbol, qty):
+        """
+        Average price of selling qty of symbol at Upbit.
+        """
+        book = self.upbit[symbol]
+        with book.lock:
+            return book.bids.vwap_qty(qty)
@@ -0,0 +1,627 @@
+import logging
+import math
+import time
+
+from binance.enums import *
+from binance.exceptions import BinanceWithdrawException
+
+from huobi.constant import *
+
+from executor import Machine, Wait, TradeError
+from phases import PhaseTimer
+from scheduler import Watch
+
+log = logging.getLogger(__name__)
+
+
+class ArbitrageCycle(Machine):
+    """
+    Binance -> Upbit with the premium coin, Upbit -> Huobi and Huobi -> Binance with coins picked by
+    transfers.TransferIndex (BTC and EOS by default), as states of executor.TradeExecutor.
+
+    Same orders, ratios and polling as the trade functions of Trader had. Every wait for a fill, withdraw or deposit
+    is a PollScheduler watch, so Trader.monitor keeps running during the whole cycle.
+    Before selling on Upbit the live premium is checked again. See Trader.SELL_MIN_PREMIUM.
+
+    Each leg is a span and every order, withdraw and wait is a child span of its leg.
+    """
+    def __init__(self, trader, premium_data, detected_at=None):
+        # Get symbol of currency with maximum premium
+        symbol = max(premium_data, key=premium_data.get)
+        super().__init__("cycle " + symbol)
+
+        self.trader = trader
+        self.premium_data = premium_data
+        self.symbol = symbol
+        self.phases = PhaseTimer("cycle", detected_at, trader.span_sink, symbol=symbol, premium=premium_data[symbol])
+        self.leg = None
+        self.open = None  # span of a wait that hasn't ended
+
+        self.trade_info = {
+            "symbol": symbol,
+            "price": 0,
+            "Upbit": {"deposit_addr": "", "secondary_addr": None},
+            "Binance": {"spot_balance": 0, "futures_balance": 0}
+        }
+
+    # Tracing
+
+    def run(self, state, result):
+        if self.leg is None:
+            return state(result)
+        with self.phases.within(self.leg):
+            return state(result)
+
+    def begin_leg(self, name, symbol):
+        if self.leg is not None:
+            self.phases.end(self.leg)
+        self.leg = self.phases.begin(name, parent_id=0, symbol=symbol)
+
+    def begin(self, name, **attrs):
+        """
+        Span that ends with the next Wait.
+        """
+        self.open = self.phases.begin(name, parent_id=self.leg["span_id"], **attrs)
+        return self.open
+
+    def waited(self, wait, error):
+        if wait.span is not None:
+            self.phases.end(wait.span, repr(error) if error else None)
+            self.open = None
+
+    def finish(self, error=None):
+        error = repr(error) if error else None
+        if self.open is not None:
+            self.phases.end(self.open, error)
+        if self.leg is not None:
+            self.phases.end(self.leg, error)
+        self.phases.finish()
+
+    def watch(self, watch, then, span=None, delay=0):
+        return Wait(self.trader.scheduler.submit(watch, delay), then, span)
+
+    def huobi_buy_price(self, coin, usdt):
+        # Lowest ask in live Huobi depth that fills usdt worth of coin at once, so the limit order fills right away.
+        # 0 when the book is empty or too thin. Transfer coins outside market_list have no feed, only this.
+        depth = self.trader.huobi_market_client.get_pricedepth(coin.lower() + "usdt", DepthStep.STEP0, 20)
+        total = 0.0
+        for ask in depth.asks or []:
+            total += ask.price * ask.amount
+            if total >= usdt:
+                return ask.price
+        return 0.0
+
+    def expected_at(self, src, dst, coin):
+        # When the transfer started at withdraw_started should arrive, from our own transfer times.
+        # Its watch polls slowly until then and fast around it. Guessed times of candidates are too rough for that,
+        # so a route we haven't used yet stays on plain backoff.
+        seconds = self.trader.transfers.seconds(src, dst, coin)
+        return self.withdraw_started + seconds if seconds else None
+
+    # Binance -> Upbit
+
+    def start(self, result=None):
+        """
+        Setup trading pre condition.
+        1. Balance. (Over BINANCE_MIN_BALANCE)
+        2. Upbit deposit address of the symbol.
+        3. Transfer 15% of spot balance to futures balance.
+        """
+        trader = self.trader
+        self.begin_leg("binance_to_upbit", self.symbol)
+
+        self.trade_info["price"] = trader.prices.binance_price(self.symbol)
+        log.info("Trading "+self.symbol)
+
+        span = self.begin("prepare", exchange="Binance", symbol=self.symbol)
+
+        # Upbit address doesn't depend on Binance checks, so it's fetched meanwhile.
+        addr_future = trader.prefetch_deposit_addr(self.symbol)
+
+        # Account, futures and balance checks don't depend on each other.
+        info, futures_balance, spot_balance = trader.gateway.gather(
+            trader.gateway.binance_account(),
+            trader.gateway.binance_futures_balance(),
+            trader.gateway.binance_balance("USDT")
+        )
+
+        # Check binance account status.
+        if info["canTrade"] is False or info["canWithdraw"] is False or info["canDeposit"] is False:
+            raise TradeError("Can't proceed trading. Check binance account status.")
+
+        # Check whether futures account is empty.
+        if float(futures_balance[0]["balance"]) != 0:
+            raise TradeError("Can't proceed trading. Futures account needs to be empty.")
+
+        # Get binance balance
+        self.trade_info["Binance"]["spot_balance"] = trader.spot_balance = float(spot_balance["free"])
+        log.info("Binance balance : " + str(self.trade_info["Binance"]["spot_balance"]))
+        if self.trade_info["Binance"]["spot_balance"] < trader.BINANCE_MIN_BALANCE:
+            raise TradeError("Check binance account minimum balance.")
+
+        # Transfer balance to futures account.
+        trader.binance_client.futures_account_transfer(asset="USDT", amount=self.trade_info["Binance"]["spot_balance"] * 0.15, type=1)
+        self.trade_info["Binance"]["spot_balance"] *= 0.85
+
+        return Wait(addr_future, self.buy, span)
+
+    def buy(self, addr):
+        """
+        1. Trade 85% of balance and leave 15% for hedging with future short.
+            It's 85% because after you sold the coin in Upbit, balance has increased and 10x leverage is no longer
+            possible with the original balance in futures account if the percentage is set to 10%.
+        2. Filter quantity LOT_SIZE according to binance manuel.
+            quantity >= minQty
+            quantity <= maxQty
+            (quantity-minQty) % stepSize == 0
+        3. Format float precision according to given baseAssetPrecision. Not sure if this is necessary.
+        """
+        trader = self.trader
+        symbol = self.symbol
+        self.trade_info["Upbit"]["deposit_addr"], self.trade_info["Upbit"]["secondary_addr"] = addr
+
+        # Multiply 0.99 because you buy in market price and their is taker fee. Real price and saved price can be different
+        self.step_size = trader.metadata.spot_step_size(symbol)
+        quantity = self.trade_info["Binance"]["spot_balance"] * 0.99 / self.trade_info["price"]
+        spot_quantity_str = trader.float_precision(quantity, self.step_size)
+
+        with self.phases.phase("spot_buy_and_hedge", exchange="Binance", symbol=symbol, quantity=quantity):
+            if trader.CONCURRENT_LEGS:
+                # Hedge quantity doesn't wait for the fill, so send both orders at the same moment.
+                order, self.futures_quantity = trader.gateway.gather(
+                    trader.gateway.binance_order(symbol+"USDT", "BUY", spot_quantity_str),
+                    trader.gateway.call(trader.binance_hedge_short, symbol, quantity, self.phases)
+                )
+                log.info("Binance buy executed.")
+            else:
+                with self.phases.phase("binance_buy", exchange="Binance", symbol=symbol, quantity=spot_quantity_str):
+                    order = trader.binance_client.order_market_buy(symbol=symbol+"USDT", quantity=spot_quantity_str)
+                log.info("Binance buy executed.")
+
+                # Futures hedge short
+                self.futures_quantity = trader.binance_hedge_short(symbol, quantity, self.phases)
+        self.phases.mark("hedged")
+
+        # To be precise get the balance again and don't use spot_quantity_str.
+        res = trader.binance_client.get_asset_balance(asset=symbol)
+        trans_quantity_str = trader.float_precision(res["free"], self.step_size)
+        log.debug(trans_quantity_str)
+
+        # Balance doesn't get update immediately and prints insufficient balance error. Need to try multiple times.
+        def binance_withdraw():
+            if self.trade_info["Upbit"]["secondary_addr"]:
+                return trader.binance_client.withdraw(
+                    asset=symbol,
+                    address=self.trade_info["Upbit"]["deposit_addr"],
+                    addressTag=self.trade_info["Upbit"]["secondary_addr"],
+                    amount=trans_quantity_str
+                )
+            return trader.binance_client.withdraw(
+                asset=symbol,
+                address=self.trade_info["Upbit"]["deposit_addr"],
+                amount=trans_quantity_str
+            )
+
+        return self.watch(Watch(
+            "Binance",
+            poll=binance_withdraw,
+            done=lambda res: res if "id" in res else None,
+            interval=1, max_interval=5,
+            retry_on=(BinanceWithdrawException,),
+            name="Binance withdraw"
+        ), self.withdrawn, self.begin("binance_withdraw", exchange="Binance", symbol=symbol, quantity=trans_quantity_str))
+
+    def withdrawn(self, res):
+        """
+        status : 0(0:Email Sent,1:Cancelled 2:Awaiting Approval 3:Rejected 4:Processing 5:Failure 6:Completed)
+        """
+        log.info("Binance withdrawing to Upbit.")
+        withdraw_id = res["id"]
+        self.withdraw_started = time.time()
+
+        def withdraw_done(res):
+            for t in res["withdrawList"]:
+                if t["id"] == withdraw_id and t["status"] not in (0, 2, 4):
+                    return t
+            return None
+
+        return self.watch(Watch(
+            "Binance",
+            poll=lambda: self.trader.binance_client.get_withdraw_history(asset=self.symbol),
+            done=withdraw_done,
+            interval=3, max_interval=30, backoff=1.2,
+            name="Binance withdraw status"
+        ), self.withdraw_confirmed, self.begin("binance_withdraw_confirm", exchange="Binance", symbol=self.symbol))
+
+    def withdraw_confirmed(self, t):
+        if t["status"] != 6:
+            raise TradeError("Binance withdraw failed with status " + str(t["status"]))
+        txid = t["txId"]
+        log.info("Binance withdraw complete. Txid : "+txid)
+
+        # Check again in upbit side.
+        return self.watch(Watch(
+            "Upbit",
+            done=lambda res: res if "error" in res or res["state"] in ("ACCEPTED", "REJECTED") else None,
+            interval=3, min_interval=1, max_interval=30,
+            expected_at=self.expected_at("Binance", "Upbit", self.symbol),
+            batch_key="Upbit deposits",
+            batch_arg=(self.symbol, txid),
+            name="Upbit deposit"
+        ), self.deposited, self.begin("upbit_deposit_confirm", exchange="Upbit", symbol=self.symbol, txid=txid))
+
+    def deposited(self, res):
+        if "error" in res:
+            raise TradeError(res["error"]["message"])
+        if res["state"] == "REJECTED":
+            raise TradeError("Upbit deposit rejected.")
+
+        trader = self.trader
+        trader.record_transfer("Binance", "Upbit", self.symbol, time.time() - self.withdraw_started)
+        if trader.SELL_MIN_PREMIUM is None:
+            return self.sell
+
+        # Coin is in Upbit now, sell while the premium lasts. Hold on when it has faded, but not longer than SELL_MAX_WAIT.
+        premium = trader.live_premium(self.symbol)
+        if premium is not None and premium >= trader.SELL_MIN_PREMIUM:
+            return self.sell
+
+        log.info(self.symbol + " premium " + str(premium) + " under " + str(trader.SELL_MIN_PREMIUM) + ". Holding Upbit sell.")
+        deadline = time.time() + trader.SELL_MAX_WAIT
+
+        def sell_now(res):
+            premium = res[0]
+            if (premium is not None and premium >= trader.SELL_MIN_PREMIUM) or time.time() >= deadline:
+                return res
+            return None
+
+        # Local check without requests, so it has no budget.
+        return self.watch(Watch(
+            "Trader",
+            poll=lambda: (trader.live_premium(self.symbol),),
+            done=sell_now,
+            interval=1, max_interval=1,
+            name="Upbit sell premium"
+        ), self.sell, self.begin("sell_hold", exchange="Upbit", symbol=self.symbol))
+
+    def sell(self, result=None):
+        trader = self.trader
+        symbol = self.symbol
+
+        with self.phases.phase("upbit_sell", exchange="Upbit", symbol=symbol, premium=trader.live_premium(symbol)) as span:
+            upbit_quantity = ""
+            res = trader.upbit_client.accounts()
+            for currency in res:
+                if currency["currency"] == symbol:
+                    upbit_quantity = currency["balance"]
+            span["quantity"] = upbit_quantity
+
+            res = trader.upbit_client.order(
+                market="KRW-"+symbol,
+                side="ask",
+                volume=upbit_quantity,
+                ord_type="market"
+            )
+        log.info("Upbit sell complete.")
+        log.info(self.premium_data)
+
+        # After upbit side trade was made, cover short hedge
+        with self.phases.phase("hedge_cover", exchange="Binance", symbol=symbol, quantity=self.futures_quantity):
+            order = trader.binance_client.futures_create_order(
+                symbol=symbol + "USDT",
+                side=SIDE_BUY,
+                type=ORDER_TYPE_MARKET,
+                quantity=self.futures_quantity
+            )
+
+        log.info("Binance futures cover complete.")
+        return self.transfer_buy
+
+    # Upbit -> Huobi
+    # 1. Buy the transfer coin and hedge with binance short. BTC unless settings transfer_coins has cheaper ones.
+    # 2. Send it to Huobi.
+    # 3. Sell with limit order so you can avoid slippage. Need precise calculation.
+
+    def transfer_buy(self, result=None):
+        trader = self.trader
+        self.transfer = trader.transfers.select("Upbit", "Huobi", self.trade_info["Binance"]["spot_balance"])
+        coin = self.transfer["coin"]
+        self.begin_leg("upbit_to_huobi", coin)
+        log.info("Upbit to Huobi with " + coin + ". " + str(self.transfer))
+
+        # Get Huobi wallet address and Upbit balance at the same time.
+        list_obj, res = trader.gateway.gather(
+            trader.gateway.huobi_deposit_address(coin.lower()),
+            trader.gateway.upbit_accounts()
+        )
+
+        self.huobi_addr = ""
+        self.huobi_addr_tag = ""
+        for obj in list_obj:
+            if obj.chain == coin.lower():  # eos1
+                self.huobi_addr = obj.address
+                self.huobi_addr_tag = obj.addressTag
+
+        # Buy the coin in Upbit
+        upbit_krw_balance = 0
+        if "error" in res:
+            raise TradeError(res["error"]["message"])
+
+        for currency in res:
+            if currency["currency"] == "KRW":
+                upbit_krw_balance = currency["balance"]
+
+        log.info("Upbit buying.")
+        log.debug("KRW Balance : "+upbit_krw_balance)
+        span = self.begin("upbit_buy", exchange="Upbit", symbol=coin, krw=upbit_krw_balance)
+        res = trader.upbit_client.order(
+            market="KRW-"+coin,
+            side="bid",
+            price=math.floor(float(upbit_krw_balance)*0.9995),
+            ord_type="price"
+        )
+
+        if "error" in res:
+            raise TradeError(res["error"]["message"])
+
+        trade_uuid = res["uuid"]
+
+        # Market order fills almost right away, so poll fast.
+        return self.watch(Watch(
+            "Upbit",
+            poll=lambda: trader.upbit_client.check_order(trade_uuid),
+            done=lambda res: res if res["trades_count"] != 0 else None,
+            interval=0.1, min_interval=0.1, max_interval=2,
+            name="Upbit order"
+        ), self.transfer_bought, span)
+
+    def transfer_bought(self, res):
+        trader = self.trader
+        coin = self.transfer["coin"]
+        upbit_avg_price = res["trades"][0]["price"]
+        log.info("Upbit bought.")
+
+        # Get Upbit balance less withdraw fee.
+        self.transfer_balance = 0
+        res = trader.upbit_client.accounts()
+        for currency in res:
+            if currency["currency"] == coin:
+                self.transfer_balance = float(currency["balance"]) - self.transfer["withdraw_fee"]
+
+        # Futures hedge short
+        self.futures_quantity = trader.binance_hedge_short(coin, self.transfer_balance, self.phases)
+
+        # Withdraw decimal point differs for each currency.
+        log.info("Upbit to Huobi withdraw started.")
+        withdraw_quantity = trader.float_precision(self.transfer_balance, self.transfer["precision"])
+        with self.phases.phase("upbit_withdraw", exchange="Upbit", symbol=coin, quantity=withdraw_quantity):
+            withdraw = {"currency": coin, "amount": withdraw_quantity, "address": self.huobi_addr}
+            if self.huobi_addr_tag:
+                withdraw["secondary_address"] = self.huobi_addr_tag
+            res = trader.upbit_client.withdraw(**withdraw)
+            if "error" in res:
+                raise TradeError(res["error"]["message"])
+        self.withdraw_started = time.time()
+
+        withdraw_uuid = res["uuid"]
+
+        return self.watch(Watch(
+            "Upbit",
+            poll=lambda: trader.upbit_client.check_withdraw(withdraw_uuid),
+            done=lambda res: res if res["done_at"] else None,
+            interval=10, min_interval=5, max_interval=60, backoff=1.2,
+            expected_at=self.expected_at("Upbit", "Huobi", coin),
+            name="Upbit withdraw"
+        ), self.transfer_withdrawn, self.begin("upbit_withdraw_confirm", exchange="Upbit", symbol=coin))
+
+    def transfer_withdrawn(self, result):
+        trader = self.trader
+        coin = self.transfer["coin"]
+        log.info("Upbit to Huobi withdraw done.")
+        trader.record_transfer("Upbit", "Huobi", coin, time.time() - self.withdraw_started)
+
+        # Sell the coin at Huobi.
+        # Balance is not updated immediately so loop the order function.
+        self.huobi_quantity = float(trader.float_precision(self.transfer_balance, self.transfer["precision"]))
+        return self.watch(Watch(
+            "Huobi",
+            poll=lambda: trader.huobi_trade_client.create_order(
+                symbol=coin.lower()+"krw",
+                account_id=trader.huobi_account_id,
+                order_type=OrderType.SELL_MARKET,
+                amount=self.huobi_quantity,
+                source=OrderSource.API,
+                price=None
+            ),
+            interval=2, max_interval=10,
+            name="Huobi sell order"
+        ), self.transfer_sell_placed, self.begin("huobi_sell", exchange="Huobi", symbol=coin, quantity=self.huobi_quantity))
+
+    def transfer_sell_placed(self, order_id):
+        log.info("Huobi sell order created.")
+
+        # Monitor until order is filled.
+        return self.watch(self.trader.huobi_filled_watch(order_id, self.huobi_quantity), self.transfer_sold,
+                          self.begin("huobi_sell_fill", exchange="Huobi", symbol=self.transfer["coin"], quantity=self.huobi_quantity))
+
+    def transfer_sold(self, order):
+        coin = self.transfer["coin"]
+        log.info("Huobi sell order filled.")
+
+        # Cover binance short hedge.
+        with self.phases.phase("hedge_cover", exchange="Binance", symbol=coin, quantity=self.futures_quantity):
+            order = self.trader.binance_client.futures_create_order(
+                symbol=coin+"USDT",
+                side=SIDE_BUY,
+                type=ORDER_TYPE_MARKET,
+                quantity=self.futures_quantity
+            )
+
+        log.info("Upbit to Huobi complete.")
+        return self.usdt_buy
+
+    # Huobi -> Binance
+    # 1. Get krw balance.
+    # 2. Buy usdt with krw.
+    # 3. Buy the return coin with usdt.( hedge needed ) EOS unless settings transfer_coins has cheaper ones.
+    # 4. Send it to binance.
+    # 5. Sell it at binance.
+    # Candidates need a usdt market with enough liquidity in Huobi, like eosusdt.
+
+    def usdt_buy(self, result=None):
+        trader = self.trader
+        self.transfer = trader.transfers.select("Huobi", "Binance", self.trade_info["Binance"]["spot_balance"])
+        self.begin_leg("huobi_to_binance", self.transfer["coin"])
+        log.info("Huobi to Binance with " + self.transfer["coin"] + ". " + str(self.transfer))
+
+        # Get krw balance.
+        krw_balance = 0
+        account_balance_list = trader.huobi_account_client.get_account_balance()
+        for balance_obj in account_balance_list[0].list:
+            if balance_obj.currency == "krw":
+                krw_balance = balance_obj.balance
+                break
+
+        # Get usdt first ask price and place a limit order their.
+        depth = trader.huobi_market_client.get_pricedepth("usdtkrw", DepthStep.STEP0, 1)
+        usdt_ask_price = depth.asks[0].price
+
+        self.usdt_quantity = float(trader.float_precision(float(krw_balance) / usdt_ask_price, 0.01))
+        # Don't leave funds in usdt when the return coin can't be bought.
+        if self.huobi_buy_price(self.transfer["coin"], self.usdt_quantity) <= 0:
+            raise TradeError("No Huobi ask for " + self.transfer["coin"] + ". Huobi to Binance not started.")
+
+        log.info("Huobi buying usdt.")
+        span = self.begin("huobi_buy", exchange="Huobi", symbol="USDT", quantity=self.usdt_quantity)
+        order_id = trader.huobi_trade_client.create_order(
+            symbol="usdtkrw",
+            account_id=trader.huobi_account_id,
+            order_type=OrderType.BUY_LIMIT,
+            amount=self.usdt_quantity,
+            source=OrderSource.API,
+            price=int(usdt_ask_price)
+        )
+
+        # Monitor until order is filled.
+        return self.watch(trader.huobi_filled_watch(order_id, self.usdt_quantity), self.usdt_bought, span)
+
+    def usdt_bought(self, order):
+        trader = self.trader
+        coin = self.transfer["coin"]
+        log.info("Huobi bought usdt.")
+        usdt_quantity = self.usdt_quantity * 0.999  # adjust market fee 0.1%
+
+        # Order at the live Huobi ask, a stale price may never fill.
+        log.info("Huobi buying " + coin + ".")
+        price = self.huobi_buy_price(coin, usdt_quantity)
+        if price <= 0:
+            raise TradeError("No Huobi ask for " + coin + ". " + str(usdt_quantity) + " USDT left on Huobi.")
+        self.return_quantity = float(trader.float_precision(usdt_quantity / price, self.transfer["precision"]))
+        span = self.begin("huobi_buy", exchange="Huobi", symbol=coin, quantity=self.return_quantity)
+        order_id = trader.huobi_trade_client.create_order(
+            symbol=coin.lower()+"usdt",
+            account_id=trader.huobi_account_id,
+            order_type=OrderType.BUY_LIMIT,
+            amount=self.return_quantity,
+            source=OrderSource.API,
+            price=price
+        )
+
+        # Monitor until order is filled.
+        return self.watch(trader.huobi_filled_watch(order_id, self.return_quantity), self.return_bought, span)
+
+    def return_bought(self, order):
+        trader = self.trader
+        coin = self.transfer["coin"]
+        fee = self.transfer["withdraw_fee"]
+        log.info("Huobi " + coin + " bought.")
+        quantity = self.return_quantity * 0.999  # Adjust market fee.
+
+        # Futures hedge short.
+        self.futures_quantity = trader.binance_hedge_short(coin, quantity, self.phases)
+
+        # Get binance deposit wallet address.
+        deposit_addr_data = trader.binance_client.get_deposit_address(asset=coin)
+
+        quantity = float(trader.float_precision(quantity - fee, self.transfer["precision"]))  # Adjust withdraw fee and precision
+
+        log.info("Huobi withdrawing " + coin + " to Binance.")
+        log.debug(coin + " quantity : "+str(quantity))
+        # Balance doesn't get updated immediately.
+        def huobi_withdraw():
+            if deposit_addr_data["addressTag"]:
+                return trader.huobi_wallet_client.post_create_withdraw(
+                    address=deposit_addr_data["address"],
+                    address_tag=deposit_addr_data["addressTag"],
+                    amount=quantity,
+                    currency=coin.lower(),
+                    fee=fee,
+                )
+            else:  # Actually you don't need this if else condition because you specify the currency.
+                return trader.huobi_wallet_client.post_create_withdraw(
+                    address=deposit_addr_data["address"],
+                    amount=quantity,
+                    currency=coin.lower(),
+                    fee=fee,
+                )
+
+        self.return_quantity = quantity
+        return self.watch(Watch("Huobi", poll=huobi_withdraw, interval=1, max_interval=10, name="Huobi withdraw"),
+                          self.return_withdraw_sent, self.begin("huobi_withdraw", exchange="Huobi", symbol=coin, quantity=quantity))
+
+    def return_withdraw_sent(self, result):
+        self.withdraw_started = time.time()
+        return self.watch(Watch(
+            "Huobi",
+            poll=lambda: self.trader.huobi_wallet_client.get_deposit_withdraw(
+                op_type=DepositWithdraw.WITHDRAW,
+                currency=self.transfer["coin"].lower(),
+                size=1,
+                direct=QueryDirection.NEXT
+            ),
+            done=lambda list_obj: list_obj if list_obj[0].state == "confirmed" else None,
+            interval=5, min_interval=2, max_interval=60, backoff=1.2,
+            expected_at=self.expected_at("Huobi", "Binance", self.transfer["coin"]),
+            name="Huobi withdraw status"
+        ), self.return_withdrawn, self.begin("huobi_withdraw_confirm", exchange="Huobi", symbol=self.transfer["coin"]), delay=5)
+
+    def return_withdrawn(self, result):
+        trader = self.trader
+        coin = self.transfer["coin"]
+        log.info("Huobi withdraw complete.")
+        log.info(self.return_quantity)
+        trader.record_transfer("Huobi", "Binance", coin, time.time() - self.withdraw_started)
+
+        step_size = trader.metadata.spot_step_size(coin)
+
+        quantity = float(trader.binance_client.get_asset_balance(asset=coin)["free"])
+        quantity = trader.float_precision(quantity, step_size)
+
+        log.info(quantity)
+
+        with self.phases.phase("binance_sell", exchange="Binance", symbol=coin, quantity=quantity):
+            order = trader.binance_client.order_market_sell(symbol=coin+"USDT", quantity=quantity)
+
+        log.info("Binance sell executed")
+
+        with self.phases.phase("hedge_cover", exchange="Binance", symbol=coin, quantity=self.futures_quantity):
+            order = trader.binance_client.futures_create_order(
+                symbol=coin+"USDT",
+                side=SIDE_BUY,
+                type=ORDER_TYPE_MARKET,
+                quantity=self.futures_quantity
+            )
+
+        futures_balance = trader.binance_client.futures_account_balance()[1]
+        if futures_balance["balance"] != futures_balance["withdrawAvailable"]:
+            raise TradeError("Maybe their is futures position left in binance.")
+
+        with self.phases.phase("futures_transfer", exchange="Binance", symbol="USDT", quantity=futures_balance["balance"]):
+            trader.binance_client.futures_account_transfer(
+                asset="USDT",
+                amount=futures_balance["balance"],
+                type=2
+            )
+
+        log.info("Huobi to Binance done")
+        return None
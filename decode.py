@@ -0,0 +1,109 @@
+import json
+import zlib
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def get_loads(backend="ujson"):
+    """
+    json loads function of backend. Falls back to standard json when backend is not installed.
+    """
+    if backend == "orjson" and orjson:
+        return orjson.loads
+    if backend == "ujson" and ujson:
+        return ujson.loads
+    return json.loads
+
+
+def gunzip(message):
+    # wbits 31 reads gzip header. Cheaper than gzip.decompress which wraps the data in a GzipFile.
+    return zlib.decompress(message, 31)
+
+
+class FieldExtractor:
+    """
+    Pulls a few top level fields out of a flat json message without parsing the rest.
+
+    1. Looks for '"key":' in the raw message.
+    2. String values are returned as str, numbers as float.
+        Anything else such as null, true, false or a nested value is returned as None.
+    3. Returns None when a key is missing so caller can fall back to full json parsing.
+    """
+    def __init__(self, keys):
+        self.keys = tuple(keys)
+        self.needles = [('"' + key + '":').encode() for key in self.keys]
+        self.str_needles = [('"' + key + '":') for key in self.keys]
+
+    def extract(self, message):
+        if isinstance(message, str):
+            needles = self.str_needles
+            quote, ends = '"', ',}'
+        else:
+            needles = self.needles
+            quote, ends = b'"', (b',', b'}')
+
+        values = []
+        for needle in needles:
+            i = message.find(needle)
+            if i < 0:
+                return None
+            i += len(needle)
+            if message[i:i+1] == quote:
+                j = message.find(quote, i + 1)
+                value = message[i+1:j]
+                values.append(value if isinstance(value, str) else value.decode())
+            else:
+                j = message.find(ends[0], i)
+                k = message.find(ends[1], i)
+                if j < 0 or (0 <= k < j):
+                    j = k
+                try:
+                    values.append(float(message[i:j]))
+                except ValueError:
+                    values.append(None)
+        return values
+
+
+class Decoder:
+    """
+    Message decoder of one feed.
+
+    1. Without fields decode(message) returns the parsed dict.
+    2. With fields it returns a list of field values in the order of fields.
+        Returns None for messages without every field such as subscription replies or errors,
+        and for messages where a field is null or not a number or string. Handlers use every field as is.
+    3. With extract, fields are pulled out by FieldExtractor and the message is fully parsed only when it misses.
+        Pays off on long messages like Upbit ticker. Short ones like Binance aggTrade are faster with the json backend.
+    """
+    def __init__(self, backend="ujson", fields=None, extract=False, gzip=False):
+        self.loads = get_loads(backend)
+        self.fields = tuple(fields) if fields else None
+        self.extractor = FieldExtractor(fields) if fields and extract else None
+        self.gzip = gzip
+
+    def decode(self, message):
+        if self.gzip:
+            message = gunzip(message)
+
+        if self.fields is None:
+            return self.loads(message)
+
+        if self.extractor:
+            values = self.extractor.extract(message)
+            if values is not None:
+                # Full parse would give the same null.
+                return None if None in values else values
+
+        data = self.loads(message)
+        if not isinstance(data, dict) or any(key not in data for key in self.fields):
+            return None
+        values = [data[key] for key in self.fields]
+        return None if None in values else values
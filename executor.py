@@ -0,0 +1,145 @@
+import asyncio
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+log = logging.getLogger(__name__)
+
+
+class TradeError(Exception):
+    """
+    A trade can't go on, like a rejected deposit or a failed withdraw.
+    """
+
+
+class Wait:
+    """
+    Returned by a state to wait for future without holding the executor thread.
+    then(result) is the next state. It runs on the executor once future is done.
+    span is passed back to Machine.waited, so a phase can last as long as the wait.
+    """
+    def __init__(self, future, then, span=None):
+        self.future = future
+        self.then = then
+        self.span = span
+
+
+class Machine:
+    """
+    One trade as explicit states.
+
+    A state is a method taking the result of the previous one. It returns the next state to run right away,
+    a Wait, or None when the trade is done. States only make quick requests, anything slow is a Wait.
+    state, history and future can be read from any thread.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.state = None
+        self.history = []  # (state, time.time())
+        self.future = Future()
+
+    def start(self, result=None):
+        raise NotImplementedError
+
+    def run(self, state, result):
+        """
+        Runs every state. Override to wrap states in something, like a tracing span.
+        """
+        return state(result)
+
+    def waited(self, wait, error):
+        """
+        Called on the thread that completed wait.future, before the next state is queued.
+        """
+        pass
+
+    def finish(self, error=None):
+        """
+        Called once on the executor when the machine stops. error is None on success.
+        """
+        pass
+
+
+class TradeExecutor(threading.Thread):
+    """
+    Runs Machines on a background thread so price monitoring never waits for a trade.
+
+    1. One machine at a time. submit() returns None while one is running.
+    2. Waits are callbacks on futures, mostly PollScheduler watches, so nothing sleeps while funds move.
+    3. A machine that raises stops the executor too, funds or hedges could be left anywhere.
+        halted holds the reason and submit() refuses new machines until resume().
+    """
+    def __init__(self):
+        super().__init__(daemon=True, name="trade executor")
+        self.queue = queue.Queue()
+        self.current = None
+        self.halted = None
+
+    def busy(self):
+        return self.current is not None and not self.current.future.done()
+
+    def submit(self, machine):
+        if self.halted or self.busy():
+            return None
+        self.current = machine
+        self.queue.put((machine, machine.start, None))
+        return machine.future
+
+    def resume(self):
+        """
+        Accept machines again after a failure was dealt with by hand.
+        """
+        self.halted = None
+
+    def stop(self):
+        self.queue.put(None)
+
+    def run(self):
+        # Huobi AccountClient.get_account_balance runs its requests on the event loop of the calling thread.
+        asyncio.set_event_loop(asyncio.new_event_loop())
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            self.step(*item)
+
+    def step(self, machine, state, result):
+        while state is not None:
+            machine.state = state.__name__
+            machine.history.append((machine.state, time.time()))
+            try:
+                state = machine.run(state, result)
+            except Exception as e:
+                self.fail(machine, e)
+                return
+            result = None
+
+            if isinstance(state, Wait):
+                state.future.add_done_callback(lambda future, wait=state: self.wake(machine, wait, future))
+                return
+
+        machine.state = "done"
+        machine.finish()
+        machine.future.set_result(machine.history)
+
+    def wake(self, machine, wait, future):
+        # Runs on the thread that completed the future, so only hand the result over to the executor.
+        error = future.exception()
+        machine.waited(wait, error)
+        if error is None:
+            self.queue.put((machine, wait.then, future.result()))
+        else:
+            def failed_wait(result):
+                raise error
+            failed_wait.__name__ = wait.then.__name__
+            self.queue.put((machine, failed_wait, None))
+
+    def fail(self, machine, error):
+        log.error(machine.name + " failed in " + machine.state + " : " + repr(error))
+        self.halted = machine.name + " " + machine.state + " : " + repr(error)
+        try:
+            machine.finish(error)
+        finally:
+            machine.future.set_exception(error)
@@ -0,0 +1,99 @@
+import asyncio
+import logging
+import random
+import threading
+
+import websockets
+
+log = logging.getLogger(__name__)
+
+
+class FeedManager(threading.Thread):
+    """
+    Runs every exchange feed as a coroutine on one asyncio event loop.
+
+    1. Feeds are ws.Client objects. Only url, subscription() and dispatch() are used, their own thread is never started.
+    2. Websocket ping/pong is done by the websockets library. Exchange level ping like Huobi is answered by handle().
+    3. Dropped connections are reconnected with exponential backoff and full jitter.
+        subscription() is sent again and on_resubscribe(feed) is called after every reconnect.
+    """
+    def __init__(self, feeds, on_resubscribe=None, ping_interval=20, ping_timeout=20, min_backoff=0.5, max_backoff=30):
+        super().__init__(daemon=True)
+
+        self.feeds = feeds
+        self.on_resubscribe = on_resubscribe
+        self.ping_interval = ping_interval
+        self.ping_timeout = ping_timeout
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+
+        self.loop = None
+        self.running = True
+
+    def run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self.main())
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.loop.close()
+
+    def stop(self):
+        self.running = False
+        if self.loop:
+            for task in asyncio.all_tasks(self.loop):
+                self.loop.call_soon_threadsafe(task.cancel)
+
+    async def main(self):
+        await asyncio.gather(*[self.run_feed(feed) for feed in self.feeds])
+
+    async def run_feed(self, feed):
+        backoff = self.min_backoff
+        first = True
+
+        while self.running:
+            try:
+                async with websockets.connect(
+                    feed.url,
+                    ping_interval=self.ping_interval,
+                    ping_timeout=self.ping_timeout,
+                    max_size=None
+                ) as conn:
+                    log.info("Connected to " + feed.exchange)
+                    backoff = self.min_backoff
+                    feed.close_hook = lambda: self.loop.call_soon_threadsafe(asyncio.ensure_future, conn.close())
+
+                    for params in feed.subscription():
+                        await conn.send(params)
+                    if not first and self.on_resubscribe:
+                        self.on_resubscribe(feed)
+                    first = False
+
+                    async for message in conn:
+                        # A message that fails to handle is logged and skipped like on ws.Client,
+                        # where websocket-client passes the error to on_error and keeps the connection.
+                        try:
+                            reply = feed.dispatch(message)
+                        except Exception as e:
+                            log.error(feed.exchange + " message error : " + repr(e))
+                            continue
+                        if reply:
+                            await conn.send(reply)
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.error(feed.exchange + " feed error : " + repr(e))
+            finally:
+                feed.close_hook = None
+
+            if not self.running or not getattr(feed, "running", True):
+                break
+
+            # Full jitter so feeds dropped together don't reconnect together.
+            delay = random.uniform(0, backoff)
+            backoff = min(backoff * 2, self.max_backoff)
+            log.warning(feed.exchange + " feed closed. Reconnecting in " + str(round(delay, 2)) + "s")
+            await asyncio.sleep(delay)
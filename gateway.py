@@ -0,0 +1,158 @@
+import asyncio
+import functools
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from requests.adapters import HTTPAdapter
+
+from huobi.constant import *
+
+log = logging.getLogger(__name__)
+
+
+def set_thread_loop():
+    # Huobi AccountClient.get_account_balance runs its requests on the event loop of the calling thread,
+    # so every pool thread has its own. Same as executor.TradeExecutor.run.
+    asyncio.set_event_loop(asyncio.new_event_loop())
+
+
+class ExchangeGateway:
+    """
+    Awaitable versions of the REST calls Trader makes to Binance, Upbit and Huobi.
+
+    1. SDK clients are blocking, so calls run on a shared thread pool and are awaited on the gateway event loop.
+        The loop runs on its own thread and never blocks the price monitoring thread.
+    2. Binance and Upbit sessions get a connection pool at least as large as the thread pool,
+        so concurrent calls reuse kept-alive connections instead of opening new ones.
+        Upbit keeps its own pool of upbit_pool_size when that is larger.
+    3. Sync code runs several calls at once with gather(). ex)
+        info, futures, balance = gateway.gather(
+            gateway.binance_account(),
+            gateway.binance_futures_balance(),
+            gateway.binance_balance("USDT")
+        )
+    """
+    def __init__(self, binance_client, upbit_client, huobi_wallet_client, huobi_account_client,
+                 huobi_trade_client, huobi_market_client, huobi_account_id, max_workers=8):
+        self.binance_client = binance_client
+        self.upbit_client = upbit_client
+        self.huobi_wallet_client = huobi_wallet_client
+        self.huobi_account_client = huobi_account_client
+        self.huobi_trade_client = huobi_trade_client
+        self.huobi_market_client = huobi_market_client
+        self.huobi_account_id = huobi_account_id
+
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=max_workers)
+        self.binance_client.session.mount("https://", adapter)
+        self.binance_client.session.mount("http://", adapter)
+        if self.upbit_client.pool_size < max_workers:
+            self.upbit_client.resize_pool(max_workers)
+
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="gateway",
+                                           initializer=set_thread_loop)
+        self.loop = asyncio.new_event_loop()
+        self.loop.set_default_executor(self.executor)
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.executor.shutdown(wait=False)
+
+    async def call(self, func, *args, **kwargs):
+        return await self.loop.run_in_executor(None, functools.partial(func, *args, **kwargs))
+
+    def submit(self, coro):
+        """
+        Schedule coro on the gateway loop from sync code. Returns concurrent.futures.Future.
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def gather(self, *coros):
+        """
+        Run coros concurrently and block until all are done. Results are in the order of coros.
+        """
+        async def _gather():
+            return await asyncio.gather(*coros)
+        return self.submit(_gather()).result()
+
+    # Binance
+    async def binance_account(self):
+        return await self.call(self.binance_client.get_account)
+
+    async def binance_futures_balance(self):
+        return await self.call(self.binance_client.futures_account_balance)
+
+    async def binance_balance(self, asset):
+        return await self.call(self.binance_client.get_asset_balance, asset=asset)
+
+    async def binance_order(self, symbol, side, quantity):
+        func = self.binance_client.order_market_buy if side == "BUY" else self.binance_client.order_market_sell
+        return await self.call(func, symbol=symbol, quantity=quantity)
+
+    async def binance_futures_order(self, **kwargs):
+        return await self.call(self.binance_client.futures_create_order, **kwargs)
+
+    async def binance_deposit_address(self, asset):
+        return await self.call(self.binance_client.get_deposit_address, asset=asset)
+
+    async def binance_withdraw(self, **kwargs):
+        return await self.call(self.binance_client.withdraw, **kwargs)
+
+    async def binance_withdraw_status(self, asset):
+        return await self.call(self.binance_client.get_withdraw_history, asset=asset)
+
+    async def binance_depth(self, symbol, limit=5):
+        return await self.call(self.binance_client.get_order_book, symbol=symbol, limit=limit)
+
+    # Upbit
+    async def upbit_order(self, **kwargs):
+        return await self.call(self.upbit_client.order, **kwargs)
+
+    async def upbit_order_status(self, trade_uuid):
+        return await self.call(self.upbit_client.check_order, trade_uuid)
+
+    async def upbit_accounts(self):
+        return await self.call(self.upbit_client.accounts)
+
+    async def upbit_deposit_address(self, currency):
+        return await self.call(self.upbit_client.generate_coin_addr, currency)
+
+    async def upbit_withdraw(self, **kwargs):
+        return await self.call(self.upbit_client.withdraw, **kwargs)
+
+    async def upbit_withdraw_status(self, withdraw_uuid):
+        return await self.call(self.upbit_client.check_withdraw, withdraw_uuid)
+
+    async def upbit_deposit_status(self, currency, txid):
+        return await self.call(self.upbit_client.deposits, currency, txid)
+
+    # Huobi
+    async def huobi_order(self, **kwargs):
+        return await self.call(self.huobi_trade_client.create_order, account_id=self.huobi_account_id, **kwargs)
+
+    async def huobi_order_status(self, order_id):
+        return await self.call(self.huobi_trade_client.get_order, order_id=order_id)
+
+    async def huobi_balance(self):
+        return await self.call(self.huobi_account_client.get_account_balance)
+
+    async def huobi_deposit_address(self, currency):
+        return await self.call(self.huobi_wallet_client.get_account_deposit_address, currency=currency)
+
+    async def huobi_withdraw(self, **kwargs):
+        return await self.call(self.huobi_wallet_client.post_create_withdraw, **kwargs)
+
+    async def huobi_withdraw_status(self, currency):
+        return await self.call(
+            self.huobi_wallet_client.get_deposit_withdraw,
+            op_type=DepositWithdraw.WITHDRAW,
+            currency=currency,
+            size=1,
+            direct=QueryDirection.NEXT
+        )
+
+    async def huobi_depth(self, symbol, depth=1):
+        return await self.call(self.huobi_market_client.get_pricedepth, symbol, DepthStep.STEP0, depth)
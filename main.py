@@ -1,3 +1,4 @@
+import sys
 import threading
 import time
 import json
@@ -11,15 +12,24 @@ logging.basicConfig(
 )
 
 from binance.exceptions import BinanceAPIException, BinanceWithdrawException
-from ws import BinanceWS, UpbitWS, HuobiWS
+from ws import BinanceShards, BinanceDepthWS, UpbitWS, HuobiWS, binance_depth_snapshot
 from trader import Trader
+from feed import FeedManager
+from prices import PriceStore
+from book import BookStore
+from recorder import TickRecorder
+from ring import FeedProcesses
+from shared_feed import SharedFeedClient
+from stream import PremiumStream
+from metrics import registry
 
 log = logging.getLogger(__name__)
 
 
 def get_settings():
     # IOTA removed due to wallet condition
-    setting_file = "./settings.json"
+    # python main.py [settings.json], so several Traders can run from one directory.
+    setting_file = sys.argv[1] if len(sys.argv) > 1 else "./settings.json"
 
     try:
         with open(setting_file, "r") as f:
@@ -31,8 +41,8 @@ def get_settings():
     return setting_data
 
 
-def get_usd_krw():
-    url = 'https://krapi-aws.huobi.pro/market/trade?symbol=usdtkrw'
+def get_usd_krw(base_url="https://krapi-aws.huobi.pro"):
+    url = base_url + '/market/trade?symbol=usdtkrw'
     data = requests.get(url).json()
 
     if data["status"] != "ok":
@@ -41,54 +51,137 @@ def get_usd_krw():
     return data["tick"]["data"][0]["price"]
 
 
-def init_prices(cur_prices, settings):
-    market_list = settings["market_list"]
-    for i in range(len(market_list)):
-        cur_prices["Upbit"]["KRW-"+market_list[i]] = 0
-        cur_prices["Binance"][market_list[i]+"USDT"] = 0
-    cur_prices["Huobi"]["usdt"] = get_usd_krw()
+def init_prices(prices, settings):
+    # Every symbol slot starts at 0 until its feed sends the first price, or at a stale price with warm_start_file.
+    try:
+        prices.set_usdt(get_usd_krw(settings.get("huobi_url", "https://krapi-aws.huobi.pro")))
+    except Exception as e:
+        # HuobiWS sets it with the first trade anyway.
+        log.error("Failed to get usdt price : " + repr(e))
 
 
 if __name__ == '__main__':
     settings = get_settings()
 
-    cur_prices = {
-        "Binance": {},
-        "Upbit": {},
-        "Huobi": {}
-    }
+    prices = PriceStore(settings["market_list"])
 
-    init_prices(cur_prices, settings)
+    # Runs while Trader makes its clients.
+    threading.Thread(target=init_prices, args=(prices, settings), daemon=True).start()
 
-    try:
-        binance_ws = BinanceWS(
-            exchange="Binance",
-            cur_prices=cur_prices,
-            settings=settings
-        )
+    # Order books for executable premium. Off unless settings orderbook is true.
+    books = None
+    if settings.get("orderbook", False):
+        books = BookStore(settings["market_list"])
+        books.fetch_snapshot = lambda symbol: binance_depth_snapshot(
+            books, symbol, settings.get("binance_url", "https://api.binance.com"))
 
-        upbit_ws = UpbitWS(
-            exchange="Upbit",
-            cur_prices=cur_prices,
-            settings=settings
-        )
+    # Latency histograms over http://127.0.0.1:<metrics_port>/metrics and in the log every metrics_interval seconds.
+    if settings.get("metrics_port"):
+        registry.start_server(settings["metrics_port"])
+    registry.start_reporter(settings.get("metrics_interval", 60))
 
-        huobi_ws = HuobiWS(
-            cur_prices=cur_prices,
-        )
+    # Every received tick goes to settings record_dir when set. See recorder.read_ticks.
+    recorder = None
+    if settings.get("record_dir"):
+        recorder = TickRecorder(settings["record_dir"], settings["market_list"])
 
+    try:
         trader = Trader(
-            cur_prices=cur_prices,
-            settings=settings
+            prices=prices,
+            settings=settings,
+            books=books
         )
 
-        huobi_ws.start()
-        binance_ws.start()
-        upbit_ws.start()
+        # Premium and prices for dashboards over http://127.0.0.1:<stream_port>/snapshot and ws://127.0.0.1:<stream_port + 1>.
+        # Read from prices on its own thread, Trader never waits on it.
+        if settings.get("stream_port"):
+            PremiumStream(prices, max_age=trader.MAX_PRICE_AGE, interval=settings.get("stream_interval", 0.2)).start(
+                settings["stream_port"], settings.get("stream_ws_port"))
+
+        # In event driven mode every price update recomputes its symbol right away.
+        event_driven = settings.get("event_driven", False)
+        on_update = trader.on_price if event_driven else None
+
+        # With feed_processes every ticker feed runs in its own process and reaches prices through shared memory.
+        # Upbit stays here when orderbook is on, its books live in this process.
+        # With shared_feed prices come from a shared_feed.py process that every Trader on this host reads,
+        # so nothing but Upbit and Binance depth for books connects to the exchanges here.
+        feed_processes = None
+        if settings.get("shared_feed"):
+            if recorder:
+                log.warning("record_dir is ignored for feeds of shared_feed")
+            feed_processes = SharedFeedClient(settings["shared_feed"], prices, on_update,
+                                              poll_interval=settings.get("ring_poll_interval", 0.0002))
+            feed_processes.start()
+        elif settings.get("feed_processes", False):
+            exchanges = ["Binance", "Huobi"] + ([] if books else ["Upbit"])
+            if recorder:
+                log.warning("record_dir is ignored for feeds in feed processes")
+            feed_processes = FeedProcesses(exchanges, settings, prices, on_update)
+            feed_processes.start()
+
+        feeds = []
+        threads = []
+        if not feed_processes:
+            # Binance streams are split across several connections.
+            binance_shards = BinanceShards(
+                prices=prices,
+                settings=settings,
+                on_update=on_update,
+                recorder=recorder
+            )
+            feeds.append(binance_shards)
+
+            huobi_ws = HuobiWS(
+                prices=prices,
+                on_update=on_update,
+                json_backend=settings.get("json_backend", "ujson"),
+                recorder=recorder,
+                url=settings.get("huobi_ws_url")
+            )
+            threads.append(huobi_ws)
+
+        if not feed_processes or books:
+            # Upbit tickers of shared_feed come from its ring, so only books are subscribed here.
+            # Otherwise both would write the same slots of prices.
+            upbit_ws = UpbitWS(
+                exchange="Upbit",
+                prices=prices,
+                settings=settings,
+                on_update=on_update,
+                books=books,
+                recorder=recorder,
+                tickers=not settings.get("shared_feed")
+            )
+            threads.append(upbit_ws)
+
+        if books:
+            depth_shards = BinanceShards(
+                prices=prices,
+                settings=settings,
+                ws_class=BinanceDepthWS,
+                books=books
+            )
+            feeds.append(depth_shards)
+
+        if settings.get("async_feeds", False):
+            # One event loop for every feed instead of one thread per exchange.
+            feed_manager = FeedManager(threads + [shard for shards in feeds for shard in shards.shards])
+            feed_manager.start()
+            for shards in feeds:
+                shards.start_rebalance()
+        else:
+            for shards in feeds:
+                shards.start()
+            for thread in threads:
+                thread.start()
 
         while True:
-            time.sleep(1)
-            trader.monitor()
+            if event_driven:
+                trader.monitor_event()
+            else:
+                time.sleep(1)
+                trader.monitor()
 
     except BinanceAPIException as e:
         print(e)
@@ -0,0 +1,142 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger(__name__)
+
+
+def get_filter(symbol_info, filter_type):
+    for f in symbol_info["filters"]:
+        if f["filterType"] == filter_type:
+            return f
+    return {}
+
+
+class MetadataIndex:
+    """
+    Binance symbol filters and precisions kept in memory.
+
+    1. Loaded in bulk from spot and futures exchange info and asset details, for market_list plus extra symbols.
+    2. Refreshed every ttl seconds on a background thread, so lookups on the trade path never go to network.
+    3. A symbol that is not in the index triggers one synchronous reload.
+    4. Tables given to restore, like a warm start snapshot, are used as they are and the first load runs in background.
+
+    spot["ADA"] looks like this
+    {"step_size": 0.1, "min_qty": 0.1, "tick_size": 0.0001, "min_notional": 10.0, "base_precision": 8}
+    futures["ADA"] looks like this
+    {"step_size": 1.0, "tick_size": 0.0001, "quantity_precision": 0, "price_precision": 4}
+    assets["ADA"] looks like this
+    {"withdraw_fee": 1.0, "min_withdraw": 2.0}
+    """
+    def __init__(self, binance_client, symbols, ttl=3600):
+        self.binance_client = binance_client
+        self.symbols = set(symbols)
+        self.ttl = ttl
+
+        self.spot = {}
+        self.futures = {}
+        self.assets = {}
+        self.loaded_at = 0
+
+        self.lock = threading.Lock()
+        self.running = False
+
+    def start(self):
+        delay = 0
+        if not self.loaded_at:
+            self.load()
+            delay = self.ttl
+        self.running = True
+        threading.Thread(target=self.refresh_loop, args=(delay,), daemon=True).start()
+
+    def refresh_loop(self, delay):
+        time.sleep(delay)
+        while self.running:
+            try:
+                self.load()
+            except Exception as e:
+                log.error("Metadata refresh failed : " + repr(e))
+            time.sleep(self.ttl)
+
+    def load(self):
+        # Three independent requests, so they are sent at the same time.
+        with ThreadPoolExecutor(max_workers=3, thread_name_prefix="metadata") as pool:
+            spot_future = pool.submit(self.binance_client.get_exchange_info)
+            futures_future = pool.submit(self.binance_client.futures_exchange_info)
+            assets_future = pool.submit(self.binance_client.get_asset_details)
+        spot_info = spot_future.result()
+        futures_info = futures_future.result()
+        asset_details = assets_future.result()
+
+        spot = {}
+        for info in spot_info["symbols"]:
+            if info["quoteAsset"] != "USDT" or info["baseAsset"] not in self.symbols:
+                continue
+            lot_size = get_filter(info, "LOT_SIZE")
+            spot[info["baseAsset"]] = {
+                "step_size": float(lot_size.get("stepSize", 0)),
+                "min_qty": float(lot_size.get("minQty", 0)),
+                "tick_size": float(get_filter(info, "PRICE_FILTER").get("tickSize", 0)),
+                "min_notional": float(get_filter(info, "MIN_NOTIONAL").get("minNotional", 0)),
+                "base_precision": info["baseAssetPrecision"]
+            }
+
+        futures = {}
+        for info in futures_info["symbols"]:
+            if info["quoteAsset"] != "USDT" or info["baseAsset"] not in self.symbols:
+                continue
+            futures[info["baseAsset"]] = {
+                "step_size": float(get_filter(info, "LOT_SIZE").get("stepSize", 0)),
+                "tick_size": float(get_filter(info, "PRICE_FILTER").get("tickSize", 0)),
+                "quantity_precision": info["quantityPrecision"],
+                "price_precision": info["pricePrecision"]
+            }
+
+        assets = {}
+        for asset, detail in asset_details.get("assetDetail", {}).items():
+            if asset in self.symbols:
+                assets[asset] = {
+                    "withdraw_fee": float(detail.get("withdrawFee", 0)),
+                    "min_withdraw": float(detail.get("minWithdrawAmount", 0))
+                }
+
+        with self.lock:
+            self.spot = spot
+            self.futures = futures
+            self.assets = assets
+            self.loaded_at = time.time()
+
+        log.info("Metadata loaded for " + str(len(spot)) + " symbols")
+
+    def state(self):
+        with self.lock:
+            return {"spot": self.spot, "futures": self.futures, "assets": self.assets, "loaded_at": self.loaded_at}
+
+    def restore(self, state):
+        """
+        Use tables of state() from an earlier run until the next load.
+        """
+        with self.lock:
+            self.spot = state["spot"]
+            self.futures = state["futures"]
+            self.assets = state["assets"]
+            self.loaded_at = state["loaded_at"]
+
+    def get(self, table, symbol):
+        entry = getattr(self, table).get(symbol)
+        if entry is None:
+            # New symbol in market_list. Load once instead of failing the trade.
+            self.symbols.add(symbol)
+            self.load()
+            entry = getattr(self, table)[symbol]
+        return entry
+
+    def spot_step_size(self, symbol):
+        return self.get("spot", symbol)["step_size"]
+
+    def futures_precision(self, symbol):
+        return self.get("futures", symbol)["quantity_precision"]
+
+    def withdraw_fee(self, symbol):
+        return self.get("assets", symbol)["withdraw_fee"]
@@ -0,0 +1,228 @@
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+log = logging.getLogger(__name__)
+
+QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+
+class Histogram:
+    """
+    Log linear histogram of seconds in microsecond units, like HdrHistogram.
+
+    Values under 2**sub_bits us get a bucket each. Above that every power of two is split into 2**(sub_bits-1) buckets,
+    so a bucket is never wider than 1/2**(sub_bits-1) of its value. sub_bits 7 is under 1.6% error up to highest.
+    record() is a bit_length, two shifts and a list increment under a lock.
+    """
+    def __init__(self, highest=60.0, sub_bits=7):
+        self.sub_bits = sub_bits
+        self.sub_count = 1 << sub_bits
+        self.half_count = self.sub_count >> 1
+        self.highest_us = int(highest * 1e6)
+        self.counts = [0] * (self.index(self.highest_us) + 1)
+
+        self.total = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.lock = threading.Lock()
+
+    def index(self, us):
+        if us < self.sub_count:
+            return us
+        shift = us.bit_length() - self.sub_bits
+        return self.sub_count + (shift - 1) * self.half_count + (us >> shift) - self.half_count
+
+    def value(self, index):
+        """
+        Middle of bucket index in seconds.
+        """
+        if index < self.sub_count:
+            return index / 1e6
+        j = index - self.sub_count
+        shift = j // self.half_count + 1
+        low = (j % self.half_count + self.half_count) << shift
+        return (low + (1 << shift) / 2) / 1e6
+
+    def record(self, seconds):
+        us = int(seconds * 1e6)
+        if us < self.sub_count:
+            i = us if us > 0 else 0
+        else:
+            if us > self.highest_us:
+                us = self.highest_us
+            # Same as index(), inlined for the hot path.
+            shift = us.bit_length() - self.sub_bits
+            i = self.sub_count + (shift - 1) * self.half_count + (us >> shift) - self.half_count
+        with self.lock:
+            self.counts[i] += 1
+            self.total += 1
+            self.sum += seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    def quantile(self, q):
+        with self.lock:
+            counts = list(self.counts)
+            total = self.total
+        if not total:
+            return 0.0
+        rank = q * total
+        seen = 0
+        for i, count in enumerate(counts):
+            seen += count
+            if seen >= rank and count:
+                return self.value(i)
+        return self.max
+
+    def summary(self):
+        """
+        {"count": 120, "mean_ms": 1.2, "p50_ms": 0.9, "p90_ms": 2.1, "p99_ms": 5.3, "p999_ms": 8.0, "max_ms": 9.1}
+        """
+        summary = {"count": self.total, "mean_ms": round(self.sum / self.total * 1000, 3) if self.total else 0.0}
+        for q in QUANTILES:
+            summary["p" + ("%g" % (q * 100)).replace(".", "")+"_ms"] = round(self.quantile(q) * 1000, 3)
+        summary["max_ms"] = round(self.max * 1000, 3)
+        return summary
+
+    def reset(self):
+        with self.lock:
+            self.counts = [0] * len(self.counts)
+            self.total = 0
+            self.sum = 0.0
+            self.max = 0.0
+
+
+class Metrics:
+    """
+    Named latency histograms of the whole process.
+
+    feed_latency.<exchange> : exchange event time to receive time
+    on_message.<exchange> : time in the feed handler
+    monitor : Trader premium check without the trade
+    rest.<exchange> <endpoint> : REST round trip
+    """
+    def __init__(self):
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def histogram(self, name):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(name, Histogram())
+        return histogram
+
+    def observe(self, name, seconds):
+        self.histogram(name).record(seconds)
+
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.histogram(name).record(time.perf_counter() - start)
+
+    def summary(self):
+        return {name: histogram.summary() for name, histogram in sorted(self.histograms.items())}
+
+    def prometheus(self):
+        lines = ["# TYPE latency_seconds summary"]
+        for name, histogram in sorted(self.histograms.items()):
+            label = 'name="' + name.replace('"', "'") + '"'
+            for q in QUANTILES:
+                lines.append("latency_seconds{%s,quantile=\"%g\"} %.6f" % (label, q, histogram.quantile(q)))
+            lines.append("latency_seconds_sum{%s} %.6f" % (label, histogram.sum))
+            lines.append("latency_seconds_count{%s} %d" % (label, histogram.total))
+        return "\n".join(lines) + "\n"
+
+    def start_server(self, port, host="127.0.0.1"):
+        """
+        GET /metrics in Prometheus text format and /metrics.json as summary().
+        """
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                path = urlparse(self.path).path
+                if path == "/metrics":
+                    body, content_type = metrics.prometheus().encode(), "text/plain; version=0.0.4"
+                elif path == "/metrics.json":
+                    body, content_type = json.dumps(metrics.summary()).encode(), "application/json"
+                else:
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True, name="metrics").start()
+        log.info("Metrics on http://" + host + ":" + str(port) + "/metrics")
+        return server
+
+    def start_reporter(self, interval=60):
+        """
+        Log summary() every interval seconds.
+        """
+        def report():
+            while True:
+                time.sleep(interval)
+                for name, summary in self.summary().items():
+                    log.info("latency " + name + " : " + str(summary))
+
+        threading.Thread(target=report, daemon=True, name="metrics reporter").start()
+
+
+class TimedClient:
+    """
+    Wraps an SDK client so every method call is observed as rest.<exchange> <method>.
+    For clients without a request hook like the Huobi SDK.
+    """
+    def __init__(self, client, exchange, metrics):
+        self._client = client
+        self._prefix = "rest." + exchange + " "
+        self._metrics = metrics
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if not callable(attr):
+            return attr
+
+        histogram = self._metrics.histogram(self._prefix + name)
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return attr(*args, **kwargs)
+            finally:
+                histogram.record(time.perf_counter() - start)
+
+        return timed
+
+
+def requests_hook(exchange, metrics):
+    """
+    requests response hook observing rest.<exchange> <METHOD> <path> with time to response headers.
+    """
+    def hook(response, *args, **kwargs):
+        endpoint = response.request.method + " " + urlparse(response.url).path
+        metrics.observe("rest." + exchange + " " + endpoint, response.elapsed.total_seconds())
+
+    return hook
+
+
+# Process wide registry. Recording is cheap enough to stay on, the server and reporter are started by main.py.
+registry = Metrics()
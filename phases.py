@@ -0,0 +1,147 @@
+import itertools
+import json
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+log = logging.getLogger(__name__)
+
+
+class SpanSink:
+    """
+    Appends finished spans to path as JSON lines. See trace_report.py.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "a", buffering=1)
+        self.lock = threading.Lock()
+
+    def write(self, span):
+        line = json.dumps(span) + "\n"
+        with self.lock:
+            self.file.write(line)
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+class PhaseTimer:
+    """
+    Wall clock time of each phase of one arbitrage cycle, and its spans for tracing.
+
+    started is when the premium was detected, so mark() gives time from detection.
+    Phases may run at the same time on different threads. A phase inside another phase on the
+    same thread becomes its child span. Every finished span goes to sink with the cycle's trace_id.
+
+    A span looks like this
+    {"trace_id": "9f1c2a7d0b3e4f51", "span_id": 3, "parent_id": 1, "name": "binance_withdraw_confirm",
+     "start": 1616044462.1, "end": 1616044790.4, "duration": 328.3, "symbol": "ADA", "exchange": "Binance"}
+    """
+    def __init__(self, name, started=None, sink=None, **attrs):
+        self.name = name
+        self.started = started or time.time()
+        self.sink = sink
+        self.attrs = attrs
+
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.ids = itertools.count(1)
+        self.local = threading.local()
+
+        self.phases = []  # (name, start, end)
+        self.marks = {}
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name, **attrs):
+        """
+        Yields attrs, so attributes known only inside the phase can be added. ex) span["quantity"] = 10
+        """
+        span = self.begin(name, **attrs)
+        try:
+            with self.within(span):
+                yield span["attrs"]
+        except BaseException as e:
+            span["error"] = repr(e)
+            raise
+        finally:
+            self.end(span)
+
+    def begin(self, name, parent_id=None, **attrs):
+        """
+        Start a span that ends with end(span), for phases that don't fit in one with block like a wait
+        in executor.TradeExecutor. Parent is the innermost phase of this thread unless parent_id is given.
+        """
+        if parent_id is None:
+            stack = self.local.__dict__.get("stack")
+            parent_id = stack[-1] if stack else 0
+        return {"name": name, "span_id": next(self.ids), "parent_id": parent_id, "start": time.time(),
+                "attrs": attrs, "error": None}
+
+    def end(self, span, error=None):
+        end = time.time()
+        error = error or span["error"]
+        with self.lock:
+            self.phases.append((span["name"], span["start"], end))
+        if error:
+            span["attrs"]["error"] = error
+        self.emit(span["name"], span["span_id"], span["parent_id"], span["start"], end, span["attrs"])
+
+    @contextmanager
+    def within(self, span):
+        """
+        Phases of this thread inside the block become children of span from begin().
+        """
+        stack = self.local.__dict__.setdefault("stack", [])
+        stack.append(span["span_id"])
+        try:
+            yield span["attrs"]
+        finally:
+            stack.pop()
+
+    def emit(self, name, span_id, parent_id, start, end, attrs):
+        if self.sink is None:
+            return
+        span = {
+            "trace_id": self.trace_id, "span_id": span_id, "parent_id": parent_id, "name": name,
+            "start": start, "end": end, "duration": round(end - start, 6)
+        }
+        span.update(attrs)
+        try:
+            self.sink.write(span)
+        except Exception as e:
+            # Tracing never stops a trade.
+            log.error("Span write failed : " + repr(e))
+
+    def mark(self, name):
+        """
+        Record a milestone, like both positions being on.
+        """
+        self.marks[name] = time.time() - self.started
+
+    def summary(self):
+        """
+        {"prepare": 0.81, "spot_buy_and_hedge": 0.12, "since_detect:hedged": 1.05}
+        Phases that ran more than once are summed.
+        """
+        summary = {}
+        with self.lock:
+            for name, start, end in self.phases:
+                summary[name] = round(summary.get(name, 0) + end - start, 3)
+        summary.update({"since_detect:" + name: round(t, 3) for name, t in self.marks.items()})
+        summary["total"] = round(time.time() - self.started, 3)
+        return summary
+
+    def finish(self):
+        """
+        Write the root span of the whole cycle and log the summary.
+        """
+        attrs = dict(self.attrs)
+        attrs.update({"mark:" + name: round(t, 6) for name, t in self.marks.items()})
+        self.emit(self.name, 0, None, self.started, time.time(), attrs)
+        self.log()
+
+    def log(self):
+        log.info(self.name + " " + self.trace_id + " phase timing : " + str(self.summary()))
@@ -0,0 +1,95 @@
+import heapq
+import threading
+
+
+def calc_premium(u_price, b_price, usdt_price):
+    """
+    Premium of upbit price over binance price in percent.
+    Positive when upbit is more expensive, negative for reverse premium.
+    """
+    b_krw = b_price * usdt_price
+    if u_price >= b_krw:
+        return round(u_price / b_krw * 100 - 100, 3)
+    else:
+        return round(100 - b_krw / u_price * 100, 3)
+
+
+class PremiumBook:
+    """
+    Keeps premium of every symbol with a max heap and a min heap.
+
+    1. update() pushes the new value to both heaps and bumps the symbol version.
+    2. Old entries are dropped lazily when they reach the top of a heap.
+    3. Heaps are rebuilt when stale entries pile up, so memory stays bounded.
+    """
+    def __init__(self, symbols):
+        self.symbols = list(symbols)
+        self.values = {}
+        self.versions = dict.fromkeys(self.symbols, 0)
+
+        self.max_heap = []  # (-premium, version, symbol)
+        self.min_heap = []  # (premium, version, symbol)
+        self.lock = threading.Lock()
+
+    def update(self, symbol, premium):
+        with self.lock:
+            version = self.versions[symbol] + 1
+            self.versions[symbol] = version
+            self.values[symbol] = premium
+
+            heapq.heappush(self.max_heap, (-premium, version, symbol))
+            heapq.heappush(self.min_heap, (premium, version, symbol))
+
+            if len(self.max_heap) > 4 * len(self.symbols) + 16:
+                self._rebuild()
+
+    def update_all(self, premiums):
+        """
+        Replace every premium at once. Used when usdt price changes and all symbols move.
+        Symbols missing from premiums are removed, like stale ones left out by PriceSnapshot.premium_data.
+        premiums looks like {'ADA': 4.2, 'ATOM': 4.033}
+        """
+        with self.lock:
+            for symbol in self.values.keys() - premiums.keys():
+                self.versions[symbol] += 1
+            for symbol in premiums:
+                self.versions[symbol] += 1
+            self.values = dict(premiums)
+            self._rebuild()
+
+    def remove(self, symbol):
+        with self.lock:
+            self.versions[symbol] += 1
+            self.values.pop(symbol, None)
+
+    def max(self):
+        """
+        Returns (symbol, premium) with maximum premium or None.
+        """
+        with self.lock:
+            return self._top(self.max_heap, -1)
+
+    def min(self):
+        """
+        Returns (symbol, premium) with minimum premium or None.
+        """
+        with self.lock:
+            return self._top(self.min_heap, 1)
+
+    def as_dict(self):
+        with self.lock:
+            return dict(self.values)
+
+    def _top(self, heap, sign):
+        while heap:
+            premium, version, symbol = heap[0]
+            if self.versions[symbol] == version and symbol in self.values:
+                return symbol, premium * sign
+            heapq.heappop(heap)
+        return None
+
+    def _rebuild(self):
+        self.max_heap = [(-p, self.versions[s], s) for s, p in self.values.items()]
+        self.min_heap = [(p, self.versions[s], s) for s, p in self.values.items()]
+        heapq.heapify(self.max_heap)
+        heapq.heapify(self.min_heap)
@@ -0,0 +1,314 @@
+import threading
+import time
+
+import numpy as np
+
+from recorder import UPBIT, BINANCE, HUOBI
+
+
+class PriceStore:
+    """
+    Symbol indexed price store shared by feed threads and Trader.
+
+    1. Every symbol of market_list gets a fixed slot. Feeds write into the slot with set_upbit and set_binance.
+    2. Each price is kept with its exchange event time and local receive time in seconds.
+    3. Writers are serialized by a lock and bump seq before and after writing (seqlock).
+        Readers never take the lock. They copy and retry when seq was odd or has changed.
+    4. index maps "ADA", "KRW-ADA" and "ADAUSDT" to the same slot so feeds don't build keys.
+    """
+    def __init__(self, market_list):
+        self.market_list = list(market_list)
+        n = len(self.market_list)
+
+        self.index = {}
+        for i, symbol in enumerate(self.market_list):
+            self.index[symbol] = i
+            self.index["KRW-"+symbol] = i
+            self.index[symbol+"USDT"] = i
+
+        self.upbit = np.zeros(n)
+        self.upbit_event_ts = np.zeros(n)
+        self.upbit_recv_ts = np.zeros(n)
+
+        self.binance = np.zeros(n)
+        self.binance_event_ts = np.zeros(n)
+        self.binance_recv_ts = np.zeros(n)
+
+        # usdt price of Huobi. [price, event_ts, recv_ts]
+        self.usdt = np.zeros(3)
+
+        self.seq = 0
+        self.write_lock = threading.Lock()
+
+    def set_upbit(self, code, price, event_ts=0.0):
+        # ex) code = KRW-ADA
+        i = self.index.get(code)
+        if i is None:
+            return None
+
+        recv_ts = time.time()
+        with self.write_lock:
+            self.seq += 1
+            self.upbit[i] = price
+            self.upbit_event_ts[i] = event_ts
+            self.upbit_recv_ts[i] = recv_ts
+            self.seq += 1
+        return i
+
+    def set_binance(self, symbol, price, event_ts=0.0):
+        # ex) symbol = ADAUSDT
+        i = self.index.get(symbol)
+        if i is None:
+            return None
+
+        recv_ts = time.time()
+        with self.write_lock:
+            self.seq += 1
+            self.binance[i] = price
+            self.binance_event_ts[i] = event_ts
+            self.binance_recv_ts[i] = recv_ts
+            self.seq += 1
+        return i
+
+    def set_usdt(self, price, event_ts=0.0):
+        recv_ts = time.time()
+        with self.write_lock:
+            self.seq += 1
+            self.usdt[0] = price
+            self.usdt[1] = event_ts
+            self.usdt[2] = recv_ts
+            self.seq += 1
+
+    def apply_ticks(self, ticks):
+        """
+        Write a batch of recorder.TICK_DTYPE records in one locked update. Used by ring.RingReader.
+        Symbol ids are market_list indexes and len(market_list) is usdt, same as recorder ids.
+        Returns (upbit slots, binance slots, usdt updated).
+        """
+        n = len(self.market_list)
+        if len(ticks) <= 64:
+            return self._apply_rows(ticks.tolist(), n)
+
+        exchange = ticks["exchange"]
+        in_market = ticks["symbol"] < n
+
+        # Repeated fancy index assignment has no defined winner, so keep only the last record of each slot.
+        latest = []
+        for exchange_id in (UPBIT, BINANCE):
+            batch = ticks[(exchange == exchange_id) & in_market]
+            slots, first = np.unique(batch["symbol"][::-1], return_index=True)
+            latest.append((slots, batch[len(batch) - 1 - first]))
+        (u_slots, upbit), (b_slots, binance) = latest
+        usdt = ticks[exchange == HUOBI]
+
+        with self.write_lock:
+            self.seq += 1
+            self.upbit[u_slots] = upbit["price"]
+            self.upbit_event_ts[u_slots] = upbit["event_ts"]
+            self.upbit_recv_ts[u_slots] = upbit["recv_ts"]
+            self.binance[b_slots] = binance["price"]
+            self.binance_event_ts[b_slots] = binance["event_ts"]
+            self.binance_recv_ts[b_slots] = binance["recv_ts"]
+            if len(usdt):
+                self.usdt[0] = usdt["price"][-1]
+                self.usdt[1] = usdt["event_ts"][-1]
+                self.usdt[2] = usdt["recv_ts"][-1]
+            self.seq += 1
+
+        return u_slots, b_slots, len(usdt) > 0
+
+    def _apply_rows(self, rows, n):
+        # Small batches are the usual case. A plain loop beats the mask and unique calls of apply_ticks by far.
+        u_slots = {}
+        b_slots = {}
+        usdt = False
+        with self.write_lock:
+            self.seq += 1
+            for exchange, _, symbol, _, event_ts, recv_ts, price in rows:
+                if exchange == BINANCE and symbol < n:
+                    self.binance[symbol] = price
+                    self.binance_event_ts[symbol] = event_ts
+                    self.binance_recv_ts[symbol] = recv_ts
+                    b_slots[symbol] = None
+                elif exchange == UPBIT and symbol < n:
+                    self.upbit[symbol] = price
+                    self.upbit_event_ts[symbol] = event_ts
+                    self.upbit_recv_ts[symbol] = recv_ts
+                    u_slots[symbol] = None
+                elif exchange == HUOBI:
+                    self.usdt[0] = price
+                    self.usdt[1] = event_ts
+                    self.usdt[2] = recv_ts
+                    usdt = True
+            self.seq += 1
+        return list(u_slots), list(b_slots), usdt
+
+    def state(self):
+        """
+        Prices and event times by symbol, for warmstart.WarmStart. Receive times are left out.
+        """
+        snapshot = self.snapshot()
+        return {
+            "upbit": {symbol: [float(snapshot.upbit[i]), float(snapshot.upbit_event_ts[i])] for i, symbol in enumerate(self.market_list)},
+            "binance": {symbol: [float(snapshot.binance[i]), float(snapshot.binance_event_ts[i])] for i, symbol in enumerate(self.market_list)},
+            "usdt": [float(snapshot.usdt[0]), float(snapshot.usdt[1])]
+        }
+
+    def restore(self, state):
+        """
+        Fill slots that have no price yet from state(). Symbols are matched by name, so market_list can change between runs.
+        recv_ts stays 0, so a restored price is stale until its feed writes the slot again.
+        """
+        with self.write_lock:
+            self.seq += 1
+            for prices, event_ts, saved in ((self.upbit, self.upbit_event_ts, state["upbit"]),
+                                            (self.binance, self.binance_event_ts, state["binance"])):
+                for symbol, (price, ts) in saved.items():
+                    i = self.index.get(symbol)
+                    if i is not None and prices[i] == 0:
+                        prices[i] = price
+                        event_ts[i] = ts
+            if self.usdt[0] == 0:
+                self.usdt[0], self.usdt[1] = state["usdt"]
+            self.seq += 1
+
+    def upbit_price(self, symbol):
+        return float(self.upbit[self.index[symbol]])
+
+    def binance_price(self, symbol):
+        return float(self.binance[self.index[symbol]])
+
+    def read(self, i):
+        """
+        Consistent (upbit, binance, usdt, oldest recv_ts) of one slot.
+        """
+        while True:
+            seq = self.seq
+            if seq & 1:
+                time.sleep(0)  # Writer is in the middle of an update. Let it finish.
+                continue
+            u_price = self.upbit[i]
+            b_price = self.binance[i]
+            usdt_price = self.usdt[0]
+            recv_ts = min(self.upbit_recv_ts[i], self.binance_recv_ts[i], self.usdt[2])
+            if seq == self.seq:
+                return u_price, b_price, usdt_price, recv_ts
+
+    def snapshot(self, out=None):
+        """
+        Copy every price into out, a PriceSnapshot, without allocating.
+        Pass the same out again on the hot path.
+        """
+        if out is None:
+            out = PriceSnapshot(self.market_list)
+
+        while True:
+            seq = self.seq
+            if seq & 1:
+                time.sleep(0)  # Writer is in the middle of an update. Let it finish.
+                continue
+            np.copyto(out.upbit, self.upbit)
+            np.copyto(out.upbit_event_ts, self.upbit_event_ts)
+            np.copyto(out.upbit_recv_ts, self.upbit_recv_ts)
+            np.copyto(out.binance, self.binance)
+            np.copyto(out.binance_event_ts, self.binance_event_ts)
+            np.copyto(out.binance_recv_ts, self.binance_recv_ts)
+            np.copyto(out.usdt, self.usdt)
+            if seq == self.seq:
+                out.seq = seq
+                return out
+
+
+class PriceSnapshot:
+    """
+    Consistent copy of PriceStore taken by PriceStore.snapshot.
+    Premium is calculated in one vectorized pass into preallocated buffers.
+    """
+    def __init__(self, market_list):
+        self.market_list = list(market_list)
+        n = len(self.market_list)
+
+        self.seq = 0
+        self.upbit = np.zeros(n)
+        self.upbit_event_ts = np.zeros(n)
+        self.upbit_recv_ts = np.zeros(n)
+        self.binance = np.zeros(n)
+        self.binance_event_ts = np.zeros(n)
+        self.binance_recv_ts = np.zeros(n)
+        self.usdt = np.zeros(3)
+
+        # Buffers for calc_premium and stale. Reused on every call to avoid allocation.
+        self.premium = np.zeros(n)
+        self._b_krw = np.zeros(n)
+        self._ratio = np.zeros(n)
+        self._reverse = np.zeros(n)
+        self._mask = np.zeros(n, dtype=bool)
+        self._stale = np.zeros(n, dtype=bool)
+
+    def ready(self):
+        """
+        True when every symbol has received its first price.
+        """
+        return self.usdt[0] != 0 and self.upbit.all() and self.binance.all()
+
+    def stale(self, max_age, now=None):
+        """
+        Mask of symbols where upbit or binance price is older than max_age seconds.
+        Every symbol is stale when usdt price is.
+        """
+        if now is None:
+            now = time.time()
+        limit = now - max_age
+
+        if self.usdt[2] < limit:
+            self._stale.fill(True)
+            return self._stale
+
+        np.less(self.upbit_recv_ts, limit, out=self._stale)
+        np.less(self.binance_recv_ts, limit, out=self._mask)
+        np.logical_or(self._stale, self._mask, out=self._stale)
+        return self._stale
+
+    def calc_premium(self):
+        """
+        Premium of every symbol in percent. Same formula as premium.calc_premium.
+        Returns the shared premium buffer, so copy it if you need to keep it.
+        """
+        # Slots without price yet give inf or nan. Callers check ready() or use premium_data.
+        with np.errstate(divide="ignore", invalid="ignore"):
+            np.multiply(self.binance, self.usdt[0], out=self._b_krw)
+            np.divide(self.upbit, self._b_krw, out=self._ratio)
+
+            # upbit >= binance : ratio*100-100, reverse premium : 100-100/ratio
+            np.multiply(self._ratio, 100, out=self.premium)
+            np.subtract(self.premium, 100, out=self.premium)
+            np.divide(100, self._ratio, out=self._reverse)
+            np.subtract(100, self._reverse, out=self._reverse)
+            np.less(self._ratio, 1, out=self._mask)
+            np.copyto(self.premium, self._reverse, where=self._mask)
+
+        return self.premium
+
+    def live_premium(self, max_age, now=None):
+        """
+        (premium, stale) where premium of stale symbols is 0, so they never cross a threshold.
+        Decision input of Trader.monitor and backtest.Backtest.
+        """
+        premium = self.calc_premium()
+        stale = self.stale(max_age, now)
+        if stale.any():
+            np.copyto(premium, 0, where=stale)
+        return premium, stale
+
+    def premium_data(self, premium=None, stale=None):
+        """
+        Premium as dict for logs and trade functions. Slots without price or with stale price are left out.
+        premium_data looks like this {'ADA': 4.2, 'ATOM': 4.033, 'BAT': 3.933}
+        """
+        if premium is None:
+            premium = self.calc_premium()
+
+        valid = (self.upbit != 0) & (self.binance != 0)
+        if stale is not None:
+            valid &= ~stale
+        return {self.market_list[i]: round(float(premium[i]), 3) for i in np.flatnonzero(valid)}
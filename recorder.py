@@ -0,0 +1,169 @@
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+UPBIT, BINANCE, HUOBI = 1, 2, 3
+EXCHANGE_IDS = {"Upbit": UPBIT, "Binance": BINANCE, "Huobi": HUOBI}
+
+# 32 bytes, every field on its natural alignment.
+TICK_DTYPE = np.dtype([
+    ("exchange", "u1"),
+    ("flags", "u1"),
+    ("symbol", "u2"),
+    ("size", "f4"),
+    ("event_ts", "f8"),
+    ("recv_ts", "f8"),
+    ("price", "f8"),
+])
+
+# Same layout as TICK_DTYPE. Records are written with struct, a numpy element assignment costs several times more.
+TICK_STRUCT = struct.Struct("<BBHfddd")
+COUNT_STRUCT = struct.Struct("<Q")
+
+MAGIC = b"TICK0001"
+HEADER_SIZE = 64  # magic, record count (u8), rest reserved
+
+
+class TickRecorder:
+    """
+    Appends every price update as a fixed width binary record to memory mapped files.
+
+    1. One file per UTC day, ticks-YYYYMMDD.bin in directory. A full file continues in ticks-YYYYMMDD-1.bin and so on.
+    2. Files are created at full capacity but stay sparse, so only written records take disk.
+        Record count lives in the header and is updated on every append, so a crashed file is still readable.
+    3. Symbol ids are indexes of symbols, kept in ticks-YYYYMMDD.json next to the data.
+
+    About 5 million ticks a day of 32 bytes is 160MB.
+    """
+    def __init__(self, directory, symbols, capacity=8_000_000):
+        self.directory = directory
+        self.capacity = capacity
+        self.symbols = []
+        self.symbol_ids = {}
+        self.set_symbols(list(symbols) + ["USDT"])
+
+        self.lock = threading.Lock()
+        self.day = None
+        self.part = 0
+        self.file = None
+        self.mm = None
+        self.count = 0
+        self.rotate_at = 0
+
+        os.makedirs(directory, exist_ok=True)
+
+    def set_symbols(self, symbols):
+        # "ADA", "KRW-ADA" and "ADAUSDT" all map to the same id like prices.PriceStore
+        symbol_ids = {}
+        for i, symbol in enumerate(symbols):
+            symbol_ids[symbol] = i
+            symbol_ids["KRW-" + symbol] = i
+            symbol_ids[symbol + "USDT"] = i
+        symbol_ids["usdt"] = symbol_ids["USDT"]
+
+        self.symbols = symbols
+        self.symbol_ids = symbol_ids
+
+    def record(self, exchange, symbol, event_ts, price, size=0.0):
+        """
+        exchange is "Upbit", "Binance" or "Huobi". symbol is any key PriceStore accepts.
+        """
+        recv_ts = time.time()
+
+        with self.lock:
+            while recv_ts >= self.rotate_at or self.count >= self.capacity:
+                self.open(recv_ts)
+            # Looked up after open, ids can change when the day's symbol file is loaded.
+            symbol_id = self.symbol_ids.get(symbol)
+            if symbol_id is None:
+                return
+            TICK_STRUCT.pack_into(
+                self.mm, HEADER_SIZE + self.count * TICK_STRUCT.size,
+                EXCHANGE_IDS[exchange], 0, symbol_id, size, event_ts, recv_ts, price
+            )
+            self.count += 1
+            COUNT_STRUCT.pack_into(self.mm, 8, self.count)
+
+    def open(self, now):
+        day = datetime.fromtimestamp(now, timezone.utc).strftime("%Y%m%d")
+        if day == self.day:
+            self.part += 1
+        else:
+            self.day = day
+            self.part = 0
+            self.load_symbols(day)
+        self.close()
+
+        # Next UTC midnight
+        self.rotate_at = (int(now) // 86400 + 1) * 86400
+
+        name = "ticks-" + day + ("-" + str(self.part) if self.part else "") + ".bin"
+        path = os.path.join(self.directory, name)
+        size = HEADER_SIZE + self.capacity * TICK_DTYPE.itemsize
+
+        self.file = open(path, "a+b")
+        if os.path.getsize(path) < size:
+            self.file.truncate(size)
+        self.mm = mmap.mmap(self.file.fileno(), size)
+
+        if self.mm[:8] != MAGIC:
+            self.mm[:8] = MAGIC
+        self.count = COUNT_STRUCT.unpack_from(self.mm, 8)[0]
+
+        log.info("Recording ticks to " + path)
+
+    def load_symbols(self, day):
+        """
+        Keep symbol ids of a day stable across restarts. New symbols get new ids at the end.
+        """
+        path = os.path.join(self.directory, "ticks-" + day + ".json")
+        if os.path.exists(path):
+            with open(path) as f:
+                symbols = json.load(f)["symbols"]
+            self.set_symbols(symbols + [symbol for symbol in self.symbols if symbol not in symbols])
+
+        with open(path, "w") as f:
+            json.dump({"symbols": self.symbols, "exchanges": EXCHANGE_IDS}, f)
+
+    def close(self):
+        if self.mm is None:
+            return
+        self.mm.flush()
+        self.mm.close()
+        self.file.close()
+        self.mm = None
+
+    def stop(self):
+        with self.lock:
+            self.close()
+
+
+def read_ticks(path):
+    """
+    Records of one tick file as a numpy structured array of TICK_DTYPE, mapped read only without copying.
+    """
+    with open(path, "rb") as f:
+        header = f.read(HEADER_SIZE)
+    if header[:8] != MAGIC:
+        raise ValueError(path + " is not a tick file")
+    count = COUNT_STRUCT.unpack_from(header, 8)[0]
+    if count == 0:
+        return np.zeros(0, dtype=TICK_DTYPE)
+    return np.memmap(path, dtype=TICK_DTYPE, mode="r", offset=HEADER_SIZE, shape=(count,))
+
+
+def read_symbols(directory, day):
+    """
+    Symbol names of a day, indexed by symbol id.
+    """
+    with open(os.path.join(directory, "ticks-" + day + ".json")) as f:
+        return json.load(f)["symbols"]
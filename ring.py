@@ -0,0 +1,319 @@
+import logging
+import multiprocessing
+import struct
+import threading
+import time
+from multiprocessing import shared_memory, resource_tracker
+
+import numpy as np
+
+from recorder import UPBIT, BINANCE, HUOBI, TICK_DTYPE, TICK_STRUCT
+from metrics import registry
+
+log = logging.getLogger(__name__)
+
+RING_MAGIC = b"RING0001"
+HEADER_SIZE = 64  # magic, capacity (u8), write count (u8), rest reserved
+HEADER_STRUCT = struct.Struct("<8sQ")
+COUNT_STRUCT = struct.Struct("<Q")
+COUNT_OFFSET = 16
+
+EXCHANGE_NAMES = {UPBIT: "Upbit", BINANCE: "Binance", HUOBI: "Huobi"}
+
+
+class TickRing:
+    """
+    Single writer ring buffer of recorder.TICK_DTYPE records in shared memory.
+
+    1. The writer packs a record into slot count % capacity and then stores count + 1.
+        Readers only use slots below the count they read, so a record is never seen half written.
+        This relies on stores not being reordered, which holds on x86.
+    2. Readers keep their own position in RingCursor. Any number of processes can read one ring and the writer never waits.
+    3. A reader more than capacity records behind has lost the oldest ones. They are counted as dropped.
+
+    The count is kept across attach, so a restarted writer continues where the last one stopped.
+    """
+    def __init__(self, shm, owner=False):
+        self.shm = shm
+        self.name = shm.name
+        self.owner = owner
+        self.buf = shm.buf
+
+        magic, self.capacity = HEADER_STRUCT.unpack_from(self.buf, 0)
+        if magic != RING_MAGIC:
+            raise ValueError(self.name + " is not a tick ring")
+        self.records = np.ndarray((self.capacity,), dtype=TICK_DTYPE, buffer=self.buf, offset=HEADER_SIZE)
+
+        self.count = self.written()
+        self.lock = threading.Lock()
+
+    @classmethod
+    def create(cls, capacity=1 << 16, name=None):
+        shm = shared_memory.SharedMemory(name=name, create=True, size=HEADER_SIZE + capacity * TICK_DTYPE.itemsize)
+        HEADER_STRUCT.pack_into(shm.buf, 0, RING_MAGIC, capacity)
+        COUNT_STRUCT.pack_into(shm.buf, COUNT_OFFSET, 0)
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        shm = shared_memory.SharedMemory(name=name)
+        # Only the creator unlinks. A process not started by multiprocessing has its own resource tracker,
+        # which would remove the ring when the process exits. Children share the tracker of their parent.
+        if multiprocessing.parent_process() is None:
+            resource_tracker.unregister(shm._name, "shared_memory")
+        return cls(shm)
+
+    def written(self):
+        return COUNT_STRUCT.unpack_from(self.buf, COUNT_OFFSET)[0]
+
+    def write(self, exchange, symbol, event_ts, recv_ts, price, size=0.0):
+        with self.lock:
+            count = self.count
+            TICK_STRUCT.pack_into(
+                self.buf, HEADER_SIZE + (count % self.capacity) * TICK_STRUCT.size,
+                exchange, 0, symbol, size, event_ts, recv_ts, price
+            )
+            self.count = count + 1
+            COUNT_STRUCT.pack_into(self.buf, COUNT_OFFSET, count + 1)
+
+    def cursor(self, from_start=False):
+        return RingCursor(self, from_start)
+
+    def close(self):
+        # numpy views must go before the shared memory can be closed.
+        self.records = None
+        self.buf = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class RingCursor:
+    """
+    Read position of one reader. read() copies every record written since the last call in at most two slices.
+    """
+    def __init__(self, ring, from_start=False):
+        self.ring = ring
+        self.pos = max(0, ring.written() - ring.capacity) if from_start else ring.written()
+        self.dropped = 0
+
+    def read(self, limit=None):
+        ring = self.ring
+        capacity = ring.capacity
+
+        count = ring.written()
+        if count - self.pos > capacity:
+            self.dropped += count - capacity - self.pos
+            self.pos = count - capacity
+        if limit and count - self.pos > limit:
+            count = self.pos + limit
+        n = count - self.pos
+        if n <= 0:
+            return ring.records[:0]
+
+        start = self.pos % capacity
+        if start + n <= capacity:
+            ticks = ring.records[start:start + n].copy()
+        else:
+            ticks = np.concatenate((ring.records[start:], ring.records[:start + n - capacity]))
+
+        # The writer may have lapped the oldest records while they were copied.
+        lapped = ring.written() - capacity - self.pos
+        if lapped > 0:
+            ticks = ticks[lapped:]
+            self.dropped += lapped
+
+        self.pos = count
+        return ticks
+
+
+class RingPrices:
+    """
+    Stands in for prices.PriceStore in a feed process. set_upbit, set_binance and set_usdt write a record to the ring.
+    Symbol ids are market_list indexes and len(market_list) is usdt, like recorder.TickRecorder.
+    """
+    def __init__(self, ring, market_list):
+        self.ring = ring
+        self.market_list = list(market_list)
+        self.usdt_id = len(self.market_list)
+
+        self.index = {}
+        for i, symbol in enumerate(self.market_list):
+            self.index[symbol] = i
+            self.index["KRW-"+symbol] = i
+            self.index[symbol+"USDT"] = i
+
+    def set_upbit(self, code, price, event_ts=0.0):
+        i = self.index.get(code)
+        if i is None:
+            return None
+        self.ring.write(UPBIT, i, event_ts, time.time(), price)
+        return i
+
+    def set_binance(self, symbol, price, event_ts=0.0):
+        i = self.index.get(symbol)
+        if i is None:
+            return None
+        self.ring.write(BINANCE, i, event_ts, time.time(), price)
+        return i
+
+    def set_usdt(self, price, event_ts=0.0):
+        self.ring.write(HUOBI, self.usdt_id, event_ts, time.time(), price)
+
+
+def run_feed_process(exchange, settings, ring_name):
+    """
+    Entry point of one feed process. Feeds of exchange run on a feed.FeedManager loop and write to the ring.
+    """
+    logging.basicConfig(format='%(asctime)s - ' + exchange + ' feed - %(levelname)s - %(message)s', level=logging.INFO, force=True)
+
+    # Imported here, the parent only needs the ring side.
+    from ws import BinanceShards, UpbitWS, HuobiWS
+    from feed import FeedManager
+
+    ring = TickRing.attach(ring_name)
+    prices = RingPrices(ring, settings["market_list"])
+
+    shards = None
+    if exchange == "Upbit":
+        feeds = [UpbitWS(exchange="Upbit", prices=prices, settings=settings)]
+    elif exchange == "Binance":
+        shards = BinanceShards(prices=prices, settings=settings)
+        feeds = shards.shards
+    elif exchange == "Huobi":
+        feeds = [HuobiWS(prices=prices, json_backend=settings.get("json_backend", "ujson"), url=settings.get("huobi_ws_url"))]
+    else:
+        raise ValueError("Unknown exchange " + exchange)
+
+    manager = FeedManager(feeds)
+    if shards:
+        shards.start_rebalance()
+    # This process has nothing else to do, so the loop runs on the main thread.
+    manager.run()
+
+
+class FeedProcesses:
+    """
+    Each exchange feed in its own process, so ingestion uses several cores and never holds the GIL of Trader.
+
+    1. Every feed process writes fixed width records to its own TickRing. Nothing is pickled after start.
+    2. RingReader applies the records to prices in batches. Without prices there is no reader,
+        the rings are read by other processes. See shared_feed.py.
+    3. A feed process that died is started again on the same ring.
+    Rings get random names, or <name>_<exchange> when name is given.
+    """
+    def __init__(self, exchanges, settings, prices=None, on_update=None, name=None):
+        self.exchanges = list(exchanges)
+        self.settings = settings
+        self.context = multiprocessing.get_context("spawn")
+
+        capacity = settings.get("ring_capacity", 1 << 16)
+        self.rings = {exchange: TickRing.create(capacity, name + "_" + exchange.lower() if name else None)
+                      for exchange in self.exchanges}
+        self.processes = {}
+        self.reader = None
+        if prices is not None:
+            self.reader = RingReader(
+                list(self.rings.values()), prices, on_update,
+                poll_interval=settings.get("ring_poll_interval", 0.0002)
+            )
+        self.running = False
+
+    def spawn(self, exchange):
+        process = self.context.Process(
+            target=run_feed_process,
+            args=(exchange, self.settings, self.rings[exchange].name),
+            name=exchange + " feed",
+            daemon=True
+        )
+        process.start()
+        self.processes[exchange] = process
+        log.info(exchange + " feed process started. pid " + str(process.pid))
+
+    def start(self):
+        self.running = True
+        for exchange in self.exchanges:
+            self.spawn(exchange)
+        if self.reader:
+            self.reader.start()
+        threading.Thread(target=self.supervise, daemon=True, name="feed supervisor").start()
+
+    def supervise(self):
+        while self.running:
+            time.sleep(1)
+            for exchange, process in list(self.processes.items()):
+                if self.running and not process.is_alive():
+                    log.error(exchange + " feed process exited with " + str(process.exitcode) + ". Restarting.")
+                    self.spawn(exchange)
+
+    def stop(self):
+        self.running = False
+        if self.reader:
+            self.reader.stop()
+        for process in self.processes.values():
+            process.terminate()
+        for process in self.processes.values():
+            process.join(5)
+        if self.reader:
+            self.reader.join(5)
+        for ring in self.rings.values():
+            ring.close()
+
+
+class RingReader(threading.Thread):
+    """
+    Drains rings into prices.PriceStore and calls on_update(exchange, symbol) for every symbol that moved.
+
+    Polls without any system call while records keep coming. When every ring is empty it sleeps poll_interval.
+    ring_latency.<exchange> is the time from feed receive to apply of the oldest record in each batch.
+    remap turns symbol ids of the writer into slots of prices when their market lists differ.
+    from_start reads every record still in the rings first, for a reader that joins a writer already running.
+    """
+    def __init__(self, rings, prices, on_update=None, poll_interval=0.0002, batch=4096, remap=None, from_start=False):
+        super().__init__(daemon=True, name="ring reader")
+        self.cursors = [ring.cursor(from_start) for ring in rings]
+        self.remap = remap
+        self.prices = prices
+        self.on_update = on_update
+        self.poll_interval = poll_interval
+        self.batch = batch
+        self.latency = {exchange: registry.histogram("ring_latency." + name) for exchange, name in EXCHANGE_NAMES.items()}
+        self.running = True
+
+    def run(self):
+        while self.running:
+            busy = False
+            for cursor in self.cursors:
+                ticks = cursor.read(self.batch)
+                if len(ticks):
+                    busy = True
+                    self.apply(ticks)
+            if not busy:
+                time.sleep(self.poll_interval)
+
+    def stop(self):
+        self.running = False
+
+    def dropped(self):
+        return sum(cursor.dropped for cursor in self.cursors)
+
+    def apply(self, ticks):
+        if self.remap is not None:
+            # ticks is a copy, so it can be changed in place.
+            ticks["symbol"] = self.remap[ticks["symbol"]]
+        u_slots, b_slots, usdt = self.prices.apply_ticks(ticks)
+
+        now = time.time()
+        histogram = self.latency.get(int(ticks["exchange"][0]))
+        if histogram:
+            histogram.record(now - float(ticks["recv_ts"].min()))
+
+        if self.on_update is None:
+            return
+        market_list = self.prices.market_list
+        for i in u_slots:
+            self.on_update("Upbit", market_list[i])
+        for i in b_slots:
+            self.on_update("Binance", market_list[i])
+        if usdt:
+            self.on_update("Huobi", "usdt")
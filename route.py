@@ -0,0 +1,202 @@
+import itertools
+import threading
+
+import numpy as np
+
+from premium import PremiumBook
+
+# Cash of each exchange. Every leg starts and ends in one of them.
+EXCHANGE_CASH = {"Binance": "USDT", "Upbit": "KRW"}
+TRADING_FEES = {"Binance": 0.001, "Upbit": 0.0005, "Huobi": 0.002}
+
+
+class RouteGraph:
+    """
+    Exchanges and assets as a graph, with the most profitable full cycle kept up to date on every tick.
+
+    1. Nodes are (exchange, asset). A trade edge joins a coin with the cash of its exchange at the live price less
+        trading fee. A transfer edge moves a coin between exchanges, less withdraw fee and with an expected transfer time.
+    2. A leg is cash of one exchange -> coin -> same coin on another exchange -> cash there.
+        Leg rates of every coin between two exchanges are kept in arrays and the best one in a premium.PremiumBook.
+    3. Cycles are loops of legs over exchanges, enumerated once. Binance -> Upbit -> Binance and Upbit -> Binance -> Upbit
+        are both there, so premium and reverse premium are covered. Cash currencies cancel out around a loop,
+        so the best cycle of a loop is the product of its best legs.
+    4. A tick of one coin recomputes only the legs of that coin, O(log n) each. Cycles are a handful of products.
+
+    A leg of coin i from A to B with notional N in cash of A
+        rate = (N / price_A * (1 - fee_A) - withdraw_fee) * price_B * (1 - fee_B) / N
+    best() looks like this
+    {"exchanges": ["Binance", "Upbit", "Binance"], "coins": ["ADA", "XRP"], "rate": 1.0123, "seconds": 1500}
+    """
+    def __init__(self, market_list, notional, exchanges=None, trading_fees=None, withdraw_fees=None,
+                 transfer_times=None, transfer_time=600):
+        self.market_list = list(market_list)
+        self.index = {symbol: i for i, symbol in enumerate(self.market_list)}
+        n = len(self.market_list)
+
+        self.exchanges = dict(exchanges or EXCHANGE_CASH)
+        self.trading_fees = dict(TRADING_FEES, **(trading_fees or {}))
+        self.notional = notional  # USDT
+        self.usdt = 0.0  # KRW per USDT, for notional in KRW
+
+        self.lock = threading.Lock()
+
+        self.prices = {exchange: np.zeros(n) for exchange in self.exchanges}
+        # Withdraw fee is nan where the coin can't be sent or its fee isn't known yet. Those legs are left out.
+        self.withdraw_fees = {exchange: np.full(n, np.nan) for exchange in self.exchanges}
+
+        # Every ordered exchange pair.
+        self.pairs = list(itertools.permutations(self.exchanges, 2))
+        self.seconds = {}
+        self.rates = {}
+        self.books = {}
+        for src, dst in self.pairs:
+            self.seconds[src, dst] = np.full(n, float(transfer_time))
+            self.rates[src, dst] = np.zeros(n)
+            self.books[src, dst] = PremiumBook(self.market_list)
+
+        for exchange, fees in (withdraw_fees or {}).items():
+            for symbol, fee in fees.items():
+                self.set_withdraw_fee(exchange, symbol, fee)
+        for symbol, seconds in (transfer_times or {}).items():
+            for src, dst in self.pairs:
+                self.set_transfer_time(symbol, src, dst, seconds)
+
+        # (A, B, A), (A, B, C, A) and so on. Rotations are separate cycles, they start from different cash.
+        self.cycles = []
+        for k in range(2, len(self.exchanges) + 1):
+            for exchanges in itertools.permutations(self.exchanges, k):
+                self.cycles.append(exchanges + (exchanges[0],))
+
+    def set_withdraw_fee(self, exchange, symbol, fee):
+        """
+        Withdraw fee of symbol from exchange in units of symbol. None means the coin can't be withdrawn there.
+        """
+        i = self.index.get(symbol)
+        if i is None or exchange not in self.withdraw_fees:
+            return
+        with self.lock:
+            self.withdraw_fees[exchange][i] = np.nan if fee is None else fee
+            for pair in self.pairs:
+                if exchange in pair:
+                    self._update_leg(pair, i)
+
+    def set_transfer_time(self, symbol, src, dst, seconds):
+        i = self.index.get(symbol)
+        if i is not None and (src, dst) in self.seconds:
+            self.seconds[src, dst][i] = seconds
+
+    def set_notional(self, notional):
+        """
+        USDT of one cycle. Trader sets it again after every cycle, the balance it trades with changes.
+        """
+        with self.lock:
+            self.notional = notional
+            for pair in self.pairs:
+                self._update_pair(pair)
+
+    def set_usdt(self, price):
+        with self.lock:
+            self.usdt = price
+            for pair in self.pairs:
+                if self.exchanges[pair[0]] == "KRW":
+                    self._update_pair(pair)
+
+    def set_price(self, exchange, symbol, price):
+        """
+        Price of symbol in cash of exchange. 0 takes the coin out of every leg, like a stale price.
+        """
+        i = self.index.get(symbol)
+        if i is None or exchange not in self.prices:
+            return
+        with self.lock:
+            self.prices[exchange][i] = price
+            for pair in self.pairs:
+                if exchange in pair:
+                    self._update_leg(pair, i)
+
+    def update_snapshot(self, snapshot, stale=None):
+        """
+        Refresh every leg from a prices.PriceSnapshot in one vectorized pass. Stale symbols are left out.
+        """
+        with self.lock:
+            for exchange, prices in (("Upbit", snapshot.upbit), ("Binance", snapshot.binance)):
+                if exchange in self.prices:
+                    np.copyto(self.prices[exchange], prices)
+                    if stale is not None:
+                        self.prices[exchange][stale] = 0
+            self.usdt = float(snapshot.usdt[0])
+            for pair in self.pairs:
+                self._update_pair(pair)
+
+    def best(self, start=None):
+        """
+        Most profitable cycle, or the one starting from cash of start. None when no cycle has every leg.
+        """
+        with self.lock:
+            best = None
+            for cycle in self.cycles:
+                if start is not None and cycle[0] != start:
+                    continue
+
+                rate = 1.0
+                coins = []
+                seconds = 0.0
+                for pair in zip(cycle, cycle[1:]):
+                    top = self.books[pair].max()
+                    if top is None:
+                        break
+                    symbol, leg_rate = top
+                    rate *= leg_rate
+                    coins.append(symbol)
+                    seconds += float(self.seconds[pair][self.index[symbol]])
+                else:
+                    if best is None or rate > best["rate"]:
+                        best = {"exchanges": list(cycle), "coins": coins, "rate": rate, "seconds": seconds}
+            return best
+
+    def leg_rates(self, src, dst):
+        """
+        Rate of every coin from src to dst. 0 where the leg doesn't exist.
+        """
+        with self.lock:
+            return self.rates[src, dst].copy()
+
+    def _cash_notional(self, exchange):
+        if self.exchanges[exchange] == "KRW":
+            return self.notional * self.usdt
+        return self.notional
+
+    def _update_pair(self, pair):
+        src, dst = pair
+        src_prices = self.prices[src]
+        dst_prices = self.prices[dst]
+        notional = self._cash_notional(src)
+
+        rates = self.rates[pair]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            quantity = notional / src_prices * (1 - self.trading_fees.get(src, 0)) - self.withdraw_fees[src]
+            np.multiply(quantity, dst_prices * (1 - self.trading_fees.get(dst, 0)) / notional, out=rates)
+        valid = (src_prices > 0) & (dst_prices > 0) & np.isfinite(rates) & (rates > 0)
+        rates[~valid] = 0
+
+        # Coins left out of update_all are removed from the book.
+        self.books[pair].update_all({self.market_list[i]: float(rates[i]) for i in np.flatnonzero(valid)})
+
+    def _update_leg(self, pair, i):
+        src, dst = pair
+        src_price = self.prices[src][i]
+        dst_price = self.prices[dst][i]
+        notional = self._cash_notional(src)
+        withdraw_fee = self.withdraw_fees[src][i]
+
+        rate = 0.0
+        if src_price > 0 and dst_price > 0 and notional > 0 and not np.isnan(withdraw_fee):
+            quantity = notional / src_price * (1 - self.trading_fees.get(src, 0)) - withdraw_fee
+            rate = max(float(quantity * dst_price * (1 - self.trading_fees.get(dst, 0)) / notional), 0.0)
+
+        self.rates[pair][i] = rate
+        if rate > 0:
+            self.books[pair].update(self.market_list[i], rate)
+        else:
+            self.books[pair].remove(self.market_list[i])
@@ -0,0 +1,183 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+log = logging.getLogger(__name__)
+
+
+class RateBudget:
+    """
+    Token bucket of one exchange. rate requests per second, up to burst at once.
+    """
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1, rate)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, now):
+        """
+        Returns 0 when a token is taken, otherwise seconds until the next token.
+        """
+        self.refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class Watch:
+    """
+    One pending order, withdraw or deposit.
+
+    poll() makes the request and done(result) returns the final value, or None while still pending.
+    Exceptions from poll in retry_on are logged and polled again, others fail the watch like exceptions from done.
+
+    Interval starts at interval and grows by backoff up to max_interval on every pending poll.
+    When expected_at(time.time() seconds) is given, polling is slow until then and min_interval around it.
+
+    Watches with the same batch_key are polled with one request. See PollScheduler.register_batch.
+    """
+    def __init__(self, exchange, poll=None, done=None, interval=1.0, min_interval=0.1, max_interval=30.0,
+                 backoff=1.5, expected_at=None, batch_key=None, batch_arg=None, retry_on=(Exception,), name=""):
+        self.exchange = exchange
+        self.poll = poll
+        self.done = done or (lambda result: result or None)
+        self.interval = interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.expected_at = expected_at
+        self.batch_key = batch_key
+        self.batch_arg = batch_arg
+        self.retry_on = retry_on
+        self.name = name
+
+        self.polls = 0
+        self.future = Future()
+
+    def next_interval(self):
+        now = time.time()
+        if self.expected_at is not None:
+            remaining = self.expected_at - now
+            if remaining > self.min_interval:
+                # Sleep most of the way, then poll fast around the expected time.
+                return min(max(remaining * 0.8, self.min_interval), self.max_interval)
+            if remaining > -self.interval:
+                return self.min_interval
+
+        interval = self.interval
+        self.interval = min(self.interval * self.backoff, self.max_interval)
+        return max(interval, self.min_interval)
+
+
+class PollScheduler(threading.Thread):
+    """
+    Owns every status polling loop of Trader.
+
+    1. Watches are kept in a heap by next poll time. Polls run on a small thread pool.
+    2. Every poll takes a token from the RateBudget of its exchange. Without budget the poll is delayed.
+    3. wait(watch) blocks the caller until the watch is done and returns the value from done.
+    """
+    def __init__(self, budgets, max_workers=4):
+        super().__init__(daemon=True)
+
+        self.budgets = budgets  # {"Upbit": RateBudget(8)}
+        self.batches = {}
+        self.heap = []
+        self.counter = itertools.count()
+        self.cond = threading.Condition()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="poll")
+        self.running = True
+
+    def register_batch(self, batch_key, batch_poll):
+        """
+        batch_poll(args) gets batch_arg of every due watch of batch_key and
+        returns {batch_arg: result}. Missing keys count as pending.
+        """
+        self.batches[batch_key] = batch_poll
+
+    def submit(self, watch, delay=0):
+        with self.cond:
+            heapq.heappush(self.heap, (time.monotonic() + delay, next(self.counter), watch))
+            self.cond.notify()
+        return watch.future
+
+    def wait(self, watch, delay=0):
+        return self.submit(watch, delay).result()
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+        self.executor.shutdown(wait=False)
+
+    def run(self):
+        while True:
+            with self.cond:
+                while self.running and (not self.heap or self.heap[0][0] > time.monotonic()):
+                    timeout = self.heap[0][0] - time.monotonic() if self.heap else None
+                    self.cond.wait(timeout)
+                if not self.running:
+                    return
+
+                now = time.monotonic()
+                due_at, _, watch = heapq.heappop(self.heap)
+
+                budget = self.budgets.get(watch.exchange)
+                if budget:
+                    wait = budget.take(now)
+                    if wait:
+                        heapq.heappush(self.heap, (now + wait, next(self.counter), watch))
+                        continue
+
+                watches = [watch]
+                if watch.batch_key in self.batches:
+                    # Every other watch of the batch rides along with this request.
+                    rest = []
+                    for item in self.heap:
+                        if item[2].batch_key == watch.batch_key:
+                            watches.append(item[2])
+                        else:
+                            rest.append(item)
+                    if len(watches) > 1:
+                        self.heap = rest
+                        heapq.heapify(self.heap)
+
+            self.executor.submit(self.poll, watches)
+
+    def poll(self, watches):
+        results = {}
+        try:
+            if watches[0].batch_key in self.batches:
+                response = self.batches[watches[0].batch_key]([w.batch_arg for w in watches])
+                results = {w: response.get(w.batch_arg) for w in watches}
+            else:
+                results = {watches[0]: watches[0].poll()}
+        except Exception as e:
+            log.error("Poll failed " + watches[0].name + " : " + repr(e))
+            if not isinstance(e, watches[0].retry_on):
+                for watch in watches:
+                    watch.future.set_exception(e)
+                return
+
+        for watch in watches:
+            watch.polls += 1
+            result = results.get(watch)
+            try:
+                value = watch.done(result) if result is not None else None
+            except Exception as e:
+                watch.future.set_exception(e)
+                continue
+
+            if value is not None:
+                watch.future.set_result(value)
+            else:
+                self.submit(watch, watch.next_interval())
@@ -0,0 +1,217 @@
+import json
+import logging
+import multiprocessing
+import os
+import struct
+import threading
+import time
+from multiprocessing import shared_memory, resource_tracker
+
+import numpy as np
+
+from ring import FeedProcesses, TickRing, RingReader
+
+log = logging.getLogger(__name__)
+
+DIRECTORY_MAGIC = b"FEED0001"
+DIRECTORY_SIZE = 1 << 16
+DIRECTORY_STRUCT = struct.Struct("<8sQ")  # magic, json length. json follows.
+UNKNOWN_SYMBOL = 0xFFFF  # Past any market_list, so prices.PriceStore.apply_ticks skips it.
+
+
+def read_directory(name):
+    """
+    What the feed publishes under name, or None when no feed is running.
+    Directory looks like this
+    {"market_list": ["ADA", ...], "rings": {"Binance": "premium_feed_binance", ...}, "pid": 1234, "started": 1600000000.0}
+    """
+    try:
+        shm = shared_memory.SharedMemory(name=name)
+    except FileNotFoundError:
+        return None
+    try:
+        # Same as ring.TickRing.attach, the tracker of this process must not remove the directory.
+        if multiprocessing.parent_process() is None:
+            resource_tracker.unregister(shm._name, "shared_memory")
+        magic, length = DIRECTORY_STRUCT.unpack_from(shm.buf, 0)
+        if magic != DIRECTORY_MAGIC or length == 0:
+            return None
+        return json.loads(bytes(shm.buf[DIRECTORY_STRUCT.size:DIRECTORY_STRUCT.size + length]))
+    finally:
+        shm.close()
+
+
+def unlink_stale(name):
+    try:
+        shm = shared_memory.SharedMemory(name=name)
+    except FileNotFoundError:
+        return
+    shm.close()
+    shm.unlink()
+
+
+class SharedFeed:
+    """
+    One set of feed processes publishing prices of market_list for any number of Trader processes on this host.
+
+    1. Feeds run in ring.FeedProcesses and write to rings named <name>_<exchange>. Nothing reads them here.
+    2. A directory segment named name holds market_list, ring names, pid and start time as JSON.
+        SharedFeedClient finds everything from name alone.
+    3. Readers keep their own cursors, so the feed does the same work for one Trader or fifty.
+        A reader that falls behind only drops its own records.
+    4. Segments left by a feed that crashed are removed on start. A feed that is still running is not replaced.
+
+    market_list of the feed should cover the market_list of every Trader. Symbols it lacks never get a price there.
+    """
+    def __init__(self, settings, name="premium_feed", exchanges=None):
+        self.name = name
+        self.exchanges = list(exchanges or ["Binance", "Huobi", "Upbit"])
+        self.market_list = list(settings["market_list"])
+
+        running = read_directory(name)
+        if running and pid_alive(running["pid"]):
+            raise RuntimeError("Feed " + name + " is already running. pid " + str(running["pid"]))
+        unlink_stale(name)
+        for exchange in self.exchanges:
+            unlink_stale(name + "_" + exchange.lower())
+
+        self.processes = FeedProcesses(self.exchanges, settings, name=name)
+        self.directory = None
+
+    def publish(self):
+        data = json.dumps({
+            "market_list": self.market_list,
+            "rings": {exchange: ring.name for exchange, ring in self.processes.rings.items()},
+            "pid": os.getpid(),
+            "started": time.time()
+        }).encode()
+        if DIRECTORY_STRUCT.size + len(data) > DIRECTORY_SIZE:
+            raise ValueError("market_list is too long for the feed directory")
+
+        self.directory = shared_memory.SharedMemory(name=self.name, create=True, size=DIRECTORY_SIZE)
+        # Length goes last, so a client never reads half a directory.
+        self.directory.buf[DIRECTORY_STRUCT.size:DIRECTORY_STRUCT.size + len(data)] = data
+        DIRECTORY_STRUCT.pack_into(self.directory.buf, 0, DIRECTORY_MAGIC, len(data))
+
+    def start(self):
+        self.processes.start()
+        self.publish()
+        log.info("Feed " + self.name + " published " + str(len(self.market_list)) + " symbols from " + ", ".join(self.exchanges))
+
+    def stop(self):
+        if self.directory:
+            self.directory.close()
+            self.directory.unlink()
+            self.directory = None
+        self.processes.stop()
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class SharedFeedClient:
+    """
+    Feeds prices.PriceStore of one Trader from a SharedFeed running in another process.
+
+    1. Rings of the feed are attached by name and drained by a ring.RingReader, same as with feed_processes.
+    2. Symbol ids of the feed are mapped to slots of prices, so every Trader can have its own market_list.
+    3. The directory is checked every check_interval seconds. A restarted feed has new rings and they are attached again.
+    4. Rings are read from their oldest record, so a Trader that joins a running feed gets the last price of every symbol
+        without waiting for its next tick. Old prices keep their recv_ts and count as stale like any other.
+    """
+    def __init__(self, name, prices, on_update=None, poll_interval=0.0002, check_interval=1):
+        self.name = name
+        self.prices = prices
+        self.on_update = on_update
+        self.poll_interval = poll_interval
+        self.check_interval = check_interval
+
+        self.started = None
+        self.rings = []
+        self.reader = None
+        self.running = False
+
+    def remap(self, market_list):
+        """
+        Slot of prices for every symbol id of the feed. usdt id of the feed goes to usdt id of prices.
+        """
+        remap = np.full(len(market_list) + 1, UNKNOWN_SYMBOL, dtype=np.uint16)
+        for i, symbol in enumerate(market_list):
+            remap[i] = self.prices.index.get(symbol, UNKNOWN_SYMBOL)
+        remap[len(market_list)] = len(self.prices.market_list)
+
+        missing = set(self.prices.market_list) - set(market_list)
+        if missing:
+            log.warning("Feed " + self.name + " has no " + ", ".join(sorted(missing)))
+        return remap
+
+    def attach(self, directory):
+        rings = [TickRing.attach(ring_name) for ring_name in directory["rings"].values()]
+        reader = RingReader(rings, self.prices, self.on_update, poll_interval=self.poll_interval,
+                            remap=self.remap(directory["market_list"]), from_start=True)
+        reader.start()
+
+        old_reader, old_rings = self.reader, self.rings
+        self.reader, self.rings = reader, rings
+        self.started = directory["started"]
+        if old_reader:
+            old_reader.stop()
+            old_reader.join(5)
+            for ring in old_rings:
+                ring.close()
+        log.info("Attached to feed " + self.name + ". pid " + str(directory["pid"]))
+
+    def start(self):
+        self.running = True
+        log.info("Waiting for feed " + self.name)
+        threading.Thread(target=self.watch, daemon=True, name="shared feed").start()
+
+    def watch(self):
+        while self.running:
+            try:
+                directory = read_directory(self.name)
+                if directory is None:
+                    if self.started is not None:
+                        log.error("Feed " + self.name + " is gone. Waiting for it to come back.")
+                        self.started = None
+                elif directory["started"] != self.started:
+                    self.attach(directory)
+            except Exception as e:
+                log.error("Feed " + self.name + " attach failed : " + repr(e))
+            time.sleep(self.check_interval)
+
+    def stop(self):
+        self.running = False
+        if self.reader:
+            self.reader.stop()
+            self.reader.join(5)
+        for ring in self.rings:
+            ring.close()
+        self.rings = []
+
+
+if __name__ == '__main__':
+    import sys
+
+    logging.basicConfig(format='%(asctime)s - feed - %(levelname)s - %(message)s', level=logging.INFO)
+
+    # python shared_feed.py [settings.json]
+    with open(sys.argv[1] if len(sys.argv) > 1 else "./settings.json", "r") as f:
+        settings = json.load(f)
+
+    feed = SharedFeed(settings, settings.get("shared_feed", "premium_feed"), settings.get("shared_feed_exchanges"))
+    feed.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        feed.stop()
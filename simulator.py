@@ -0,0 +1,918 @@
+"""
+Local stand-in for the Upbit, Binance and Huobi surfaces this bot uses, for end to end benchmarks without exchanges.
+
+    python simulator.py [--config sim.json] [--host 127.0.0.1] [--port 8100]
+
+port is Upbit REST, port+1 Binance REST, port+2 Huobi REST and port+3 the websocket of every exchange.
+Prints the settings.json keys that point main.py and Trader at it.
+
+1. Feeds. Upbit /websocket/v1 ticker, Binance /ws/<symbol>usdt@aggTrade combined streams and
+    Huobi /ws gzip trade detail with ping. Every symbol sends message_rate messages per second.
+    Event timestamps are feed_latency + jitter before the send, like an exchange far away.
+2. REST. Every request waits rest_latency + jitter. Orders fill after fill_delay, a reject_rate share is rejected.
+    Withdraws arrive at the exchange that owns the address after withdraw_delay.
+3. Prices walk randomly from binance_prices. Upbit is premium percent over Binance, set per symbol by premium_events.
+    Time from the first tick carrying an event's premium to the first Binance order of that symbol is tick to order latency.
+    GET /sim/stats on any REST port returns it with message and request counts.
+"""
+import argparse
+import asyncio
+import gzip
+import itertools
+import json
+import logging
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import websockets
+
+log = logging.getLogger(__name__)
+
+DEFAULT_CONFIG = {
+    "market_list": ["ADA", "XRP", "TRX"],
+    "binance_prices": {"BTC": 50000.0, "EOS": 4.0},  # USDT. 1.0 for symbols not here.
+    "usdt_krw": 1130.0,
+    "premium": 0.5,  # percent of Upbit over Binance for every symbol
+    "premium_events": [],  # [{"at": 30, "symbol": "ADA", "premium": 3.0}], at is seconds after start
+    "volatility": 0.0002,  # random walk step of price per message
+    "message_rate": {"Upbit": 5, "Binance": 10, "Huobi": 2},  # messages per second per symbol
+    "feed_latency": 0.02,
+    "feed_jitter": 0.01,
+    "rest_latency": 0.03,
+    "rest_jitter": 0.01,
+    "fill_delay": 0.2,
+    "reject_rate": 0.0,
+    "slippage": 0.0005,
+    "withdraw_delay": 5.0,
+    "withdraw_fees": {"BTC": 0.0009, "EOS": 0.1},
+    "quote_volumes": {"BTC": 5e9, "EOS": 2e8},  # 24h USDT volume of Binance tickers. 1e7 for symbols not here.
+    "balances": {"Upbit": {"KRW": 0.0}, "Binance": {"USDT": 1000.0}, "Huobi": {"KRW": 0.0}},
+    "huobi_account_id": 20694732
+}
+
+
+class SimError(Exception):
+    def __init__(self, status, body):
+        super().__init__(body)
+        self.status = status
+        self.body = body
+
+
+class Market:
+    """
+    Prices of every symbol. Binance price walks, Upbit and Huobi follow it.
+    """
+    def __init__(self, config):
+        self.config = config
+        self.symbols = list(dict.fromkeys(config["market_list"] + ["BTC", "EOS"]))
+        self.binance = {symbol: float(config["binance_prices"].get(symbol, 1.0)) for symbol in self.symbols}
+        self.premium = dict.fromkeys(self.symbols, float(config["premium"]))
+        self.usdt = float(config["usdt_krw"])
+        self.volatility = config["volatility"]
+
+        self.started = time.time()
+        self.events = sorted(config["premium_events"], key=lambda event: event["at"])
+
+        # tick to order latency. symbol -> (send time, event time) of the first tick with the new premium
+        self.premium_sent = {}
+        self.pending_events = set()
+        self.tick_to_order = []
+        self.event_to_order = []
+
+    def apply_events(self, now):
+        while self.events and self.started + self.events[0]["at"] <= now:
+            event = self.events.pop(0)
+            self.premium[event["symbol"]] = float(event["premium"])
+            self.pending_events.add(event["symbol"])
+            log.info("Premium of " + event["symbol"] + " is now " + str(event["premium"]))
+
+    def step(self, symbol):
+        self.binance[symbol] *= 1 + random.gauss(0, self.volatility)
+        return self.binance[symbol]
+
+    def upbit_price(self, symbol):
+        price = self.binance[symbol] * self.usdt * (1 + self.premium[symbol] / 100)
+        # Upbit KRW tick sizes are coarse, a few significant digits is close enough.
+        return float("%.4g" % price)
+
+    def sent_upbit(self, symbol, now, event_ts):
+        if symbol in self.pending_events:
+            self.pending_events.discard(symbol)
+            self.premium_sent[symbol] = (now, event_ts)
+
+    def ordered(self, symbol, now):
+        sent = self.premium_sent.pop(symbol, None)
+        if sent:
+            self.tick_to_order.append(round(now - sent[0], 6))
+            self.event_to_order.append(round(now - sent[1], 6))
+
+
+class Transfer:
+    def __init__(self, id, source, dest, asset, amount, fee, address, tag, done_at):
+        self.id = id
+        self.source = source
+        self.dest = dest  # None when the address belongs to nobody. The coin is lost like on chain.
+        self.asset = asset
+        self.amount = amount
+        self.fee = fee
+        self.address = address
+        self.tag = tag
+        self.created = time.time()
+        self.done_at = done_at
+        self.txid = "tx" + str(id) + "%08x" % random.getrandbits(32)
+        self.done = False
+
+
+class Order:
+    def __init__(self, id, exchange, symbol, side, amount, price, fill_at, quote=False):
+        self.id = id
+        self.exchange = exchange
+        self.symbol = symbol  # base asset ex) BTC
+        self.quote_asset = "USDT" if exchange == "Binance" or symbol == "EOS" else "KRW"
+        self.side = side  # "buy" or "sell"
+        self.amount = amount  # base quantity, or quote to spend when quote is True
+        self.price = price  # limit price or None for market
+        self.quote = quote
+        self.created = time.time()
+        self.fill_at = fill_at
+
+        self.state = "wait"
+        self.filled = 0.0
+        self.funds = 0.0
+        self.avg_price = 0.0
+
+
+class Simulator:
+    """
+    Accounts, orders and transfers of the three exchanges behind one lock.
+    Pending orders and transfers settle at the start of every request.
+    """
+    def __init__(self, config):
+        self.config = config
+        self.market = Market(config)
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1000)
+
+        self.balances = {
+            exchange: {asset.upper(): float(amount) for asset, amount in config["balances"].get(exchange, {}).items()}
+            for exchange in ("Upbit", "Binance", "Huobi")
+        }
+        self.futures = {"USDT": 0.0}
+        self.positions = {}  # symbol -> [signed quantity, entry price]
+        self.leverage = {}
+
+        self.orders = {}
+        self.transfers = []
+
+        self.messages = {"Upbit": 0, "Binance": 0, "Huobi": 0}
+        self.requests = {}
+
+    # Common
+
+    def balance(self, exchange, asset):
+        return self.balances[exchange].get(asset, 0.0)
+
+    def add(self, exchange, asset, amount):
+        self.balances[exchange][asset] = self.balance(exchange, asset) + amount
+
+    def take(self, exchange, asset, amount):
+        if amount > self.balance(exchange, asset) + 1e-9:
+            raise SimError(400, "insufficient " + asset)
+        self.add(exchange, asset, -amount)
+
+    def maybe_reject(self):
+        if random.random() < self.config["reject_rate"]:
+            raise SimError(400, "rejected by simulator")
+
+    def address(self, exchange, asset):
+        return exchange.lower() + "-" + asset.upper()
+
+    def owner(self, address):
+        for exchange in ("Upbit", "Binance", "Huobi"):
+            if address.startswith(exchange.lower() + "-"):
+                return exchange
+        return None
+
+    def settle(self, now):
+        self.market.apply_events(now)
+        for order in self.orders.values():
+            if order.state == "wait" and order.fill_at <= now:
+                self.fill(order)
+        for transfer in self.transfers:
+            if not transfer.done and transfer.done_at <= now:
+                transfer.done = True
+                if transfer.dest:
+                    self.add(transfer.dest, transfer.asset, transfer.amount - transfer.fee)
+
+    def price_of(self, exchange, symbol, quote_asset):
+        if exchange == "Binance" or quote_asset == "USDT":
+            return self.market.binance[symbol]
+        if symbol == "USDT":
+            return self.market.usdt
+        return self.market.upbit_price(symbol)
+
+    def fill(self, order):
+        """
+        Market orders fill at price with slippage, limit orders at their price. Fee is left out to keep balances exact.
+        """
+        slippage = self.config["slippage"]
+        if order.price:
+            price = order.price
+        else:
+            price = self.price_of(order.exchange, order.symbol, order.quote_asset)
+            price *= 1 + slippage if order.side == "buy" else 1 - slippage
+
+        quantity = order.amount / price if order.quote else order.amount
+        funds = quantity * price
+        try:
+            if order.side == "buy":
+                self.take(order.exchange, order.quote_asset, funds)
+                self.add(order.exchange, order.symbol, quantity)
+            else:
+                self.take(order.exchange, order.symbol, quantity)
+                self.add(order.exchange, order.quote_asset, funds)
+        except SimError:
+            order.state = "cancel"
+            return
+
+        order.state = "done"
+        order.filled = quantity
+        order.funds = funds
+        order.avg_price = price
+
+    def new_order(self, exchange, symbol, side, amount, price=None, quote=False, delay=None):
+        self.maybe_reject()
+        delay = self.config["fill_delay"] if delay is None else delay
+        order = Order(next(self.ids), exchange, symbol, side, amount, price, time.time() + delay, quote)
+        self.orders[order.id] = order
+        if delay == 0:
+            self.fill(order)
+            if order.state == "cancel":
+                raise SimError(400, "insufficient balance")
+        return order
+
+    def withdraw(self, exchange, asset, amount, address, tag=None, fee=None):
+        self.maybe_reject()
+        if fee is None:
+            fee = self.config["withdraw_fees"].get(asset, 0.0)
+        # Huobi charges fee on top of amount, Upbit and Binance take it out of amount.
+        fee_on_top = exchange == "Huobi"
+        self.take(exchange, asset, amount + fee if fee_on_top else amount)
+        transfer = Transfer(
+            next(self.ids), exchange, self.owner(address), asset, amount,
+            0.0 if fee_on_top else fee, address, tag, time.time() + self.config["withdraw_delay"]
+        )
+        self.transfers.append(transfer)
+        return transfer
+
+    def find_transfer(self, id):
+        for transfer in self.transfers:
+            if str(transfer.id) == str(id):
+                return transfer
+        raise SimError(404, "no withdraw " + str(id))
+
+    def stats(self):
+        return {
+            "tick_to_order": self.market.tick_to_order,
+            "event_to_order": self.market.event_to_order,
+            "messages": self.messages,
+            "requests": self.requests,
+            "balances": self.balances,
+            "futures": self.futures
+        }
+
+    # Upbit REST. Every parameter comes in query string.
+
+    def upbit_accounts(self, params):
+        return [
+            {"currency": asset, "balance": "%.8f" % amount, "locked": "0.0", "avg_buy_price": "0",
+             "avg_buy_price_modified": False, "unit_currency": "KRW"}
+            for asset, amount in self.balances["Upbit"].items()
+        ]
+
+    def upbit_order_json(self, order):
+        data = {
+            "uuid": str(order.id),
+            "side": "bid" if order.side == "buy" else "ask",
+            "ord_type": "price" if order.quote else "market",
+            "market": "KRW-" + order.symbol,
+            "state": order.state,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S+09:00", time.localtime(order.created)),
+            "volume": None if order.quote else str(order.amount),
+            "price": str(order.amount) if order.quote else None,
+            "executed_volume": str(order.filled),
+            "trades_count": 1 if order.state == "done" else 0
+        }
+        if order.state == "done":
+            data["trades"] = [{
+                "market": data["market"], "price": str(order.avg_price), "volume": str(order.filled),
+                "funds": str(order.funds), "side": data["side"]
+            }]
+        return data
+
+    def upbit_orders(self, params):
+        symbol = params["market"].split("-")[1]
+        if params["side"] == "bid":
+            order = self.new_order("Upbit", symbol, "buy", float(params["price"]), quote=True)
+        else:
+            order = self.new_order("Upbit", symbol, "sell", float(params["volume"]))
+        return self.upbit_order_json(order)
+
+    def upbit_order(self, params):
+        order = self.orders.get(int(params["uuid"]))
+        if order is None:
+            raise SimError(404, "order not found")
+        return self.upbit_order_json(order)
+
+    def upbit_generate_coin_address(self, params):
+        currency = params["currency"]
+        return {"currency": currency, "deposit_address": self.address("Upbit", currency), "secondary_address": None}
+
+    def upbit_deposits(self, params):
+        txids = params.get("txids[]", [])
+        deposits = []
+        for transfer in self.transfers:
+            if transfer.dest == "Upbit" and transfer.asset == params["currency"] and (not txids or transfer.txid in txids):
+                deposits.append({
+                    "type": "deposit", "uuid": str(transfer.id), "currency": transfer.asset, "txid": transfer.txid,
+                    "state": "ACCEPTED" if transfer.done else "PROCESSING",
+                    "amount": str(transfer.amount - transfer.fee), "fee": "0.0"
+                })
+        return deposits
+
+    def upbit_withdraw_json(self, transfer):
+        return {
+            "type": "withdraw", "uuid": str(transfer.id), "currency": transfer.asset, "txid": transfer.txid,
+            "state": "DONE" if transfer.done else "PROCESSING", "amount": str(transfer.amount),
+            "fee": str(transfer.fee),
+            "done_at": time.strftime("%Y-%m-%dT%H:%M:%S+09:00", time.localtime(transfer.done_at)) if transfer.done else None
+        }
+
+    def upbit_withdraws_coin(self, params):
+        transfer = self.withdraw(
+            "Upbit", params["currency"], float(params["amount"]), params["address"], params.get("secondary_address")
+        )
+        return self.upbit_withdraw_json(transfer)
+
+    def upbit_withdraw(self, params):
+        return self.upbit_withdraw_json(self.find_transfer(params["uuid"]))
+
+    # Binance REST. Signed parameters are taken as they are.
+
+    def binance_filters(self, symbol):
+        price = self.market.binance[symbol]
+        step = 0.00001 if price > 1000 else 0.01 if price > 10 else 0.1
+        return [
+            {"filterType": "PRICE_FILTER", "minPrice": "0.00000100", "maxPrice": "1000000.00", "tickSize": "0.00010000"},
+            {"filterType": "LOT_SIZE", "minQty": str(step), "maxQty": "9000000.00", "stepSize": str(step)},
+            {"filterType": "MIN_NOTIONAL", "minNotional": "10.00000000"}
+        ]
+
+    def binance_exchange_info(self, params):
+        return {"timezone": "UTC", "serverTime": int(time.time() * 1000), "symbols": [
+            {"symbol": symbol + "USDT", "status": "TRADING", "baseAsset": symbol, "baseAssetPrecision": 8,
+             "quoteAsset": "USDT", "quotePrecision": 8, "filters": self.binance_filters(symbol)}
+            for symbol in self.market.symbols
+        ]}
+
+    def binance_futures_exchange_info(self, params):
+        symbols = []
+        for symbol in self.market.symbols:
+            step = float(self.binance_filters(symbol)[1]["stepSize"])
+            symbols.append({
+                "symbol": symbol + "USDT", "status": "TRADING", "baseAsset": symbol, "quoteAsset": "USDT",
+                "pricePrecision": 4, "quantityPrecision": max(0, len(("%f" % step).rstrip("0").split(".")[1])),
+                "filters": self.binance_filters(symbol)
+            })
+        return {"timezone": "UTC", "serverTime": int(time.time() * 1000), "symbols": symbols}
+
+    def binance_depth(self, params):
+        price = self.market.binance[params["symbol"][:-4]]
+        levels = int(params.get("limit", 100))
+        return {
+            "lastUpdateId": next(self.ids),
+            "bids": [["%.8f" % (price * (1 - 0.0001 * (i + 1))), "100.0"] for i in range(levels)],
+            "asks": [["%.8f" % (price * (1 + 0.0001 * (i + 1))), "100.0"] for i in range(levels)]
+        }
+
+    def binance_ticker(self, params):
+        return [
+            {"symbol": symbol + "USDT", "lastPrice": "%.8f" % self.market.binance[symbol],
+             "quoteVolume": "%.2f" % self.config["quote_volumes"].get(symbol, 1e7)}
+            for symbol in self.market.symbols
+        ]
+
+    def binance_account(self, params):
+        return {
+            "canTrade": True, "canWithdraw": True, "canDeposit": True, "updateTime": int(time.time() * 1000),
+            "balances": [
+                {"asset": asset, "free": "%.8f" % amount, "locked": "0.00000000"}
+                for asset, amount in self.balances["Binance"].items()
+            ]
+        }
+
+    def binance_order(self, params):
+        symbol = params["symbol"][:-4]
+        self.market.ordered(symbol, time.time())
+        order = self.new_order("Binance", symbol, params["side"].lower(), float(params["quantity"]), delay=0)
+        return {
+            "symbol": params["symbol"], "orderId": order.id, "transactTime": int(time.time() * 1000),
+            "status": "FILLED", "type": "MARKET", "side": params["side"],
+            "executedQty": str(order.filled), "cummulativeQuoteQty": str(order.funds),
+            "fills": [{"price": str(order.avg_price), "qty": str(order.filled), "commission": "0", "commissionAsset": "BNB"}]
+        }
+
+    def binance_asset_detail(self, params):
+        return {"success": True, "assetDetail": {
+            symbol: {"minWithdrawAmount": "0", "depositStatus": True, "withdrawStatus": True,
+                     "withdrawFee": self.config["withdraw_fees"].get(symbol, 0.0)}
+            for symbol in self.market.symbols
+        }}
+
+    def binance_withdraw(self, params):
+        transfer = self.withdraw(
+            "Binance", params["asset"], float(params["amount"]), params["address"], params.get("addressTag")
+        )
+        return {"msg": "success", "success": True, "id": str(transfer.id)}
+
+    def binance_withdraw_history(self, params):
+        # status 4 : Processing, 6 : Completed
+        return {"success": True, "withdrawList": [
+            {"id": str(transfer.id), "amount": transfer.amount, "transactionFee": transfer.fee,
+             "address": transfer.address, "asset": transfer.asset, "txId": transfer.txid,
+             "applyTime": int(transfer.created * 1000), "status": 6 if transfer.done else 4}
+            for transfer in reversed(self.transfers)
+            if transfer.source == "Binance" and transfer.asset == params.get("asset", transfer.asset)
+        ]}
+
+    def binance_deposit_address(self, params):
+        asset = params["asset"]
+        return {"address": self.address("Binance", asset), "addressTag": "", "asset": asset, "success": True}
+
+    def binance_futures_transfer(self, params):
+        amount = float(params["amount"])
+        if int(params["type"]) == 1:
+            self.take("Binance", "USDT", amount)
+            self.futures["USDT"] += amount
+        else:
+            if amount > self.futures["USDT"] + 1e-9:
+                raise SimError(400, "insufficient futures balance")
+            self.futures["USDT"] -= amount
+            self.add("Binance", "USDT", amount)
+        return {"tranId": next(self.ids)}
+
+    def binance_futures_balance(self, params):
+        margin = sum(abs(quantity) * entry / self.leverage.get(symbol, 1)
+                     for symbol, (quantity, entry) in self.positions.items())
+        return [
+            {"accountAlias": "", "asset": "BNB", "balance": "0.00000000", "withdrawAvailable": "0.00000000"},
+            {"accountAlias": "", "asset": "USDT", "balance": "%.8f" % self.futures["USDT"],
+             "withdrawAvailable": "%.8f" % (self.futures["USDT"] - margin)}
+        ]
+
+    def binance_futures_leverage(self, params):
+        self.leverage[params["symbol"][:-4]] = int(params["leverage"])
+        return {"leverage": int(params["leverage"]), "maxNotionalValue": "1000000", "symbol": params["symbol"]}
+
+    def binance_futures_order(self, params):
+        self.maybe_reject()
+        symbol = params["symbol"][:-4]
+        price = self.market.binance[symbol]
+        quantity = float(params["quantity"]) * (1 if params["side"] == "BUY" else -1)
+
+        held, entry = self.positions.get(symbol, (0.0, price))
+        if held and (held > 0) != (quantity > 0):
+            # Closing part or all of the position realizes pnl.
+            closed = min(abs(held), abs(quantity))
+            self.futures["USDT"] += closed * (price - entry) * (1 if held > 0 else -1)
+        else:
+            entry = (abs(held) * entry + abs(quantity) * price) / (abs(held) + abs(quantity))
+        held += quantity
+        if abs(held) < 1e-12:
+            self.positions.pop(symbol, None)
+        else:
+            self.positions[symbol] = (held, entry)
+
+        return {"orderId": next(self.ids), "symbol": params["symbol"], "status": "FILLED", "side": params["side"],
+                "avgPrice": str(price), "executedQty": params["quantity"], "type": "MARKET"}
+
+    # Huobi REST. Assets are lower case in responses.
+
+    def huobi_accounts(self, params):
+        return {"status": "ok", "data": [
+            {"id": self.config["huobi_account_id"], "type": "spot", "subtype": "", "state": "working"}
+        ]}
+
+    def huobi_balance(self, params):
+        return {"status": "ok", "data": {
+            "id": self.config["huobi_account_id"], "type": "spot", "state": "working",
+            "list": [{"currency": asset.lower(), "type": "trade", "balance": "%.8f" % amount}
+                     for asset, amount in self.balances["Huobi"].items()]
+        }}
+
+    def huobi_symbol(self, symbol):
+        # btckrw -> (BTC, KRW), eosusdt -> (EOS, USDT)
+        for quote in ("usdt", "krw"):
+            if symbol.endswith(quote):
+                return symbol[:-len(quote)].upper(), quote.upper()
+        raise SimError(400, "unknown symbol " + symbol)
+
+    def huobi_price(self, base, quote):
+        if base == "USDT":
+            return self.market.usdt
+        if quote == "USDT":
+            return self.market.binance[base]
+        return self.market.upbit_price(base)
+
+    def huobi_depth(self, params):
+        price = self.huobi_price(*self.huobi_symbol(params["symbol"]))
+        levels = int(params.get("depth", 20))
+        return {"status": "ok", "ch": "market." + params["symbol"] + ".depth.step0", "ts": int(time.time() * 1000),
+                "tick": {"ts": int(time.time() * 1000), "version": next(self.ids),
+                         "bids": [[price * (1 - 0.0005 * (i + 1)), 100.0] for i in range(levels)],
+                         "asks": [[price * (1 + 0.0005 * (i + 1)), 100.0] for i in range(levels)]}}
+
+    def huobi_trade(self, params):
+        price = self.huobi_price(*self.huobi_symbol(params["symbol"]))
+        now = int(time.time() * 1000)
+        return {"status": "ok", "ch": "market." + params["symbol"] + ".trade.detail", "ts": now, "tick": {
+            "id": next(self.ids), "ts": now,
+            "data": [{"id": next(self.ids), "ts": now, "trade-id": next(self.ids), "amount": 1.0, "price": price,
+                      "direction": "buy"}]
+        }}
+
+    def huobi_place(self, params):
+        base, quote = self.huobi_symbol(params["symbol"])
+        side, kind = params["type"].split("-")
+        price = float(params["price"]) if kind == "limit" and params.get("price") else None
+        order = self.new_order("Huobi", base, side, float(params["amount"]), price)
+        return {"status": "ok", "data": str(order.id)}
+
+    def huobi_order(self, order_id):
+        order = self.orders.get(int(order_id))
+        if order is None:
+            raise SimError(404, "order not found")
+        state = {"wait": "submitted", "done": "filled", "cancel": "canceled"}[order.state]
+        filled = "%.8f" % order.filled
+        return {"status": "ok", "data": {
+            "id": order.id, "symbol": (order.symbol + order.quote_asset).lower(),
+            "account-id": self.config["huobi_account_id"], "amount": str(order.amount),
+            "price": str(order.price or 0), "created-at": int(order.created * 1000),
+            "type": order.side + ("-limit" if order.price else "-market"),
+            "field-amount": filled, "filled-amount": filled, "field-cash-amount": str(order.funds),
+            "filled-cash-amount": str(order.funds), "field-fees": "0", "filled-fees": "0",
+            "source": "api", "state": state
+        }}
+
+    def huobi_withdraw(self, params):
+        transfer = self.withdraw(
+            "Huobi", params["currency"].upper(), float(params["amount"]), params["address"],
+            params.get("addr-tag"), float(params.get("fee", 0))
+        )
+        return {"status": "ok", "data": transfer.id}
+
+    def huobi_deposit_withdraw(self, params):
+        kind = params.get("type", "withdraw")
+        currency = params.get("currency", "").upper()
+        records = []
+        for transfer in reversed(self.transfers):
+            mine = transfer.source == "Huobi" if kind == "withdraw" else transfer.dest == "Huobi"
+            if mine and (not currency or transfer.asset == currency):
+                records.append({
+                    "id": transfer.id, "type": kind, "currency": transfer.asset.lower(), "tx-hash": transfer.txid,
+                    "chain": transfer.asset.lower(), "amount": transfer.amount, "address": transfer.address,
+                    "address-tag": transfer.tag or "", "fee": transfer.fee,
+                    "state": ("confirmed" if transfer.done else "pre-transfer") if kind == "withdraw"
+                    else ("safe" if transfer.done else "confirming"),
+                    "created-at": int(transfer.created * 1000), "updated-at": int(time.time() * 1000)
+                })
+        return {"status": "ok", "data": records[:int(params.get("size", 100))]}
+
+    def huobi_deposit_address(self, params):
+        currency = params["currency"]
+        return {"code": 200, "data": [
+            {"userId": 1, "currency": currency, "address": self.address("Huobi", currency), "addressTag": "",
+             "chain": currency}
+        ]}
+
+    def huobi_timestamp(self, params):
+        return {"status": "ok", "data": int(time.time() * 1000)}
+
+
+def routes(sim, exchange):
+    """
+    {(method, path): handler(params)} of exchange. Huobi paths with ids are matched in RestHandler.route.
+    """
+    if exchange == "Upbit":
+        return {
+            ("GET", "/v1/accounts"): sim.upbit_accounts,
+            ("POST", "/v1/orders"): sim.upbit_orders,
+            ("GET", "/v1/order"): sim.upbit_order,
+            ("GET", "/v1/deposits"): sim.upbit_deposits,
+            ("POST", "/v1/deposits/generate_coin_address"): sim.upbit_generate_coin_address,
+            ("GET", "/v1/deposits/coin_address"): sim.upbit_generate_coin_address,
+            ("POST", "/v1/withdraws/coin"): sim.upbit_withdraws_coin,
+            ("GET", "/v1/withdraw"): sim.upbit_withdraw,
+        }
+    if exchange == "Binance":
+        return {
+            ("GET", "/api/v3/ping"): lambda params: {},
+            ("GET", "/api/v3/time"): lambda params: {"serverTime": int(time.time() * 1000)},
+            ("GET", "/api/v3/exchangeInfo"): sim.binance_exchange_info,
+            ("GET", "/api/v3/depth"): sim.binance_depth,
+            ("GET", "/api/v3/ticker/24hr"): sim.binance_ticker,
+            ("GET", "/api/v3/account"): sim.binance_account,
+            ("POST", "/api/v3/order"): sim.binance_order,
+            ("GET", "/wapi/v3/assetDetail.html"): sim.binance_asset_detail,
+            ("POST", "/wapi/v3/withdraw.html"): sim.binance_withdraw,
+            ("GET", "/wapi/v3/withdrawHistory.html"): sim.binance_withdraw_history,
+            ("GET", "/wapi/v3/depositAddress.html"): sim.binance_deposit_address,
+            ("POST", "/sapi/v1/futures/transfer"): sim.binance_futures_transfer,
+            ("GET", "/fapi/v1/exchangeInfo"): sim.binance_futures_exchange_info,
+            ("GET", "/fapi/v1/balance"): sim.binance_futures_balance,
+            ("POST", "/fapi/v1/leverage"): sim.binance_futures_leverage,
+            ("POST", "/fapi/v1/order"): sim.binance_futures_order,
+        }
+    return {
+        ("GET", "/v1/common/timestamp"): sim.huobi_timestamp,
+        ("GET", "/v1/account/accounts"): sim.huobi_accounts,
+        ("GET", "/market/depth"): sim.huobi_depth,
+        ("GET", "/market/trade"): sim.huobi_trade,
+        ("POST", "/v1/order/orders/place"): sim.huobi_place,
+        ("POST", "/v1/dw/withdraw/api/create"): sim.huobi_withdraw,
+        ("GET", "/v1/query/deposit-withdraw"): sim.huobi_deposit_withdraw,
+        ("GET", "/v2/account/deposit/address"): sim.huobi_deposit_address,
+    }
+
+
+class RestHandler(BaseHTTPRequestHandler):
+    sim = None
+    exchange = None
+    routes = {}
+
+    def log_message(self, format, *args):
+        log.debug(self.exchange + " " + format % args)
+
+    def do_GET(self):
+        self.handle_request("GET")
+
+    def do_POST(self):
+        self.handle_request("POST")
+
+    def do_DELETE(self):
+        self.handle_request("DELETE")
+
+    def params(self, url):
+        # txids[] stays a list, everything else is a single value.
+        params = {key: values if key.endswith("[]") else values[0]
+                  for key, values in parse_qs(url.query, keep_blank_values=True).items()}
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            body = self.rfile.read(length).decode()
+            if body.lstrip().startswith("{"):
+                params.update(json.loads(body))
+            else:
+                params.update({key: values[0] for key, values in parse_qs(body, keep_blank_values=True).items()})
+        return params
+
+    def route(self, method, path):
+        handler = self.routes.get((method, path))
+        if handler:
+            return handler
+        parts = path.strip("/").split("/")
+        if self.exchange == "Huobi" and method == "GET":
+            # /v1/order/orders/{order-id} and /v1/account/accounts/{account-id}/balance
+            if parts[:3] == ["v1", "order", "orders"] and len(parts) == 4:
+                return lambda params: self.sim.huobi_order(parts[3])
+            if parts[:3] == ["v1", "account", "accounts"] and parts[-1] == "balance":
+                return self.sim.huobi_balance
+        return None
+
+    def handle_request(self, method):
+        config = self.sim.config
+        time.sleep(config["rest_latency"] + random.random() * config["rest_jitter"])
+
+        url = urlparse(self.path)
+        params = self.params(url)
+        endpoint = method + " " + url.path
+
+        if url.path == "/sim/stats":
+            with self.sim.lock:
+                return self.reply(200, self.sim.stats())
+
+        handler = self.route(method, url.path)
+        if handler is None:
+            return self.reply(404, self.error(404, "unknown endpoint " + endpoint))
+
+        with self.sim.lock:
+            self.sim.requests[self.exchange + " " + endpoint] = self.sim.requests.get(self.exchange + " " + endpoint, 0) + 1
+            self.sim.settle(time.time())
+            try:
+                body = handler(params)
+                status = 200
+            except SimError as e:
+                status, body = e.status, self.error(e.status, e.body)
+            except (KeyError, ValueError) as e:
+                status, body = 400, self.error(400, "bad parameter " + repr(e))
+        self.reply(status, body)
+
+    def error(self, status, message):
+        # Error shape of each exchange.
+        if self.exchange == "Upbit":
+            return {"error": {"name": "simulator", "message": message}}
+        if self.exchange == "Binance":
+            return {"code": -2010, "msg": message}
+        return {"status": "error", "err-code": "simulator", "err-msg": message}
+
+    def reply(self, status, body):
+        data = json.dumps(body).encode()
+        # Huobi answers errors with 200 and status error.
+        self.send_response(200 if self.exchange == "Huobi" else status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class FeedServer:
+    """
+    Websocket feeds of every exchange on one port, told apart by path.
+    """
+    def __init__(self, sim, host, port):
+        self.sim = sim
+        self.host = host
+        self.port = port
+
+    def event_ts(self, now):
+        config = self.sim.config
+        return now - config["feed_latency"] - random.random() * config["feed_jitter"]
+
+    async def handler(self, websocket, path=None):
+        # websockets before 10 passes path, newer versions keep it on the request.
+        if path is None:
+            path = websocket.request.path if hasattr(websocket, "request") else websocket.path
+        try:
+            if path.startswith("/websocket/v1"):
+                await self.upbit(websocket)
+            elif path.startswith("/ws/"):
+                await self.binance(websocket, path[4:].split("/"))
+            elif path.startswith("/ws"):
+                await self.huobi(websocket)
+        except websockets.ConnectionClosed:
+            pass
+
+    async def pace(self, exchange, symbols, send):
+        """
+        Call send(symbol, now) for every symbol message_rate times a second.
+        """
+        interval = 1 / self.sim.config["message_rate"][exchange]
+        loop = asyncio.get_event_loop()
+        next_at = loop.time()
+        while True:
+            now = time.time()
+            self.sim.market.apply_events(now)
+            for symbol in symbols:
+                await send(symbol, now)
+            self.sim.messages[exchange] += len(symbols)
+            next_at += interval
+            await asyncio.sleep(max(0.0, next_at - loop.time()))
+
+    async def upbit(self, websocket):
+        # [{"ticket": "test"}, {"type": "ticker", "codes": ["KRW-ADA"]}, {"type": "orderbook", ...}]
+        request = json.loads(await websocket.recv())
+        codes = []
+        for item in request:
+            if item.get("type") == "ticker":
+                codes = [code for code in item["codes"] if code[4:] in self.sim.market.binance]
+        market = self.sim.market
+
+        async def send(code, now):
+            symbol = code[4:]
+            ts = self.event_ts(now)
+            price = market.upbit_price(symbol)
+            message = {
+                "type": "ticker", "code": code, "trade_price": price, "trade_volume": round(random.random() * 100, 8),
+                "trade_timestamp": int(ts * 1000), "timestamp": int(ts * 1000), "ask_bid": "BID",
+                "market_state": "ACTIVE", "stream_type": "REALTIME"
+            }
+            market.sent_upbit(symbol, now, ts)
+            # Upbit sends binary frames.
+            await websocket.send(json.dumps(message, separators=(",", ":")).encode())
+
+        await self.pace("Upbit", codes, send)
+
+    async def binance(self, websocket, streams):
+        # adausdt@aggTrade. Depth streams get no messages, the simulator has no book.
+        symbols = [stream.split("@")[0][:-4].upper() for stream in streams if stream.endswith("@aggTrade")]
+        symbols = [symbol for symbol in symbols if symbol in self.sim.market.binance]
+        trade_ids = itertools.count(1)
+
+        async def send(symbol, now):
+            ts = int(self.event_ts(now) * 1000)
+            trade_id = next(trade_ids)
+            message = {
+                "e": "aggTrade", "E": ts, "s": symbol + "USDT", "a": trade_id,
+                "p": "%.8f" % self.sim.market.step(symbol), "q": "%.8f" % (random.random() * 100),
+                "f": trade_id, "l": trade_id, "T": ts, "m": random.random() < 0.5, "M": True
+            }
+            await websocket.send(json.dumps(message, separators=(",", ":")))
+
+        if symbols:
+            await self.pace("Binance", symbols, send)
+        else:
+            await websocket.wait_closed()
+
+    async def huobi(self, websocket):
+        # {"sub": "market.usdtkrw.trade.detail"}
+        request = json.loads(await websocket.recv())
+        channel = request["sub"]
+        await websocket.send(gzip.compress(json.dumps(
+            {"id": request.get("id"), "status": "ok", "subbed": channel, "ts": int(time.time() * 1000)}).encode()))
+
+        async def ping():
+            while True:
+                await asyncio.sleep(5)
+                await websocket.send(gzip.compress(json.dumps({"ping": int(time.time() * 1000)}).encode()))
+
+        async def send(_, now):
+            ts = int(self.event_ts(now) * 1000)
+            message = {"ch": channel, "ts": ts, "tick": {"id": ts, "ts": ts, "data": [
+                {"id": ts, "ts": ts, "tradeId": ts, "amount": round(random.random() * 1000, 2),
+                 "price": self.sim.market.usdt, "direction": "buy"}
+            ]}}
+            await websocket.send(gzip.compress(json.dumps(message).encode()))
+
+        async def pongs():
+            # {"pong": ts} replies are read and dropped.
+            async for _ in websocket:
+                pass
+
+        await asyncio.gather(self.pace("Huobi", ["usdtkrw"], send), ping(), pongs())
+
+    async def serve(self):
+        async with websockets.serve(self.handler, self.host, self.port, max_size=None):
+            log.info("Feeds on ws://" + self.host + ":" + str(self.port))
+            await asyncio.Future()
+
+    def run(self):
+        asyncio.run(self.serve())
+
+
+def start(config=None, host="127.0.0.1", port=8100):
+    """
+    Start every server on background threads. Returns (Simulator, settings to point the bot at it).
+    """
+    config = dict(DEFAULT_CONFIG, **(config or {}))
+    sim = Simulator(config)
+
+    for offset, exchange in enumerate(("Upbit", "Binance", "Huobi")):
+        handler = type(exchange + "Handler", (RestHandler,), {"sim": sim, "exchange": exchange,
+                                                              "routes": routes(sim, exchange)})
+        server = ThreadingHTTPServer((host, port + offset), handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True, name=exchange + " REST").start()
+
+    threading.Thread(target=FeedServer(sim, host, port + 3).run, daemon=True, name="feeds").start()
+
+    base = "http://" + host + ":"
+    ws = "ws://" + host + ":" + str(port + 3)
+    settings = {
+        "upbit_url": base + str(port),
+        "binance_url": base + str(port + 1),
+        "huobi_url": base + str(port + 2),
+        "upbit_ws_url": ws + "/websocket/v1",
+        "binance_ws_url": ws + "/ws/",
+        "huobi_ws_url": ws + "/ws",
+        "market_list": config["market_list"]
+    }
+    return sim, settings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local Upbit, Binance and Huobi simulator.")
+    parser.add_argument("--config", help="json file overriding DEFAULT_CONFIG")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.INFO)
+
+    config = {}
+    if args.config:
+        with open(args.config) as f:
+            config = json.load(f)
+
+    sim, settings = start(config, args.host, args.port)
+    print(json.dumps(settings, indent=4))
+
+    while True:
+        time.sleep(10)
+        with sim.lock:
+            log.info("messages " + str(sim.messages) + " tick_to_order " + str(sim.market.tick_to_order))
+
+
+if __name__ == '__main__':
+    main()
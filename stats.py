@@ -0,0 +1,295 @@
+import re
+import threading
+
+import numpy as np
+
+PERCENTILE_DEV = re.compile(r"^p(\d{1,2})_dev$")
+
+
+class RollingStats:
+    """
+    Rolling premium statistics of every symbol over its last window samples.
+
+    1. Samples go to a ring buffer per symbol in one (symbols, window) array. Memory never grows past it.
+    2. Sum and sum of squares are updated with the new and the evicted sample, so mean and std are O(1).
+        They are recomputed from the buffer once per window samples, so float error doesn't pile up.
+    3. EWMA with alpha is O(1) too.
+    4. Each symbol counts its window in buckets of resolution percent over [-limit, limit], kept in a Fenwick tree.
+        Adding, evicting and finding the k-th sample are O(log buckets), for every symbol at once in update_all.
+        Median and percentiles are exact to resolution. Premiums past limit count in the edge bucket.
+
+    update_all() takes the premium array of PriceSnapshot.live_premium, update() one symbol from a feed thread.
+    """
+    def __init__(self, market_list, window=3600, alpha=0.05, resolution=0.01, limit=20.0):
+        self.market_list = list(market_list)
+        n = len(self.market_list)
+        self.window = window
+        self.alpha = alpha
+        self.resolution = resolution
+        self.limit = limit
+
+        self.buffer = np.zeros((n, window))
+        self.pos = np.zeros(n, dtype=np.int64)  # next slot
+        self.count = np.zeros(n, dtype=np.int64)  # samples in window
+        self.sum = np.zeros(n)
+        self.sumsq = np.zeros(n)
+        self.ewma = np.zeros(n)
+        self.median = np.zeros(n)
+        self.last = np.zeros(n)
+
+        # Fenwick tree of bucket counts per symbol, 1-indexed. top is the highest power of two within buckets.
+        self.buckets = int(round(2 * limit / resolution)) + 1
+        self.tree = np.zeros((n, self.buckets + 1), dtype=np.int32)
+        self.top = 1 << (self.buckets.bit_length() - 1)
+        # Same rows as memoryviews for update() of one symbol. Their items are plain ints, numpy scalars cost far more.
+        self.tree_rows = [memoryview(row) for row in self.tree]
+
+        self.lock = threading.Lock()
+
+    def update(self, i, value):
+        with self.lock:
+            self._update(i, float(value))
+
+    def update_all(self, premium, valid=None):
+        """
+        Add premium[i] of every symbol, or only where valid is True.
+        Everything is updated in one vectorized pass.
+        """
+        with self.lock:
+            idx = np.arange(len(self.market_list)) if valid is None else np.flatnonzero(valid)
+            if len(idx) == 0:
+                return
+            values = premium[idx]
+            pos = self.pos[idx]
+            full = self.count[idx] == self.window
+            old = np.where(full, self.buffer[idx, pos], 0.0)
+
+            self.buffer[idx, pos] = values
+            self.sum[idx] += values - old
+            self.sumsq[idx] += values * values - old * old
+            count = np.minimum(self.count[idx] + 1, self.window)
+            self.count[idx] = count
+            ewma = self.ewma[idx]
+            self.ewma[idx] = np.where(count == 1, values, ewma + self.alpha * (values - ewma))
+            self.last[idx] = values
+
+            if full.any():
+                self._add(idx[full], self._bucket(old[full]), -1)
+            self._add(idx, self._bucket(values), 1)
+            self.median[idx] = self._kth(idx, count // 2)
+
+            pos += 1
+            wrapped = pos == self.window
+            if wrapped.any():
+                # Once per window, start the sums again from the buffer.
+                rows = idx[wrapped]
+                self.sum[rows] = self.buffer[rows].sum(axis=1)
+                self.sumsq[rows] = np.einsum("ij,ij->i", self.buffer[rows], self.buffer[rows])
+                pos[wrapped] = 0
+            self.pos[idx] = pos
+
+    def _update(self, i, value):
+        pos = self.pos[i]
+        count = self.count[i]
+        tree = self.tree_rows[i]
+
+        if count == self.window:
+            old = self.buffer[i, pos]
+            self.sum[i] -= old
+            self.sumsq[i] -= old * old
+            self._add_one(tree, self._bucket_one(old), -1)
+        else:
+            count += 1
+            self.count[i] = count
+
+        self.buffer[i, pos] = value
+        self.sum[i] += value
+        self.sumsq[i] += value * value
+        self._add_one(tree, self._bucket_one(value), 1)
+
+        self.ewma[i] = value if count == 1 else self.ewma[i] + self.alpha * (value - self.ewma[i])
+        self.median[i] = self._kth_one(tree, count // 2)
+        self.last[i] = value
+
+        pos += 1
+        if pos == self.window:
+            pos = 0
+            # Once per window, start the sums again from the buffer.
+            self.sum[i] = self.buffer[i].sum()
+            self.sumsq[i] = np.dot(self.buffer[i], self.buffer[i])
+        self.pos[i] = pos
+
+    def _bucket(self, value):
+        return np.clip(np.rint((value + self.limit) / self.resolution), 0, self.buckets - 1).astype(np.int64)
+
+    def _bucket_one(self, value):
+        return min(max(int(round((value + self.limit) / self.resolution)), 0), self.buckets - 1)
+
+    def _add(self, rows, buckets, delta):
+        # Rows are distinct, so plain fancy index assignment adds every one.
+        i = buckets + 1
+        while len(i):
+            self.tree[rows, i] += delta
+            i = i + (i & -i)
+            inside = i <= self.buckets
+            rows, i = rows[inside], i[inside]
+
+    def _add_one(self, tree, bucket, delta):
+        i = bucket + 1
+        while i <= self.buckets:
+            tree[i] += delta
+            i += i & -i
+
+    def _kth(self, rows, ranks):
+        """
+        Value of the sample at 0-based rank of every row, by binary lifting down the tree.
+        """
+        pos = np.zeros(len(rows), dtype=np.int64)
+        remaining = np.asarray(ranks, dtype=np.int64) + 1
+        step = self.top
+        while step:
+            nxt = pos + step
+            counts = self.tree[rows, np.minimum(nxt, self.buckets)]
+            below = (nxt <= self.buckets) & (counts < remaining)
+            pos[below] = nxt[below]
+            remaining -= np.where(below, counts, 0)
+            step >>= 1
+        return pos * self.resolution - self.limit
+
+    def _kth_one(self, tree, rank):
+        pos = 0
+        remaining = rank + 1
+        step = self.top
+        while step:
+            nxt = pos + step
+            if nxt <= self.buckets and tree[nxt] < remaining:
+                pos = nxt
+                remaining -= tree[nxt]
+            step >>= 1
+        return pos * self.resolution - self.limit
+
+    def mean(self):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(self.count > 0, self.sum / self.count, 0.0)
+
+    def std(self):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean = self.sum / self.count
+            var = self.sumsq / self.count - mean * mean
+        return np.sqrt(np.where(self.count > 1, np.maximum(var, 0.0), 0.0))
+
+    def percentile(self, q):
+        """
+        q(0-100) percentile of every symbol's window. 0 for symbols without samples.
+        """
+        with self.lock:
+            out = np.zeros(len(self.market_list))
+            rows = np.flatnonzero(self.count)
+            if len(rows):
+                count = self.count[rows]
+                out[rows] = self._kth(rows, np.minimum(count - 1, (q / 100 * count).astype(np.int64)))
+            return out
+
+    def zscore(self, premium):
+        std = self.std()
+        with np.errstate(divide="ignore", invalid="ignore"):
+            z = (premium - self.mean()) / std
+        z[std == 0] = 0.0
+        return z
+
+    def stat(self, name, premium):
+        """
+        Signed statistic of premium against the window.
+        premium, z, ewma_dev(premium - ewma), median_dev(premium - median) or pNN_dev(premium - NN percentile)
+        """
+        if name == "premium":
+            return premium
+        if name == "z":
+            return self.zscore(premium)
+        if name == "ewma_dev":
+            return premium - self.ewma
+        if name == "median_dev":
+            return premium - self.median
+        match = PERCENTILE_DEV.match(name)
+        if match:
+            return premium - self.percentile(int(match.group(1)))
+        raise ValueError("Unknown premium statistic " + name)
+
+    def stat_one(self, name, i, premium):
+        """
+        stat() of a single symbol without touching the others. Used on every tick.
+        """
+        if name == "premium":
+            return premium
+        if name == "z":
+            count = self.count[i]
+            if count < 2:
+                return 0.0
+            mean = self.sum[i] / count
+            std = max(self.sumsq[i] / count - mean * mean, 0.0) ** 0.5
+            return (premium - mean) / std if std > 0 else 0.0
+        if name == "ewma_dev":
+            return premium - self.ewma[i]
+        if name == "median_dev":
+            return premium - self.median[i]
+        match = PERCENTILE_DEV.match(name)
+        if match:
+            with self.lock:
+                count = int(self.count[i])
+                if count == 0:
+                    return premium
+                return premium - self._kth_one(self.tree_rows[i], min(count - 1, int(int(match.group(1)) / 100 * count)))
+        raise ValueError("Unknown premium statistic " + name)
+
+    def summary(self, symbol):
+        i = self.market_list.index(symbol)
+        return {
+            "count": int(self.count[i]),
+            "mean": round(float(self.mean()[i]), 4),
+            "std": round(float(self.std()[i]), 4),
+            "ewma": round(float(self.ewma[i]), 4),
+            "median": round(float(self.median[i]), 4)
+        }
+
+
+class Trigger:
+    """
+    Trade condition over RollingStats instead of a fixed PREMIUM_RATIO.
+
+    conditions looks like this {"z": 3.0, "median_dev": 0.5, "premium": 1.0}
+    Premium triggers when every statistic is at least its value, reverse premium when every one is at most -value.
+    Symbols with fewer than min_samples samples never trigger, their window doesn't mean much yet.
+    """
+    def __init__(self, stats, conditions, min_samples=60):
+        self.stats = stats
+        self.conditions = dict(conditions)
+        self.min_samples = min_samples
+
+        # Fail on start, not on the first check.
+        for name in self.conditions:
+            stats.stat(name, np.zeros(len(stats.market_list)))
+
+    def check(self, premium):
+        """
+        (premium mask, reverse mask) of every symbol.
+        """
+        up = self.stats.count >= self.min_samples
+        down = up.copy()
+        for name, value in self.conditions.items():
+            stat = self.stats.stat(name, premium)
+            up &= stat >= value
+            down &= stat <= -value
+        return up, down
+
+    def check_one(self, i, premium):
+        """
+        1 for premium, -1 for reverse premium and 0 otherwise, for a single symbol.
+        """
+        if self.stats.count[i] < self.min_samples:
+            return 0
+        up = down = True
+        for name, value in self.conditions.items():
+            stat = self.stats.stat_one(name, i, premium)
+            up = up and stat >= value
+            down = down and stat <= -value
+        return 1 if up else -1 if down else 0
@@ -0,0 +1,168 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+
+class PremiumStream:
+    """
+    Latest premium and prices for dashboards and alerting bots, served from memory away from Trader.
+
+    1. Its own thread takes a PriceStore snapshot every interval seconds into its own PriceSnapshot.
+        Snapshot readers never take the write lock, so feeds and Trader.monitor never wait on subscribers.
+    2. Symbols whose premium, prices or staleness changed since the last round go out as one delta.
+        The delta is encoded once and queued for every subscriber. Nothing is sent when nothing changed.
+    3. A websocket subscriber gets the full state first and deltas after it. GET /snapshot returns the full state.
+    4. Every subscriber has a queue of max_queue messages. One that falls that far behind is disconnected
+        instead of holding memory, it gets a fresh snapshot when it connects again.
+
+    Premium is rounded like PriceSnapshot.premium_data and is null while a price is missing.
+    Symbols are [premium, upbit price, binance price, stale]. Messages look like this
+    {"type": "snapshot", "seq": 12, "ts": 1600000000.0, "usdt": 1130.0, "symbols": {"ADA": [4.2, 1400.0, 1.1, false]}}
+    {"type": "delta", "seq": 13, "ts": 1600000000.2, "usdt": 1130.0, "symbols": {"ADA": [4.3, 1401.0, 1.1, false]}}
+    """
+    def __init__(self, prices, max_age=30, interval=0.2, max_queue=256):
+        self.prices = prices
+        self.market_list = list(prices.market_list)
+        self.max_age = max_age
+        self.interval = interval
+        self.max_queue = max_queue
+
+        self.snapshot = None
+        n = len(self.market_list)
+        self.last_premium = np.full(n, np.nan)
+        self.last_upbit = np.zeros(n)
+        self.last_binance = np.zeros(n)
+        self.last_stale = np.zeros(n, dtype=bool)
+
+        self.seq = 0
+        self.ts = 0.0
+        self.usdt = 0.0
+        self.symbols = {}  # symbol -> [premium, upbit, binance, stale]
+        self.lock = threading.Lock()  # symbols is read by the HTTP threads
+
+        self.subscribers = set()  # asyncio.Queue of every websocket
+
+    def update(self):
+        """
+        One round. Returns the delta message or None when nothing changed.
+        """
+        self.snapshot = self.prices.snapshot(self.snapshot)
+        snapshot = self.snapshot
+        premium, stale = snapshot.live_premium(self.max_age)
+
+        # No price yet gives inf or nan. nan never equals itself, so keep those as a plain nan and compare them apart.
+        valid = (snapshot.upbit != 0) & (snapshot.binance != 0) & (snapshot.usdt[0] != 0)
+        premium = np.where(valid, np.round(premium, 3), np.nan)
+        changed = ((premium != self.last_premium) & ~(np.isnan(premium) & np.isnan(self.last_premium))) \
+            | (snapshot.upbit != self.last_upbit) | (snapshot.binance != self.last_binance) | (stale != self.last_stale)
+        usdt = float(snapshot.usdt[0])
+        if not changed.any() and usdt == self.usdt:
+            return None
+
+        np.copyto(self.last_premium, premium)
+        np.copyto(self.last_upbit, snapshot.upbit)
+        np.copyto(self.last_binance, snapshot.binance)
+        np.copyto(self.last_stale, stale)
+
+        delta = {}
+        for i in np.flatnonzero(changed).tolist():
+            delta[self.market_list[i]] = [
+                None if np.isnan(premium[i]) else float(premium[i]),
+                float(snapshot.upbit[i]), float(snapshot.binance[i]), bool(stale[i])
+            ]
+        with self.lock:
+            self.seq += 1
+            self.ts = time.time()
+            self.usdt = usdt
+            self.symbols.update(delta)
+            return {"type": "delta", "seq": self.seq, "ts": self.ts, "usdt": usdt, "symbols": delta}
+
+    def full(self):
+        with self.lock:
+            return {"type": "snapshot", "seq": self.seq, "ts": self.ts, "usdt": self.usdt, "symbols": dict(self.symbols)}
+
+    def publish(self, message):
+        data = json.dumps(message, separators=(",", ":"))
+        for queue in list(self.subscribers):
+            try:
+                queue.put_nowait(data)
+            except asyncio.QueueFull:
+                # None tells the sender to hang up.
+                queue.get_nowait()
+                queue.put_nowait(None)
+                self.subscribers.discard(queue)
+
+    async def produce(self):
+        while True:
+            try:
+                message = self.update()
+                if message and self.subscribers:
+                    self.publish(message)
+            except Exception as e:
+                log.error("Premium stream update failed : " + repr(e))
+            await asyncio.sleep(self.interval)
+
+    async def handler(self, websocket, path=None):
+        import websockets
+
+        queue = asyncio.Queue(self.max_queue)
+        # Same loop as produce(), so no delta can come between the snapshot and the subscription.
+        queue.put_nowait(json.dumps(self.full(), separators=(",", ":")))
+        self.subscribers.add(queue)
+        try:
+            while True:
+                data = await queue.get()
+                if data is None:
+                    log.warning("Premium stream subscriber fell behind. Disconnected.")
+                    break
+                await websocket.send(data)
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            self.subscribers.discard(queue)
+
+    async def serve(self, host, port):
+        import websockets
+
+        async with websockets.serve(self.handler, host, port):
+            log.info("Premium stream on ws://" + host + ":" + str(port))
+            await self.produce()
+
+    def start(self, port, ws_port=None, host="127.0.0.1"):
+        """
+        GET /snapshot on http://host:port and the websocket stream on ws://host:ws_port, port + 1 by default.
+        """
+        stream = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                if urlparse(self.path).path != "/snapshot":
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                body = json.dumps(stream.full(), separators=(",", ":")).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True, name="premium http").start()
+        log.info("Premium snapshot on http://" + host + ":" + str(port) + "/snapshot")
+
+        ws_port = port + 1 if ws_port is None else ws_port
+        threading.Thread(target=lambda: asyncio.run(self.serve(host, ws_port)), daemon=True, name="premium stream").start()
+        return server
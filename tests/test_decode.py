@@ -0,0 +1,46 @@
+import time
+
+import pytest
+
+from decode import Decoder, FieldExtractor
+from prices import PriceStore
+from ws import UpbitWS
+
+FIELDS = ("code", "trade_price", "trade_timestamp", "trade_volume")
+
+
+def ticker(price="1400.0", timestamp=None):
+    timestamp = str(int(time.time() * 1000)) if timestamp is None else timestamp
+    return ('{"type":"ticker","code":"KRW-ADA","trade_price":' + price + ',"trade_timestamp":' + timestamp +
+            ',"trade_volume":12.5,"stream_type":"REALTIME"}')
+
+
+def test_extractor_returns_none_for_values_that_are_not_numbers_or_strings():
+    extractor = FieldExtractor(["a", "b", "c", "d", "e"])
+    message = '{"a":null,"b":true,"c":"x","d":1.5,"e":[1,2]}'
+    assert extractor.extract(message) == [None, None, "x", 1.5, None]
+    assert extractor.extract(message.encode()) == [None, None, "x", 1.5, None]
+
+
+@pytest.mark.parametrize("extract", [True, False])
+@pytest.mark.parametrize("as_bytes", [True, False])
+def test_decoder_drops_messages_with_null_fields(extract, as_bytes):
+    decoder = Decoder(backend="json", fields=FIELDS, extract=extract)
+    for message in (ticker(price="null"), ticker(timestamp="null")):
+        assert decoder.decode(message.encode() if as_bytes else message) is None
+
+    values = decoder.decode(ticker(timestamp="1600000000000"))
+    assert values == ["KRW-ADA", 1400.0, 1600000000000, 12.5]
+
+
+@pytest.mark.parametrize("extract", [True, False])
+def test_upbit_skips_ticker_with_null_price(extract):
+    prices = PriceStore(["ADA"])
+    feed = UpbitWS("Upbit", prices, {"market_list": ["ADA"], "json_backend": "json", "extract_fields": extract})
+
+    feed.handle(ticker(price="null").encode())
+    feed.handle(ticker(timestamp="null").encode())
+    assert prices.snapshot().upbit.tolist() == [0.0]
+
+    feed.handle(ticker().encode())
+    assert prices.snapshot().upbit.tolist() == [1400.0]
@@ -0,0 +1,64 @@
+import os
+import time
+
+from prices import PriceStore
+from recorder import UPBIT, BINANCE, HUOBI
+from ring import TickRing, RingReader
+from shared_feed import SharedFeedClient
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_late_client_gets_prices_written_before_attach():
+    name = "test_feed_" + str(os.getpid())
+    feed_market_list = ["ADA", "XRP", "BTC"]
+    rings = {exchange: TickRing.create(1024, name + "_" + exchange.lower()) for exchange in ("Upbit", "Binance", "Huobi")}
+    try:
+        now = time.time()
+        # Ticks written before the client attaches. XRP ticks twice, only the last one counts.
+        rings["Upbit"].write(UPBIT, 0, now, now, 1400.0)
+        rings["Upbit"].write(UPBIT, 1, now, now, 1000.0)
+        rings["Upbit"].write(UPBIT, 1, now, now, 1010.0)
+        rings["Binance"].write(BINANCE, 0, now, now, 1.1)
+        rings["Binance"].write(BINANCE, 1, now, now, 0.8)
+        rings["Huobi"].write(HUOBI, len(feed_market_list), now, now, 1130.0)
+
+        prices = PriceStore(["XRP", "ADA"])
+        client = SharedFeedClient(name, prices)
+        client.attach({
+            "market_list": feed_market_list,
+            "rings": {exchange: ring.name for exchange, ring in rings.items()},
+            "pid": os.getpid(),
+            "started": now
+        })
+        try:
+            assert wait_for(lambda: prices.snapshot().ready())
+            snapshot = prices.snapshot()
+            assert snapshot.upbit.tolist() == [1010.0, 1400.0]
+            assert snapshot.binance.tolist() == [0.8, 1.1]
+            assert snapshot.usdt[0] == 1130.0
+        finally:
+            client.stop()
+    finally:
+        for ring in rings.values():
+            ring.close()
+
+
+def test_reader_starts_at_the_end_by_default():
+    ring = TickRing.create(1024, "test_ring_" + str(os.getpid()))
+    try:
+        now = time.time()
+        ring.write(BINANCE, 0, now, now, 1.1)
+        prices = PriceStore(["ADA"])
+        reader = RingReader([ring], prices)
+        ring.write(BINANCE, 0, now, now, 1.2)
+        assert [tick["price"] for tick in reader.cursors[0].read()] == [1.2]
+    finally:
+        ring.close()
@@ -0,0 +1,82 @@
+import argparse
+import json
+from collections import defaultdict
+
+import numpy as np
+
+PERCENTILES = (50, 95, 99)
+
+
+def read_spans(path, since=None):
+    """
+    Spans written by phases.SpanSink. Broken lines from a crash mid write are skipped.
+    """
+    spans = []
+    with open(path) as f:
+        for line in f:
+            try:
+                span = json.loads(line)
+            except ValueError:
+                continue
+            if since is None or span["start"] >= since:
+                spans.append(span)
+    return spans
+
+
+def aggregate(spans, by=None):
+    """
+    Duration percentiles of every span name, split by the by attribute when given.
+    {("binance_withdraw_confirm", "ADA"): {"count": 12, "p50": 301.2, "p95": 612.0, "p99": 640.5, "max": 642.1, "errors": 0}}
+    """
+    durations = defaultdict(list)
+    errors = defaultdict(int)
+    for span in spans:
+        key = (span["name"], span.get(by)) if by else (span["name"],)
+        durations[key].append(span["duration"])
+        if "error" in span:
+            errors[key] += 1
+
+    report = {}
+    for key, values in durations.items():
+        values = np.array(values)
+        row = {"count": len(values)}
+        for p, value in zip(PERCENTILES, np.percentile(values, PERCENTILES)):
+            row["p" + str(p)] = round(float(value), 3)
+        row["max"] = round(float(values.max()), 3)
+        row["errors"] = errors[key]
+        report[key] = row
+    return report
+
+
+def slowest(spans, name, n):
+    """
+    n slowest spans of name, so a bad p99 can be looked up by trace_id.
+    """
+    return sorted((span for span in spans if span["name"] == name), key=lambda span: span["duration"], reverse=True)[:n]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Phase latency percentiles from trace_file spans.")
+    parser.add_argument("path", help="trace_file of the trader")
+    parser.add_argument("--by", help="Split by a span attribute. ex) symbol, exchange")
+    parser.add_argument("--since", type=float, help="Only spans started after this unix time")
+    parser.add_argument("--slowest", help="Also print the slowest spans of this name")
+    parser.add_argument("-n", type=int, default=5)
+    args = parser.parse_args()
+
+    spans = read_spans(args.path, args.since)
+    report = aggregate(spans, args.by)
+
+    # Slowest first, so the bottleneck is on top.
+    for key, row in sorted(report.items(), key=lambda item: item[1]["p50"], reverse=True):
+        name = " ".join(str(part) for part in key)
+        print(name.ljust(40), " ".join(k + "=" + str(v) for k, v in row.items()))
+
+    if args.slowest:
+        print()
+        for span in slowest(spans, args.slowest, args.n):
+            print(span["trace_id"], span["duration"], {k: v for k, v in span.items() if k not in ("trace_id", "name", "duration")})
+
+
+if __name__ == '__main__':
+    main()
@@ -1,588 +1,588 @@
 import logging
-import requests
 import time
-import binance.client
 import upbit
 import math
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
 
 from binance.enums import *
-from binance.exceptions import BinanceAPIException, BinanceWithdrawException
 
-from huobi.client.account import AccountClient
-from huobi.client.wallet import WalletClient
-from huobi.client.trade import TradeClient
-from huobi.client.market import MarketClient
 from huobi.constant import *
-from huobi.utils import *
+
+from premium import PremiumBook, calc_premium
+from gateway import ExchangeGateway
+from scheduler import PollScheduler, RateBudget, Watch
+from metadata import MetadataIndex
+from route import RouteGraph
+from transfers import TransferIndex
+from stats import RollingStats, Trigger
+from phases import SpanSink
+from executor import TradeExecutor, TradeError
+from cycle import ArbitrageCycle
+from metrics import registry, requests_hook, TimedClient
+from warmstart import WarmStart
 
 log = logging.getLogger(__name__)
 
 
+def binance_client(api_key, api_secret, base_url=None):
+    """
+    binance.client.Client of api.binance.com, or of base_url when given.
+    """
+    # binance.client pulls in dateparser, which alone takes about half a second to import.
+    import binance.client
+
+    if not base_url:
+        return binance.client.Client(api_key, api_secret)
+
+    # Client pings in __init__, so the urls have to be there before it's created.
+    class Client(binance.client.Client):
+        API_URL = base_url + "/api"
+        WITHDRAW_API_URL = base_url + "/wapi"
+        MARGIN_API_URL = base_url + "/sapi"
+        FUTURES_URL = base_url + "/fapi"
+
+    return Client(api_key, api_secret)
+
+
+def huobi_clients(settings, url):
+    """
+    (wallet, account, trade, market) clients of Huobi Korea. Each is wrapped with metrics.TimedClient.
+    """
+    # The SDK imports aiohttp, so it's only loaded when clients are made.
+    from huobi.client.account import AccountClient
+    from huobi.client.wallet import WalletClient
+    from huobi.client.trade import TradeClient
+    from huobi.client.market import MarketClient
+
+    keys = {"api_key": settings["huobi_korea_access_key"], "secret_key": settings["huobi_korea_secret_key"], "url": url}
+    return (
+        TimedClient(WalletClient(**keys), "Huobi", registry),
+        TimedClient(AccountClient(**keys), "Huobi", registry),
+        TimedClient(TradeClient(**keys), "Huobi", registry),
+        TimedClient(MarketClient(url=url), "Huobi", registry)
+    )
+
+
 class Trader:
-    def __init__(self, cur_prices, settings):
+    def __init__(self, prices, settings, books=None):
         self.PREMIUM_RATIO = 1.5
         self.BINANCE_MIN_BALANCE = 400
 
-        self.cur_prices = cur_prices
+        self.prices = prices
+        self.books = books  # book.BookStore. When given, premium is confirmed with executable prices.
         self.settings = settings
 
-        self.u_prices = cur_prices["Upbit"]
-        self.b_prices = cur_prices["Binance"]
+        # Legs older than this(seconds) are not used. Protects from false premium when a feed is stalled.
+        self.MAX_PRICE_AGE = settings.get("max_price_age", 30)
+        self.snapshot = prices.snapshot()
+
         self.market_list = settings["market_list"]
 
-        self.binance_client = binance.client.Client(settings["binance_access_key"], settings["binance_secret_key"])
-        self.upbit_client = upbit.Client(settings["upbit_access_key"], settings["upbit_secret_key"])
+        # Last prices and metadata of the previous run. Restored prices are stale until their feed sends a tick.
+        self.warm_start = None
+        if settings.get("warm_start_file"):
+            self.warm_start = WarmStart(settings["warm_start_file"], prices, interval=settings.get("warm_start_interval", 60))
+            self.warm_start.restore_prices()
+
+        # Server urls can point to a local simulator. See simulator.py.
+        # Clients are made at the same time. Binance pings in __init__ and each SDK import takes a while.
+        huobi_url = settings.get("huobi_url", "https://krapi-aws.huobi.pro")
+        with ThreadPoolExecutor(max_workers=3, thread_name_prefix="client init") as pool:
+            binance_future = pool.submit(
+                binance_client,
+                settings["binance_access_key"],
+                settings["binance_secret_key"],
+                settings.get("binance_url")
+            )
+            upbit_future = pool.submit(
+                upbit.Client,
+                settings["upbit_access_key"],
+                settings["upbit_secret_key"],
+                pool_size=settings.get("upbit_pool_size", 10),
+                server_url=settings.get("upbit_url", "https://api.upbit.com")
+            )
+            huobi_future = pool.submit(huobi_clients, settings, huobi_url)
+        self.binance_client = binance_future.result()
+        self.upbit_client = upbit_future.result()
+        self.huobi_wallet_client, self.huobi_account_client, self.huobi_trade_client, self.huobi_market_client = huobi_future.result()
+
+        # REST latency of every endpoint goes to metrics. Huobi SDK has no hook, so its clients are wrapped.
+        self.binance_client.session.hooks["response"].append(requests_hook("Binance", registry))
+        self.upbit_client.on_latency = lambda endpoint, seconds: registry.observe("rest.Upbit " + endpoint, seconds)
+        self.monitor_time = registry.histogram("monitor")
+        self.huobi_account_id = 20694732
 
-        self.huobi_wallet_client = WalletClient(
-            api_key=self.settings["huobi_korea_access_key"],
-            secret_key=self.settings["huobi_korea_secret_key"],
-            url="https://krapi-aws.huobi.pro"
+        # Binance USDT balance. Read once here for trade_notional and again by every cycle.
+        self.spot_balance = self.read_spot_balance()
+
+        # Awaitable REST calls so independent requests run at the same time.
+        self.gateway = ExchangeGateway(
+            binance_client=self.binance_client,
+            upbit_client=self.upbit_client,
+            huobi_wallet_client=self.huobi_wallet_client,
+            huobi_account_client=self.huobi_account_client,
+            huobi_trade_client=self.huobi_trade_client,
+            huobi_market_client=self.huobi_market_client,
+            huobi_account_id=self.huobi_account_id,
+            max_workers=settings.get("gateway_workers", 8)
         )
-        self.huobi_account_client = AccountClient(
-            api_key=self.settings["huobi_korea_access_key"],
-            secret_key=self.settings["huobi_korea_secret_key"],
-            url="https://krapi-aws.huobi.pro"
+
+        # Every order, withdraw and deposit status poll goes through one scheduler.
+        budgets = settings.get("poll_budgets", {"Binance": 10, "Upbit": 8, "Huobi": 10})
+        self.scheduler = PollScheduler({exchange: RateBudget(rate) for exchange, rate in budgets.items()})
+        self.scheduler.register_batch("Upbit deposits", self.poll_upbit_deposits)
+        self.scheduler.start()
+
+        # Coins to move funds back with, scored by fee, liquidity and our own transfer times. See transfers.TransferIndex.
+        self.transfers = TransferIndex(
+            self.binance_client,
+            settings.get("transfer_coins"),
+            path=settings.get("transfer_index_file"),
+            ttl=settings.get("metadata_ttl", 3600),
+            impact=settings.get("transfer_impact", 1.0),
+            time_cost=settings.get("transfer_time_cost", 0.001)
         )
-        self.huobi_trade_client = TradeClient(
-            api_key=self.settings["huobi_korea_access_key"],
-            secret_key=self.settings["huobi_korea_secret_key"],
-            url="https://krapi-aws.huobi.pro"
+        self.transfers.start()
+
+        # Symbol filters and precisions are loaded once and refreshed in background.
+        self.metadata = MetadataIndex(
+            self.binance_client,
+            self.market_list + self.transfers.coins(),
+            ttl=settings.get("metadata_ttl", 3600)
         )
-        self.huobi_market_client = MarketClient(url="https://krapi-aws.huobi.pro")
-        self.huobi_account_id = 20694732
+        if self.warm_start:
+            # Restored tables are used right away and refreshed in background.
+            self.warm_start.restore_metadata(self.metadata)
+            self.warm_start.start()
+        self.metadata.start()
+        self.leverage = {}  # symbol -> leverage already set in futures account
+
+        # Run independent legs of a trade at the same time. Upbit deposit addresses of
+        # symbols over PREFETCH_RATIO are fetched ahead, they don't change once generated.
+        self.CONCURRENT_LEGS = settings.get("concurrent_legs", False)
+        self.PREFETCH_RATIO = settings.get("prefetch_ratio", self.PREMIUM_RATIO * 0.7)
+        self.deposit_addrs = {}  # symbol -> Future of (deposit_addr, secondary_addr)
+
+        # Spans of every cycle go to settings trace_file as JSON lines. See trace_report.py.
+        self.span_sink = SpanSink(settings["trace_file"]) if settings.get("trace_file") else None
+
+        # Cycles run as cycle.ArbitrageCycle on a background thread, monitor keeps running during a trade.
+        # Upbit sell waits while live premium is under sell_min_premium, up to sell_max_wait seconds. Off by default.
+        self.SELL_MIN_PREMIUM = settings.get("sell_min_premium")
+        self.SELL_MAX_WAIT = settings.get("sell_max_wait", 600)
+        self.executor = TradeExecutor()
+        self.executor.start()
+
+        # Best full cycle over every coin in both directions, with fees and transfer times. See route.RouteGraph.
+        # Off unless settings route_engine is true. Binance withdraw fees come from metadata, the rest from settings.
+        # Coins without a known withdraw fee are left out of routes.
+        self.routes = None
+        self.best_route = None
+        if settings.get("route_engine", False):
+            self.routes = RouteGraph(
+                self.market_list,
+                self.trade_notional(),
+                trading_fees=settings.get("trading_fees"),
+                withdraw_fees=settings.get("withdraw_fees"),
+                transfer_times=settings.get("transfer_times")
+            )
+            for symbol, asset in self.metadata.assets.items():
+                self.routes.set_withdraw_fee("Binance", symbol, asset["withdraw_fee"])
+            for key, (seconds, count) in self.transfers.observed.items():
+                src, dst, coin = key.split(">")
+                self.routes.set_transfer_time(coin, src, dst, seconds)
+
+        # Rolling premium statistics of every symbol. See stats.RollingStats.
+        # With settings premium_trigger, trades start on conditions over them instead of PREMIUM_RATIO.
+        # ex) "premium_trigger": {"z": 3.0, "median_dev": 0.5, "premium": 1.0}
+        self.premium_stats = None
+        self.trigger = None
+        if settings.get("premium_stats") or settings.get("premium_trigger"):
+            stats_settings = settings.get("premium_stats") or {}
+            self.premium_stats = RollingStats(
+                self.market_list,
+                window=stats_settings.get("window", 3600),
+                alpha=stats_settings.get("alpha", 0.05)
+            )
+            if settings.get("premium_trigger"):
+                self.trigger = Trigger(self.premium_stats, settings["premium_trigger"], settings.get("trigger_min_samples", 60))
 
-        self.trade_info = {
-            "symbol": "",
-            "price": 0,
-            "Upbit": {"deposit_addr": "", "secondary_addr": None},
-            "Binance": {"spot_balance": 0, "futures_balance": 0}
-        }
+        # Event driven mode. Feed threads call on_price and main thread waits on premium_signal.
+        self.premium_book = PremiumBook(self.market_list)
+        self.huobi_snapshot = prices.snapshot()
+        self.premium_signal = threading.Event()
+        self.detected_at = None
+        self.triggered = {}  # symbol -> 1 for premium, -1 for reverse, set by on_price with a trigger
 
     def monitor(self):
         """
         Check whether their is premium
         """
-        if len(self.u_prices) != len(self.b_prices):
-            log.error("Length of market list data, upbit data and binance data should be same")
-            exit()
-
-        premium_data = {} # upbit-binance
-        usdt_price = self.cur_prices["Huobi"]["usdt"]
-        for i in range(len(self.market_list)):
-            u_price = self.u_prices["KRW-"+self.market_list[i]]
-            b_price = self.b_prices[self.market_list[i]+"USDT"]
-
-            if u_price == 0 or b_price == 0:
-                return
+        start = time.perf_counter()
+        snapshot = self.prices.snapshot(self.snapshot)
+        if not snapshot.ready():
+            return
 
-            if u_price >= b_price * usdt_price:
-                premium_data[self.market_list[i]] = round(u_price/(b_price*usdt_price)*100-100, 3)
-            else:
-                premium_data[self.market_list[i]] = round((b_price*usdt_price)/u_price*100-100, 3)
+        premium, stale = snapshot.live_premium(self.MAX_PRICE_AGE)
+        if stale.any():
+            log.warning("Stale price : " + str([self.market_list[i] for i in stale.nonzero()[0]]))
+        if self.routes:
+            self.update_best_route(snapshot, stale)
 
         # premium_data looks like this {'ADA': 4.2, 'ATOM': 4.033, 'BAT': 3.933}
-        log.info(premium_data)
-        if max(premium_data.values()) > self.PREMIUM_RATIO:
-            #print("hi")
-            self.trade_binance_to_upbit(premium_data)
-            self.send_btc_upbit_to_huobi()
-            self.trade_huobi_to_binance()
-            #exit()
-        elif min(premium_data.values()) < -self.PREMIUM_RATIO:
+        # Building the dict is only worth it when it's logged or traded on.
+        premium_data = None
+        if log.isEnabledFor(logging.INFO):
+            premium_data = snapshot.premium_data(premium, stale)
             log.info(premium_data)
-            self.trade_upbit_to_binance(premium_data)
-        else:
-            return
 
-        return
+        # One trade at a time. The running cycle reads live_premium itself.
+        idle = not (self.executor.busy() or self.executor.halted)
 
-    def trade_binance_to_upbit(self, premium_data):
-        """
-        How to trade
-        1. Setup trading pre condition.
-        2. Place market order and future short with 9:1 ratio.
-        3. Only allow one trade at a time.
-        """
-
-        # Get symbol of currency with maximum premium
-        self.trade_info["symbol"] = list(premium_data.keys())[list(premium_data.values()).index(max(premium_data.values()))]
-        self.trade_info["price"] = self.b_prices[self.trade_info["symbol"]+"USDT"]
-
-        log.info("Trading "+self.trade_info["symbol"])
-
-        self.prepare_binance_to_upbit()
-
-        # Get symbol info and setup filters for new order
-        symbol_info = self.binance_client.get_symbol_info(symbol=self.trade_info["symbol"]+"USDT")
-
-        """
-        What it does.
-        1. Trade 85% of balance and leave 15% for hedging with future short.
-            It's 85% because after you sold the coin in Upbit, balance has increased and 10x leverage is no longer 
-            possible with the original balance in futures account if the percentage is set to 10%. 
-        2. Filter quantity LOT_SIZE according to binance manuel.
-            quantity >= minQty
-            quantity <= maxQty
-            (quantity-minQty) % stepSize == 0
-        3. Format float precision according to given baseAssetPrecision. Not sure if this is necessary.
-        """
-
-        # Multiply 0.99 because you buy in market price and their is taker fee. Real price and saved price can be different
-        step_size = float(list(filter(lambda f: f['filterType'] == 'LOT_SIZE', symbol_info['filters']))[0]['stepSize'])
-        quantity = self.trade_info["Binance"]["spot_balance"] * 0.99 / self.trade_info["price"]
-        spot_quantity_str = self.float_precision(quantity,  step_size)
-
-        # Real order
-        order = self.binance_client.order_market_buy(symbol=self.trade_info["symbol"]+"USDT", quantity=spot_quantity_str)
-        log.info("Binance buy executed.")
-
-        # Futures hedge short
-        futures_quantity = self.binance_hedge_short(self.trade_info["symbol"], quantity)
-
-        # To be precise get the balance again and don't use spot_quantity_str.
-        res = self.binance_client.get_asset_balance(asset=self.trade_info["symbol"])
-        trans_quantity_str = self.float_precision(res["free"], step_size)
-        log.debug(trans_quantity_str)
-
-        # Balance doesn't get update immediately and prints insufficient balance error. Need to try multiple times.
-        while True:
-            try:
-                if self.trade_info["Upbit"]["secondary_addr"]:
-                    res = self.binance_client.withdraw(
-                        asset=self.trade_info["symbol"],
-                        address=self.trade_info["Upbit"]["deposit_addr"],
-                        addressTag=self.trade_info["Upbit"]["secondary_addr"],
-                        amount=trans_quantity_str
-                    )
-                else:
-                    print("Trying withdraw")
-                    res = self.binance_client.withdraw(
-                        asset=self.trade_info["symbol"],
-                        address=self.trade_info["Upbit"]["deposit_addr"],
-                        amount=trans_quantity_str
-                    )
-
-                if "id" in res:
-                    break
-
-            except BinanceWithdrawException as e:
-                print(e)
-                time.sleep(1)
-                pass
-
-        log.info("Binance withdrawing to Upbit.")
-        txid = self.monitor_trans_binance_to_upbit(res["id"])
-        log.info("Binance withdraw complete. Txid : "+txid)
-
-        # Check again in upbit side.
-        while True:
-            data = self.upbit_client.deposits(self.trade_info["symbol"], txid)
-            if data:
-                res = data[0]
-                if "error" in res:
-                    log.error(res["error"]["message"])
-                    exit()
-                if res["state"] == "ACCEPTED":
-                    break
-                elif res["state"] == "REJECTED":
-                    log.error("Upbit deposit rejected.")
-                    exit()
-                else:
-                    time.sleep(3)
-                    continue
-            else:
-                continue
+        # Trigger and executable premium are checked against the window before this sample joins it.
+        confirmed = down = None
+        if self.trigger and idle:
+            up, down = self.trigger.check(premium)
+            premium_data = premium_data or snapshot.premium_data(premium, stale)
+            confirmed = self.confirm_triggered(premium_data, [self.market_list[i] for i in np.flatnonzero(up & ~stale)])
+            down = [self.market_list[i] for i in np.flatnonzero(down & ~stale)]
+        if self.premium_stats:
+            self.premium_stats.update_all(premium, ~stale)
 
-        upbit_quantity = ""
-        res = self.upbit_client.accounts()
-        for currency in res:
-            if currency["currency"] == self.trade_info["symbol"]:
-                upbit_quantity = currency["balance"]
-
-        res = self.upbit_client.order(
-            market="KRW-"+self.trade_info["symbol"],
-            side="ask",
-            volume=upbit_quantity,
-            ord_type="market"
-        )
-        log.info("Upbit sell complete.")
-        log.info(premium_data)
-
-        # After upbit side trade was made, cover short hedge
-        order = self.binance_client.futures_create_order(
-            symbol=self.trade_info["symbol"] + "USDT",
-            side=SIDE_BUY,
-            type=ORDER_TYPE_MARKET,
-            quantity=futures_quantity
-        )
+        i_max = premium.argmax()
+        i_min = premium.argmin()
+        self.monitor_time.record(time.perf_counter() - start)
 
-        log.info("Binance futures cover complete.")
+        if not idle:
+            return
+
+        if confirmed is not None:
+            self.trade_triggered(premium_data, confirmed, down, time.time())
+        elif premium[i_max] > self.PREMIUM_RATIO:
+            detected_at = time.time()
+            premium_data = self.confirm_premium(premium_data or snapshot.premium_data(premium, stale))
+            if max(premium_data.values()) <= self.PREMIUM_RATIO:
+                return
+            self.run_cycle(premium_data, detected_at)
+        elif premium[i_min] < -self.PREMIUM_RATIO:
+            premium_data = premium_data or snapshot.premium_data(premium, stale)
+            log.info(premium_data)
+            self.trade_upbit_to_binance(premium_data)
+        elif self.CONCURRENT_LEGS and premium[i_max] > self.PREFETCH_RATIO:
+            self.prefetch_deposit_addr(self.market_list[i_max])
 
         return
 
-    def monitor_trans_binance_to_upbit(self, id):
+    def run_cycle(self, premium_data, detected_at=None):
         """
-        status : 0(0:Email Sent,1:Cancelled 2:Awaiting Approval 3:Rejected 4:Processing 5:Failure 6:Completed)
+        Start Binance -> Upbit with the premium coin, Upbit -> Huobi with BTC, Huobi -> Binance with EOS
+        on the executor. Returns Future of the cycle, or None when a cycle is running or trading is halted.
         """
-        while True:
-            res = self.binance_client.get_withdraw_history(asset=self.trade_info["symbol"])
-            for t in res["withdrawList"]:
-                if t["id"] == id:
-                    if t["status"] == 6:
-                        log.info("transaction success.")
-                        return t["txId"]
-                    elif t["status"] == 4 or t["status"] == 2 or t["status"] == 0:
-                        time.sleep(3)
-                        break
-                    else:
-                        log.error("transaction failed")
-                        exit()
-
-    def trade_upbit_to_binance(self, premium_data):
-        print("Trade reverse premium. Currently not supported")
-
-    def prepare_binance_to_upbit(self):
+        if self.executor.halted:
+            log.error("Trading halted. " + self.executor.halted)
+            return None
+
+        future = self.executor.submit(ArbitrageCycle(self, premium_data, detected_at))
+        if future is None:
+            log.info("Cycle running, " + self.executor.current.state)
+        elif self.routes:
+            future.add_done_callback(self.refresh_notional)
+        return future
+
+    def refresh_notional(self, future=None):
         """
-        Things to check before trading starts
-        1. Balance. (Over $200)
-        2. Check all wallet address that is needed for the trading.
-        3. Transfer 15% of spot balance to futures balance.
+        Size routes from the Binance balance a cycle left. Keeps the last balance when it can't be read.
         """
+        self.spot_balance = self.read_spot_balance() or self.spot_balance
+        self.routes.set_notional(self.trade_notional())
 
-        # Check binance account status.
-        info = self.binance_client.get_account()
-        if info["canTrade"] is False or info["canWithdraw"] is False or info["canDeposit"] is False:
-            log.error("Can't proceed trading. Check binance account status.")
-            exit()
-
-        # Check whether futures account is empty.
-        if float(self.binance_client.futures_account_balance()[0]["balance"]) != 0:
-            log.error("Can't proceed trading. Futures account needs to be empty.")
-            exit()
+    def live_premium(self, symbol):
+        """
+        Premium of symbol from the latest prices, or None when a price is missing or older than MAX_PRICE_AGE.
+        Read by the running cycle.
+        """
+        u_price, b_price, usdt_price, recv_ts = self.prices.read(self.prices.index[symbol])
+        if u_price == 0 or b_price == 0 or usdt_price == 0 or time.time() - recv_ts > self.MAX_PRICE_AGE:
+            return None
+        return calc_premium(u_price, b_price, usdt_price)
 
-        # Get binance balance
-        self.trade_info["Binance"]["spot_balance"] = float(self.binance_client.get_asset_balance(asset='USDT')["free"])
-        log.info("Binance balance : " + str(self.trade_info["Binance"]["spot_balance"]))
-        if self.trade_info["Binance"]["spot_balance"] < self.BINANCE_MIN_BALANCE:
-            log.error("Check binance account minimum balance.")
-            exit()
+    def on_price(self, exchange, key):
+        """
+        Called by feed threads after every price update.
+        Only the symbol of the update is recomputed, except usdt price of Huobi which moves every symbol.
+        """
+        if exchange == "Huobi":
+            # Feed threads have their own snapshot buffer because this runs on the Huobi thread.
+            snapshot = self.prices.snapshot(self.huobi_snapshot)
+            premium = snapshot.calc_premium()
+            stale = snapshot.stale(self.MAX_PRICE_AGE)
+            self.premium_book.update_all(snapshot.premium_data(premium, stale))
+            if self.routes:
+                self.routes.set_usdt(float(snapshot.usdt[0]))
+            if self.premium_stats:
+                valid = ~stale & (snapshot.upbit != 0) & (snapshot.binance != 0)
+                if self.trigger:
+                    up, down = self.trigger.check(premium)
+                    for i in np.flatnonzero((up | down) & valid):
+                        self.triggered[self.market_list[i]] = 1 if up[i] else -1
+                self.premium_stats.update_all(premium, valid)
+        else:
+            # ex) key = KRW-ADA or ADAUSDT
+            i = self.prices.index.get(key)
+            if i is None:
+                return
 
-        # Get Upbit wallet address.
-        while True:
-            res = self.upbit_client.generate_coin_addr(self.trade_info["symbol"])
-            if "success" in res:
-                if res["success"]:
-                    time.sleep(0.5)
-                    continue
-                else:
-                    log.error("Upbit wallet generation failed for "+self.trade_info["symbol"])
-                    exit()
-            elif "error" in res:
-                log.error(res)
-            else:
-                if self.trade_info["symbol"] == "BCH":
-                    # BCH has prefix bitcoincash:
-                    self.trade_info["Upbit"]["deposit_addr"] = res["deposit_address"].split(":")[1]
-                else:
-                    self.trade_info["Upbit"]["deposit_addr"] = res["deposit_address"]
-                self.trade_info["Upbit"]["secondary_addr"] = res["secondary_address"]
-                break
-
-        # Transfer balance to futures account.
-        self.binance_client.futures_account_transfer(asset="USDT", amount=self.trade_info["Binance"]["spot_balance"] * 0.15, type=1)
-        self.trade_info["Binance"]["spot_balance"] *= 0.85
+            u_price, b_price, usdt_price, recv_ts = self.prices.read(i)
+            stale = time.time() - recv_ts > self.MAX_PRICE_AGE
+            if self.routes:
+                # Only legs of this coin move. A stale coin leaves every route until its next fresh tick.
+                price = u_price if exchange == "Upbit" else b_price
+                self.routes.set_price(exchange, self.market_list[i], 0 if stale else float(price))
+            if u_price == 0 or b_price == 0 or usdt_price == 0:
+                return
+            if stale:
+                self.premium_book.remove(self.market_list[i])
+                return
+            premium = calc_premium(u_price, b_price, usdt_price)
+            self.premium_book.update(self.market_list[i], premium)
+            if self.premium_stats:
+                direction = self.trigger.check_one(i, premium) if self.trigger else 0
+                self.premium_stats.update(i, premium)
+                if direction:
+                    self.triggered[self.market_list[i]] = direction
+
+        if self.trigger:
+            if self.triggered:
+                self.detected_at = time.time()
+                self.premium_signal.set()
+            return
 
-        return
+        top = self.premium_book.max()
+        bottom = self.premium_book.min()
+        if (top and top[1] > self.PREMIUM_RATIO) or (bottom and bottom[1] < -self.PREMIUM_RATIO):
+            self.detected_at = time.time()
+            self.premium_signal.set()
+        elif self.CONCURRENT_LEGS and top and top[1] > self.PREFETCH_RATIO:
+            self.prefetch_deposit_addr(top[0])
 
-    def send_btc_upbit_to_huobi(self):
+    def update_best_route(self, snapshot, stale):
         """
-        1. Buy BTC and hedge with binance short
-        2. Send it to Huobi.
-        3. Sell with limit order so you can avoid slippage. Need precise calculation.
+        Refresh routes from snapshot and log the best cycle when its coins change.
         """
-        # Get Huobi BTC wallet address.
-        list_obj = self.huobi_wallet_client.get_account_deposit_address(currency="btc")
-
-        huobi_btc_addr = ""
-        for obj in list_obj:
-            if obj.chain == "btc":  # eos1
-                huobi_btc_addr = obj.address
-
-        # Buy BTC in Upbit
-        upbit_krw_balance = 0
-        res = self.upbit_client.accounts()
+        self.routes.update_snapshot(snapshot, stale)
+        route = self.routes.best()
+        if route is None:
+            return
+        if self.best_route is None or route["coins"] != self.best_route["coins"] or route["exchanges"] != self.best_route["exchanges"]:
+            log.info("Best route " + " -> ".join(route["exchanges"]) + " with " + str(route["coins"]) +
+                     " rate " + str(round(route["rate"], 5)) + " in " + str(round(route["seconds"])) + "s")
+        self.best_route = route
 
-        if "error" in res:
-            log.error(res["error"]["message"])
-            exit()
+    def monitor_event(self, timeout=None):
+        """
+        Event driven version of monitor. Blocks until a feed thread reports premium over PREMIUM_RATIO.
+        """
+        if not self.premium_signal.wait(timeout):
+            return
+        self.premium_signal.clear()
+        if self.executor.busy() or self.executor.halted:
+            return
 
-        for currency in res:
-            if currency["currency"] == "KRW":
-                upbit_krw_balance = currency["balance"]
+        if self.trigger:
+            triggered, self.triggered = self.triggered, {}
+            premium_data = self.premium_book.as_dict()
+            self.trade_triggered(
+                premium_data,
+                self.confirm_triggered(premium_data, [symbol for symbol, direction in triggered.items()
+                                                      if direction == 1 and symbol in premium_data]),
+                [symbol for symbol, direction in triggered.items() if direction == -1 and symbol in premium_data],
+                self.detected_at
+            )
+            return
 
-        log.info("Upbit buying.")
-        log.debug("KRW Balance : "+upbit_krw_balance)
-        res = self.upbit_client.order(
-            market="KRW-BTC",
-            side="bid",
-            price=math.floor(float(upbit_krw_balance)*0.9995),
-            ord_type="price"
-        )
+        # Prices could have moved back while waiting, so check the book again.
+        top = self.premium_book.max()
+        bottom = self.premium_book.min()
+        premium_data = self.premium_book.as_dict()
 
-        if "error" in res:
-            log.error(res["error"]["message"])
-            exit()
-
-        trade_uuid = res["uuid"]
-
-        while True:
-            res = self.upbit_client.check_order(trade_uuid)
-            if res["trades_count"] != 0:
-                upbit_avg_price = res["trades"][0]["price"]
-                break
-            time.sleep(0.1)
-        log.info("Upbit bought.")
-
-        # Get Upbit BTC balance.
-        btc_balance = 0
-        res = self.upbit_client.accounts()
-        for currency in res:
-            if currency["currency"] == "BTC":
-                btc_balance = float(currency["balance"]) - 0.0009 # withdraw fee is 0.0009
-
-        # Futures hedge short
-        futures_quantity = self.binance_hedge_short("BTC", btc_balance)
-
-        # Withdraw decimal point differs for each currency.
-        log.info("Upbit to Huobi withdraw started.")
-        res = self.upbit_client.withdraw(
-            currency="BTC",
-            amount=self.float_precision(btc_balance, 0.0001),  # eos -> 0.0001
-            address=huobi_btc_addr  # eos secondary_address=6837108
-        )
-        if "error" in res:
-            log.error(res["error"]["message"])
-            exit()
-
-        withdraw_uuid = res["uuid"]
-
-        while True:
-            try:
-                res = self.upbit_client.check_withdraw(withdraw_uuid)
-                time.sleep(10)
-                if res["done_at"]:
-                    break
-            except Exception as e:
-                print(e)
-                time.sleep(10)
-                pass
-
-        log.info("Upbit to Huobi withdraw done.")
-
-        # Sell BTC at Huobi.
-        # Balance is not updated immediately so loop the order function.
-        huobi_quantity = float(self.float_precision(btc_balance, 0.0001))  # eos -> 0.01 # btc -> 0.0001
-        while True:
-            try:
-                order_id = self.huobi_trade_client.create_order(
-                    symbol="btckrw",
-                    account_id=self.huobi_account_id,
-                    order_type=OrderType.SELL_MARKET,
-                    amount=huobi_quantity,
-                    source=OrderSource.API,
-                    price=None
-                )
-                if order_id:
-                    break
-            except Exception as e:
-                time.sleep(4)
-                print(e)
-                pass
-        log.info("Huobi sell order created.")
-
-        # Monitor until order is filled.
-        while True:
-            order = self.huobi_trade_client.get_order(order_id=order_id)
-            if float(order.filled_amount) == huobi_quantity:
-                break
-            time.sleep(5)
-        log.info("Huobi sell order filled.")
-
-        # Cover binance short hedge.
-        order = self.binance_client.futures_create_order(
-            symbol="BTCUSDT",
-            side=SIDE_BUY,
-            type=ORDER_TYPE_MARKET,
-            quantity=futures_quantity
-        )
+        if top and top[1] > self.PREMIUM_RATIO:
+            premium_data = self.confirm_premium(premium_data)
+            if max(premium_data.values()) <= self.PREMIUM_RATIO:
+                return
+            log.info(premium_data)
+            self.run_cycle(premium_data, self.detected_at)
+        elif bottom and bottom[1] < -self.PREMIUM_RATIO:
+            log.info(premium_data)
+            self.trade_upbit_to_binance(premium_data)
 
-        log.info("Upbit to Huobi complete.")
         return
 
-    def trade_huobi_to_binance(self):
-        """
-        1. Get krw balance.
-        2. Buy usdt with krw.
-        3. Buy eos with usdt.( hedge needed )
-        4. Send eos to binance.
-        5. Sell eos at binance.
-
-        Here you buy with eos because eosusdt market has enough liquidity.
-        """
-        # Get krw balance.
-        krw_balance = 0
-        account_balance_list = self.huobi_account_client.get_account_balance()
-        for balance_obj in account_balance_list[0].list:
-            if balance_obj.currency == "krw":
-                krw_balance = balance_obj.balance
-                break
-
-        # Get usdt first ask price and place a limit order their.
-        depth = self.huobi_market_client.get_pricedepth("usdtkrw", DepthStep.STEP0, 1)
-        usdt_ask_price = depth.asks[0].price
-
-        log.info("Huobi buying usdt.")
-        usdt_quantity = float(self.float_precision(float(krw_balance) / usdt_ask_price, 0.01))
-        order_id = self.huobi_trade_client.create_order(
-            symbol="usdtkrw",
-            account_id=self.huobi_account_id,
-            order_type=OrderType.BUY_LIMIT,
-            amount=usdt_quantity,
-            source=OrderSource.API,
-            price=int(usdt_ask_price)
-        )
-
-        # Monitor until order is filled.
-        while True:
-            order = self.huobi_trade_client.get_order(order_id=order_id)
-            if float(order.filled_amount) == usdt_quantity:
-                break
-            time.sleep(5)
-
-        log.info("Huobi bought usdt.")
-        usdt_quantity *= 0.999  # adjust market fee 0.1%
-
-        # Order with binance price.
-        log.info("Huobi buying EOS.")
-        eos_quantity = float(self.float_precision(usdt_quantity / self.b_prices["EOSUSDT"], 0.0001))
-        order_id = self.huobi_trade_client.create_order(
-            symbol="eosusdt",
-            account_id=self.huobi_account_id,
-            order_type=OrderType.BUY_LIMIT,
-            amount=eos_quantity,
-            source=OrderSource.API,
-            price=self.b_prices["EOSUSDT"]
-        )
-
-        # Monitor until order is filled.
-        while True:
-            order = self.huobi_trade_client.get_order(order_id=order_id)
-            if float(order.filled_amount) == eos_quantity:
-                break
-            time.sleep(5)
-
-        log.info("Huobi EOS bought.")
-        eos_quantity *= 0.999 # Adjust market fee.
-
-        # Futures hedge short.
-        futures_quantity = self.binance_hedge_short("EOS", eos_quantity)
-
-        # Get binance deposit wallet address.
-        deposit_addr_data = self.binance_client.get_deposit_address(asset="EOS")
-
-        eos_quantity = float(self.float_precision(eos_quantity - 0.1, 0.0001))  # Adjust withdraw fee(0.1) and precision
-
-        log.info("Huobi withdrawing EOS to Binance.")
-        log.debug("EOS quantity : "+str(eos_quantity))
-        # Balance doesn't get updated immediately.
-        while True:
-            try:
-                if deposit_addr_data["addressTag"]:
-                    withdraw_id = self.huobi_wallet_client.post_create_withdraw(
-                        address=deposit_addr_data["address"],
-                        address_tag=deposit_addr_data["addressTag"],
-                        amount=eos_quantity,
-                        currency="eos",
-                        fee=0.1,
-                    )
-                else:  # Actually you don't need this if else condition because you specify the currency.
-                    withdraw_id = self.huobi_wallet_client.post_create_withdraw(
-                        address=deposit_addr_data["address"],
-                        amount=eos_quantity,
-                        currency="eos",
-                        fee=0.1,
-                    )
-                if withdraw_id:
-                    break
-            except Exception as e:
-                log.error(e)
-                time.sleep(1)
-                pass
-
-        while True:
-            time.sleep(5)
-            list_obj = self.huobi_wallet_client.get_deposit_withdraw(
-                op_type=DepositWithdraw.WITHDRAW,
-                currency="eos",
-                size=1,
-                direct=QueryDirection.NEXT
-            )
-            if list_obj[0].state == "confirmed":
-                break
-        log.info("Huobi withdraw complete.")
-        log.info(eos_quantity)
+    def confirm_triggered(self, premium_data, up):
+        """
+        Symbols of up whose executable premium still meets premium_trigger, with that premium.
+        Call it before the sample that fired the trigger joins premium_stats, or the sample is checked against itself.
+        A premium the books left as it was has met the trigger already and isn't checked again.
+        """
+        candidates = {symbol: premium_data[symbol] for symbol in up}
+        confirmed = self.confirm_premium(candidates, threshold=float("-inf"))
+        return {symbol: premium for symbol, premium in confirmed.items()
+                if premium == candidates[symbol] or self.trigger.check_one(self.prices.index[symbol], premium) == 1}
 
-        symbol_info = self.binance_client.get_symbol_info(symbol="EOSUSDT")
-        step_size = float(list(filter(lambda f: f['filterType'] == 'LOT_SIZE', symbol_info['filters']))[0]['stepSize'])
+    def trade_triggered(self, premium_data, confirmed, down, detected_at):
+        """
+        Trade symbols that met premium_trigger. confirmed from confirm_triggered for premium, down for reverse premium.
+        """
+        if confirmed:
+            log.info("Premium trigger " + str({symbol: self.premium_stats.summary(symbol) for symbol in confirmed}))
+            self.run_cycle(confirmed, detected_at)
+        elif down:
+            log.info(premium_data)
+            self.trade_upbit_to_binance({symbol: premium_data[symbol] for symbol in down})
 
-        eos_quantity = float(self.binance_client.get_asset_balance(asset="EOS")["free"])
-        eos_quantity = self.float_precision(eos_quantity,  step_size)
+    def trade_notional(self):
+        """
+        USDT spent on Binance spot buy. Same 85% and 99% as cycle.ArbitrageCycle.
+        """
+        # BINANCE_MIN_BALANCE only when the balance couldn't be read, a cycle wouldn't start under it anyway.
+        balance = self.settings.get("trade_notional") or self.spot_balance or self.BINANCE_MIN_BALANCE
+        return balance * 0.85 * 0.99
+
+    def read_spot_balance(self):
+        try:
+            return float(self.binance_client.get_asset_balance(asset="USDT")["free"])
+        except Exception as e:
+            log.error("Failed to get Binance balance : " + repr(e))
+            return 0
+
+    def executable_premium(self, symbol, notional):
+        """
+        Premium of buying notional USDT of symbol on Binance asks and selling the same quantity on Upbit bids.
+        None when either book is not deep enough.
+        """
+        b_price, quantity = self.books.binance_buy(symbol, notional)
+        u_price = self.books.upbit_sell(symbol, quantity)
+        if math.isnan(b_price) or math.isnan(u_price):
+            return None
+        return calc_premium(u_price, b_price, self.prices.usdt[0])
 
-        log.info(eos_quantity)
+    def confirm_premium(self, premium_data, threshold=None):
+        """
+        Last trade price premium can be far from what the books give for our size.
+        Candidates over threshold, PREMIUM_RATIO by default, get their executable premium instead.
+        """
+        if not self.books:
+            return premium_data
+
+        if threshold is None:
+            threshold = self.PREMIUM_RATIO
+        notional = self.trade_notional()
+        confirmed = dict(premium_data)
+        for symbol, premium in premium_data.items():
+            if premium > threshold:
+                executable = self.executable_premium(symbol, notional)
+                confirmed[symbol] = executable if executable is not None else 0
+                log.info(symbol + " premium " + str(premium) + " executable " + str(confirmed[symbol]))
+        return confirmed
+
+    def poll_upbit_deposits(self, args):
+        """
+        Batch poll of Upbit deposits. One request per currency for every pending txid.
+        args is a list of (currency, txid) and returns {(currency, txid): deposit}
+        """
+        txids = {}
+        for currency, txid in args:
+            txids.setdefault(currency, []).append(txid)
+
+        results = {}
+        for currency, currency_txids in txids.items():
+            data = self.upbit_client.deposits(currency, currency_txids)
+            if "error" in data:
+                # Every watch sees the error and stops.
+                results.update({(currency, txid): data for txid in currency_txids})
+                continue
+            for res in data:
+                results[(currency, res["txid"])] = res
+        return results
 
-        order = self.binance_client.order_market_sell(symbol="EOSUSDT", quantity=eos_quantity)
+    def record_transfer(self, src, dst, coin, seconds):
+        """
+        Called by the cycle when a transfer it made has arrived. Next coin selections and routes use the time.
+        """
+        self.transfers.record(src, dst, coin, seconds)
+        if self.routes:
+            self.routes.set_transfer_time(coin, src, dst, self.transfers.seconds(src, dst, coin))
 
-        log.info("Binance sell executed")
+    def trade_upbit_to_binance(self, premium_data):
+        print("Trade reverse premium. Currently not supported")
 
-        order = self.binance_client.futures_create_order(
-            symbol="EOSUSDT",
-            side=SIDE_BUY,
-            type=ORDER_TYPE_MARKET,
-            quantity=futures_quantity
+    def upbit_deposit_addr_watch(self, symbol):
+        """
+        Watch giving (deposit_addr, secondary_addr) of symbol in Upbit.
+        """
+        # {"success": true} means address is being generated. Ask again until it's there.
+        def addr_done(res):
+            if "error" in res:
+                log.error(res)
+                return None
+            if res.get("success") is True:
+                return None
+            if "success" in res:
+                raise TradeError("Upbit wallet generation failed for "+symbol)
+
+            if symbol == "BCH":
+                # BCH has prefix bitcoincash:
+                return res["deposit_address"].split(":")[1], res["secondary_address"]
+            return res["deposit_address"], res["secondary_address"]
+
+        return Watch(
+            "Upbit",
+            poll=lambda: self.upbit_client.generate_coin_addr(symbol),
+            done=addr_done,
+            interval=0.5, max_interval=5,
+            name="Upbit deposit address"
         )
 
-        futures_balance = self.binance_client.futures_account_balance()[1]
-        if futures_balance["balance"] != futures_balance["withdrawAvailable"]:
-            log.error("Maybe their is futures position left in binance.")
-            exit()
-
-        self.binance_client.futures_account_transfer(
-            asset="USDT",
-            amount=futures_balance["balance"],
-            type=2
+    def prefetch_deposit_addr(self, symbol):
+        """
+        Start fetching Upbit deposit address of symbol. Returns Future of (deposit_addr, secondary_addr).
+        A failed fetch is tried again next time.
+        """
+        future = self.deposit_addrs.get(symbol)
+        if future is None or (future.done() and future.exception() is not None):
+            future = self.scheduler.submit(self.upbit_deposit_addr_watch(symbol))
+            self.deposit_addrs[symbol] = future
+        return future
+
+    def huobi_filled_watch(self, order_id, quantity):
+        return Watch(
+            "Huobi",
+            poll=lambda: self.huobi_trade_client.get_order(order_id=order_id),
+            done=lambda order: order if float(order.filled_amount) == quantity else None,
+            interval=1, max_interval=10,
+            name="Huobi order"
         )
 
-        log.info("Huobi to Binance done")
-        return
-
-    def binance_hedge_short(self, symbol, quantity):
-        # Binance BTC futures short
-        self.binance_client.futures_change_leverage(symbol=symbol+"USDT", leverage=10)
+    def binance_hedge_short(self, symbol, quantity, phases):
+        # Binance BTC futures short. The order is timed as a span of phases, the PhaseTimer of the calling cycle.
+        # Leverage stays once it's set, so only change it the first time.
+        if self.leverage.get(symbol) != 10:
+            self.binance_client.futures_change_leverage(symbol=symbol+"USDT", leverage=10)
+            self.leverage[symbol] = 10
 
         # Adjust precision. It's different from spot market.
-        res = self.binance_client.futures_recent_trades(symbol=symbol+"USDT", limit=1)
-        if "." in res[0]["qty"]:
-            precision = len(res[0]["qty"].split(".")[1])
-        else:
-            precision = 0
+        precision = self.metadata.futures_precision(symbol)
         futures_quantity = round(quantity, precision)
 
-        order = self.binance_client.futures_create_order(
-            symbol=symbol+"USDT",
-            side=SIDE_SELL,
-            type=ORDER_TYPE_MARKET,
-            quantity=futures_quantity
-        )
+        with phases.phase("hedge_short", exchange="Binance", symbol=symbol, quantity=futures_quantity):
+            order = self.binance_client.futures_create_order(
+                symbol=symbol+"USDT",
+                side=SIDE_SELL,
+                type=ORDER_TYPE_MARKET,
+                quantity=futures_quantity
+            )
 
         log.info("Futures short executed")
 
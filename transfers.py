@@ -0,0 +1,170 @@
+import json
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+# Coins the cycle always used to move funds back, with the fees and precisions it had in code.
+DEFAULT_CANDIDATES = {
+    "Upbit": {"Huobi": {"BTC": {"withdraw_fee": 0.0009, "precision": 0.0001, "min_withdraw": 0.001, "seconds": 1800}}},
+    "Huobi": {"Binance": {"EOS": {"withdraw_fee": 0.1, "precision": 0.0001, "min_withdraw": 0.2, "seconds": 600}}}
+}
+
+
+class TransferIndex:
+    """
+    Candidate coins to move funds from one exchange to another, with what each costs and how long it takes.
+
+    1. Withdraw fee, withdraw precision, minimum withdraw and a first guess of transfer seconds per exchange pair
+        come from candidates, {src: {dst: {coin: {...}}}} like DEFAULT_CANDIDATES.
+    2. Price and 24h quote volume of every coin come from Binance 24h tickers, refreshed every ttl seconds on a background thread.
+    3. Transfer seconds are an EWMA of our own completed transfers. Observations are saved to path and loaded on start.
+    4. select() scores every candidate of a pair in one vectorized pass and returns the cheapest.
+
+    Cost of a candidate as a fraction of notional(USDT)
+        withdraw_fee * price / notional + impact * notional / volume + time_cost * seconds / 3600
+    """
+    def __init__(self, binance_client, candidates=None, path=None, ttl=3600, impact=1.0, time_cost=0.001, alpha=0.3):
+        self.binance_client = binance_client
+        self.path = path
+        self.ttl = ttl
+        self.impact = impact
+        self.time_cost = time_cost  # fraction of notional per hour of transfer
+        self.alpha = alpha
+
+        self.prices = {}  # coin -> USDT
+        self.volumes = {}  # coin -> 24h USDT volume
+        self.observed = {}  # "src>dst>coin" -> [ewma seconds, count]
+        self.lock = threading.Lock()
+        self.running = False
+
+        if path:
+            self.load()
+
+        # Per pair arrays, one slot per candidate coin.
+        self.pairs = {}
+        for src, dsts in (candidates or DEFAULT_CANDIDATES).items():
+            for dst, coins in dsts.items():
+                self.pairs[src, dst] = self.build(src, dst, coins)
+
+    def build(self, src, dst, coins):
+        pair = {
+            "coins": list(coins),
+            "withdraw_fee": np.array([float(c["withdraw_fee"]) for c in coins.values()]),
+            "precision": np.array([float(c.get("precision", 0.0001)) for c in coins.values()]),
+            "min_withdraw": np.array([float(c.get("min_withdraw", 0)) for c in coins.values()]),
+            "seconds": np.array([float(c.get("seconds", 600)) for c in coins.values()]),
+            "price": np.zeros(len(coins)),
+            "volume": np.zeros(len(coins))
+        }
+        for i, coin in enumerate(pair["coins"]):
+            observed = self.observed.get(src + ">" + dst + ">" + coin)
+            if observed:
+                pair["seconds"][i] = observed[0]
+        return pair
+
+    def coins(self):
+        return sorted({coin for pair in self.pairs.values() for coin in pair["coins"]})
+
+    def start(self):
+        self.running = True
+        threading.Thread(target=self.refresh_loop, daemon=True, name="transfer index").start()
+
+    def refresh_loop(self):
+        while self.running:
+            try:
+                self.refresh()
+            except Exception as e:
+                log.error("Transfer index refresh failed : " + repr(e))
+            time.sleep(self.ttl)
+
+    def refresh(self):
+        prices = {}
+        volumes = {}
+        for ticker in self.binance_client.get_ticker():
+            if ticker["symbol"].endswith("USDT"):
+                coin = ticker["symbol"][:-4]
+                prices[coin] = float(ticker["lastPrice"])
+                volumes[coin] = float(ticker["quoteVolume"])
+
+        with self.lock:
+            self.prices = prices
+            self.volumes = volumes
+            for pair in self.pairs.values():
+                pair["price"][:] = [prices.get(coin, 0.0) for coin in pair["coins"]]
+                pair["volume"][:] = [volumes.get(coin, 0.0) for coin in pair["coins"]]
+
+    def record(self, src, dst, coin, seconds):
+        """
+        Seconds from withdraw request to funds usable on dst, of a transfer we made.
+        """
+        key = src + ">" + dst + ">" + coin
+        with self.lock:
+            ewma, count = self.observed.get(key, (seconds, 0))
+            ewma = seconds if count == 0 else ewma + self.alpha * (seconds - ewma)
+            self.observed[key] = [ewma, count + 1]
+
+            pair = self.pairs.get((src, dst))
+            if pair and coin in pair["coins"]:
+                pair["seconds"][pair["coins"].index(coin)] = ewma
+        log.info(key + " took " + str(round(seconds)) + "s. Expected now " + str(round(ewma)) + "s")
+
+        if self.path:
+            try:
+                self.save()
+            except OSError as e:
+                log.error("Transfer index save failed : " + repr(e))
+
+    def seconds(self, src, dst, coin):
+        observed = self.observed.get(src + ">" + dst + ">" + coin)
+        return observed[0] if observed else None
+
+    def select(self, src, dst, notional):
+        """
+        Cheapest candidate from src to dst for notional USDT.
+        Falls back to the first candidate when nothing can be scored yet, like before tickers are loaded.
+        select() looks like this
+        {"coin": "BTC", "withdraw_fee": 0.0009, "precision": 0.0001, "seconds": 1800.0, "cost": 0.0023}
+        """
+        with self.lock:
+            pair = self.pairs[src, dst]
+            price = pair["price"]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                quantity = notional / price
+                cost = (pair["withdraw_fee"] * price / notional
+                        + self.impact * notional / pair["volume"]
+                        + self.time_cost * pair["seconds"] / 3600)
+            valid = (price > 0) & (pair["volume"] > 0) & (quantity - pair["withdraw_fee"] >= pair["min_withdraw"])
+            cost[~valid] = np.inf
+
+            i = int(np.argmin(cost))
+            if not valid[i]:
+                i = 0
+            return {
+                "coin": pair["coins"][i],
+                "withdraw_fee": float(pair["withdraw_fee"][i]),
+                "precision": float(pair["precision"][i]),
+                "seconds": float(pair["seconds"][i]),
+                "cost": float(cost[i])
+            }
+
+    def load(self):
+        try:
+            with open(self.path, "r") as f:
+                self.observed = json.load(f)
+        except FileNotFoundError:
+            pass
+        except ValueError as e:
+            log.error("Transfer index file " + self.path + " is broken : " + repr(e))
+
+    def save(self):
+        with self.lock:
+            observed = dict(self.observed)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(observed, f)
+        os.replace(tmp, self.path)
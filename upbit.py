@@ -1,207 +1,144 @@
 import os
 import jwt
 import uuid
+import time
 import hashlib
+import threading
 from urllib.parse import urlencode
 
 import requests
+from requests.adapters import HTTPAdapter
 
 
 class Client:
-    def __init__(self, access_key, secret_key):
+    """
+    Upbit REST client.
+
+    1. Every request goes through one keep-alive session, so TCP and TLS connections are reused.
+        pool_size is the max number of connections kept open to the server.
+    2. Signing is done in one place. See sign().
+    3. Latency of every call is kept per endpoint. See latency_summary().
+    """
+    def __init__(self, access_key, secret_key, pool_size=10, server_url="https://api.upbit.com"):
         self.access_key = access_key
         self.secret_key = secret_key
 
-        self.server_url = "https://api.upbit.com"
+        self.server_url = server_url
 
-    def get_deposit_addr(self, currency):
-        query = {"currency": currency}
-        query_string = urlencode(query).encode()
+        self.session = requests.Session()
+        self.pool_size = 0
+        self.resize_pool(pool_size)
+
+        # "GET /v1/order" -> [count, total seconds, max seconds]
+        self.latency = {}
+        self.latency_lock = threading.Lock()
+        self.on_latency = None  # on_latency(endpoint, seconds) is called after every request
 
-        m = hashlib.sha512()
-        m.update(query_string)
-        query_hash = m.hexdigest()
+    def resize_pool(self, pool_size):
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.pool_size = pool_size
 
+    def sign(self, query_string=None):
+        """
+        Authorization header. query_string is the exact string sent to server, in bytes.
+        """
         payload = {
             'access_key': self.access_key,
             'nonce': str(uuid.uuid4()),
-            'query_hash': query_hash,
-            'query_hash_alg': 'SHA512',
         }
 
-        jwt_token = jwt.encode(payload, self.secret_key)
-        authorize_token = 'Bearer {}'.format(jwt_token)
-        headers = {"Authorization": authorize_token}
-
-        res = requests.get(self.server_url + "/v1/deposits/coin_address", params=query, headers=headers)
+        if query_string:
+            payload['query_hash'] = hashlib.sha512(query_string).hexdigest()
+            payload['query_hash_alg'] = 'SHA512'
 
-        return res.json()
+        jwt_token = jwt.encode(payload, self.secret_key)
+        return {"Authorization": 'Bearer {}'.format(jwt_token)}
 
-    def generate_coin_addr(self, currency):
-        query = {'currency': currency}
-        query_string = urlencode(query).encode()
+    def request(self, method, path, query=None, query_string=None):
+        if query and query_string is None:
+            query_string = urlencode(query).encode()
+        headers = self.sign(query_string)
 
-        m = hashlib.sha512()
-        m.update(query_string)
-        query_hash = m.hexdigest()
+        start = time.perf_counter()
+        res = self.session.request(method, self.server_url + path, params=query, headers=headers)
+        self.record_latency(method + " " + path, time.perf_counter() - start)
 
-        payload = {
-            'access_key': self.access_key,
-            'nonce': str(uuid.uuid4()),
-            'query_hash': query_hash,
-            'query_hash_alg': 'SHA512',
-        }
+        return res.json()
 
-        jwt_token = jwt.encode(payload, self.secret_key)
-        authorize_token = 'Bearer {}'.format(jwt_token)
-        headers = {"Authorization": authorize_token}
+    def record_latency(self, endpoint, seconds):
+        with self.latency_lock:
+            stat = self.latency.get(endpoint)
+            if stat is None:
+                stat = self.latency[endpoint] = [0, 0.0, 0.0]
+            stat[0] += 1
+            stat[1] += seconds
+            if seconds > stat[2]:
+                stat[2] = seconds
+
+        if self.on_latency:
+            self.on_latency(endpoint, seconds)
+
+    def latency_summary(self):
+        """
+        {"GET /v1/order": {"count": 10, "avg": 0.021, "max": 0.05}}
+        """
+        with self.latency_lock:
+            return {
+                endpoint: {"count": count, "avg": total / count, "max": max_seconds}
+                for endpoint, (count, total, max_seconds) in self.latency.items()
+            }
 
-        res = requests.post(self.server_url + "/v1/deposits/generate_coin_address", params=query, headers=headers)
+    def get_deposit_addr(self, currency):
+        query = {"currency": currency}
+        return self.request("GET", "/v1/deposits/coin_address", query)
 
-        return res.json()
+    def generate_coin_addr(self, currency):
+        query = {'currency': currency}
+        return self.request("POST", "/v1/deposits/generate_coin_address", query)
 
     def order(self, **kwargs):
         query = {}
         for k, v in kwargs.items():
             query[k] = v
-        query_string = urlencode(query).encode()
-
-        m = hashlib.sha512()
-        m.update(query_string)
-        query_hash = m.hexdigest()
-
-        payload = {
-            'access_key': self.access_key,
-            'nonce': str(uuid.uuid4()),
-            'query_hash': query_hash,
-            'query_hash_alg': 'SHA512',
-        }
-
-        jwt_token = jwt.encode(payload, self.secret_key)
-        authorize_token = 'Bearer {}'.format(jwt_token)
-        headers = {"Authorization": authorize_token}
-
-        res = requests.post(self.server_url + "/v1/orders", params=query, headers=headers)
-
-        return res.json()
+        return self.request("POST", "/v1/orders", query)
 
     def accounts(self):
-        payload = {
-            'access_key': self.access_key,
-            'nonce': str(uuid.uuid4()),
-        }
-
-        jwt_token = jwt.encode(payload, self.secret_key)
-        authorize_token = 'Bearer {}'.format(jwt_token)
-        headers = {"Authorization": authorize_token}
-
-        res = requests.get(self.server_url + "/v1/accounts", headers=headers)
-
-        return res.json()
+        return self.request("GET", "/v1/accounts")
 
     def deposits(self, currency, txid):
+        """
+        txid can be a list to query several deposits with one request.
+        """
         query = {
             'currency': currency,
         }
         query_string = urlencode(query)
 
-        txids = [txid]
+        txids = txid if isinstance(txid, (list, tuple)) else [txid]
 
         txids_query_string = '&'.join(["txids[]={}".format(txid) for txid in txids])
 
         query['txids[]'] = txids
         query_string = "{0}&{1}".format(query_string, txids_query_string).encode()
 
-        m = hashlib.sha512()
-        m.update(query_string)
-        query_hash = m.hexdigest()
-
-        payload = {
-            'access_key': self.access_key,
-            'nonce': str(uuid.uuid4()),
-            'query_hash': query_hash,
-            'query_hash_alg': 'SHA512',
-        }
-
-        jwt_token = jwt.encode(payload, self.secret_key)
-        authorize_token = 'Bearer {}'.format(jwt_token)
-        headers = {"Authorization": authorize_token}
-
-        res = requests.get(self.server_url + "/v1/deposits", params=query, headers=headers)
-
-        return res.json()
+        return self.request("GET", "/v1/deposits", query, query_string)
 
     def withdraw(self, **kwargs):
         query = {}
         for k, v in kwargs.items():
             query[k] = v
-        query_string = urlencode(query).encode()
-
-        m = hashlib.sha512()
-        m.update(query_string)
-        query_hash = m.hexdigest()
-
-        payload = {
-            'access_key': self.access_key,
-            'nonce': str(uuid.uuid4()),
-            'query_hash': query_hash,
-            'query_hash_alg': 'SHA512',
-        }
-
-        jwt_token = jwt.encode(payload, self.secret_key)
-        authorize_token = 'Bearer {}'.format(jwt_token)
-        headers = {"Authorization": authorize_token}
-
-        res = requests.post(self.server_url + "/v1/withdraws/coin", params=query, headers=headers)
-
-        return res.json()
+        return self.request("POST", "/v1/withdraws/coin", query)
 
     def check_withdraw(self, withdraw_uuid):
         query = {
             'uuid': withdraw_uuid
         }
-        query_string = urlencode(query).encode()
-
-        m = hashlib.sha512()
-        m.update(query_string)
-        query_hash = m.hexdigest()
-
-        payload = {
-            'access_key': self.access_key,
-            'nonce': str(uuid.uuid4()),
-            'query_hash': query_hash,
-            'query_hash_alg': 'SHA512',
-        }
-
-        jwt_token = jwt.encode(payload, self.secret_key)
-        authorize_token = 'Bearer {}'.format(jwt_token)
-        headers = {"Authorization": authorize_token}
-
-        res = requests.get(self.server_url + "/v1/withdraw", params=query, headers=headers)
-
-        return res.json()
+        return self.request("GET", "/v1/withdraw", query)
 
     def check_order(self, trade_uuid):
         query = {
             'uuid': trade_uuid,
         }
-        query_string = urlencode(query).encode()
-
-        m = hashlib.sha512()
-        m.update(query_string)
-        query_hash = m.hexdigest()
-
-        payload = {
-            'access_key': self.access_key,
-            'nonce': str(uuid.uuid4()),
-            'query_hash': query_hash,
-            'query_hash_alg': 'SHA512',
-        }
-
-        jwt_token = jwt.encode(payload, self.secret_key)
-        authorize_token = 'Bearer {}'.format(jwt_token)
-        headers = {"Authorization": authorize_token}
-
-        res = requests.get(self.server_url + "/v1/order", params=query, headers=headers)
-
-        return res.json()
\ No newline at end of file
+        return self.request("GET", "/v1/order", query)
@@ -0,0 +1,75 @@
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+class WarmStart:
+    """
+    Last prices and exchange metadata kept in a JSON file, so a restart doesn't wait on every feed and REST call.
+
+    1. Saved every interval seconds and at exit. Written to a temporary file and renamed, so a crash never leaves half a file.
+    2. Restored prices fill only empty slots and keep recv_ts 0. They are stale for PriceSnapshot.stale and
+        Trader.live_premium until their own feed sends a tick, so nothing is traded on them.
+    3. Restored metadata is used right away. MetadataIndex reloads it in background on start.
+
+    The file looks like this
+    {"saved_at": 1600000000.0, "prices": PriceStore.state(), "metadata": MetadataIndex.state()}
+    """
+    def __init__(self, path, prices, metadata=None, interval=60):
+        self.path = path
+        self.prices = prices
+        self.metadata = metadata
+        self.interval = interval
+        self.state = self.load()
+        self.running = False
+
+    def load(self):
+        try:
+            with open(self.path, "r") as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            log.info("No warm start file " + self.path)
+            return None
+        except ValueError as e:
+            log.error("Warm start file " + self.path + " is broken : " + repr(e))
+            return None
+
+        log.info("Warm start from " + str(round(time.time() - state["saved_at"])) + " seconds ago")
+        return state
+
+    def restore_prices(self):
+        if self.state:
+            self.prices.restore(self.state["prices"])
+
+    def restore_metadata(self, metadata):
+        self.metadata = metadata
+        if self.state and self.state.get("metadata"):
+            metadata.restore(self.state["metadata"])
+
+    def save(self):
+        state = {"saved_at": time.time(), "prices": self.prices.state()}
+        if self.metadata and self.metadata.loaded_at:
+            state["metadata"] = self.metadata.state()
+
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp, self.path)
+
+    def start(self):
+        self.running = True
+        threading.Thread(target=self.save_loop, daemon=True, name="warm start").start()
+        atexit.register(self.save)
+
+    def save_loop(self):
+        while self.running:
+            time.sleep(self.interval)
+            try:
+                self.save()
+            except Exception as e:
+                log.error("Warm start save failed : " + repr(e))
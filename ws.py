@@ -2,23 +2,36 @@ import websocket
 import threading
 import requests
 import logging
-import gzip
+import random
+import heapq
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-from huobi.client.market import MarketClient
-from json import loads, dumps
-from datetime import datetime
+from json import dumps
+from decode import Decoder, get_loads
+from metrics import registry
 
 log = logging.getLogger(__name__)
 
 
 class Client(threading.Thread):
-    def __init__(self, url, exchange):
+    def __init__(self, url, exchange, on_update=None):
         super().__init__()
 
+        self.url = url
         self.exchange = exchange
+        self.on_update = on_update  # on_update(exchange, key) is called after every price update
 
-        self.ws = websocket.WebSocketApp(
-            url=url,
+        self.running = True
+        self.close_hook = None  # Set by feed.FeedManager while it owns the connection.
+        self.ws = self.create_ws()
+
+        self.handle_time = registry.histogram("on_message." + exchange)
+        self.feed_latency = registry.histogram("feed_latency." + exchange)
+
+    def create_ws(self):
+        return websocket.WebSocketApp(
+            url=self.url,
             on_open=self.on_open,
             on_message=self.on_message,
             on_error=self.on_error,
@@ -26,13 +39,65 @@ class Client(threading.Thread):
         )
 
     def run(self):
-        self.ws.run_forever()
+        backoff = 0.5
+        while self.running:
+            started = time.time()
+            self.ws.run_forever()
+            if not self.running:
+                break
+
+            # Connection lived long enough, so start over from the shortest backoff.
+            if time.time() - started > 60:
+                backoff = 0.5
+            time.sleep(random.uniform(0, backoff))
+            backoff = min(backoff * 2, 30)
+            self.ws = self.create_ws()
+
+    def reconnect(self):
+        """
+        Drop the connection. It's connected again to self.url, so change url first to move streams.
+        """
+        if self.close_hook:
+            self.close_hook()
+        else:
+            self.ws.close()
+
+    def stop(self):
+        self.running = False
+        self.reconnect()
 
     def on_open(self, ws):
         print(f'Connected to {self.exchange}\n')
 
+        for params in self.subscription():
+            self.ws.send(params)
+
     def on_message(self, ws, message):
-        pass
+        reply = self.dispatch(message)
+        if reply:
+            self.ws.send(reply)
+
+    def dispatch(self, message):
+        """
+        handle() with its time recorded. Used by both transports.
+        """
+        start = time.perf_counter()
+        reply = self.handle(message)
+        self.handle_time.record(time.perf_counter() - start)
+        return reply
+
+    def subscription(self):
+        """
+        Messages to send right after connecting. Sent again on every reconnect.
+        """
+        return []
+
+    def handle(self, message):
+        """
+        Parse exchange message and update prices. Returns a message to send back or None.
+        Transport independent so feed.FeedManager can reuse it.
+        """
+        return None
 
     def on_error(self, ws, error):
         log.error(error)
@@ -42,47 +107,284 @@ class Client(threading.Thread):
 
 
 class UpbitWS(Client):
-    def __init__(self, exchange, cur_prices, settings):
-        url = "wss://api.upbit.com/websocket/v1"
-        super().__init__(url, exchange)
+    def __init__(self, exchange, prices, settings, on_update=None, books=None, recorder=None, tickers=True):
+        url = settings.get("upbit_ws_url", "wss://api.upbit.com/websocket/v1")
+        super().__init__(url, exchange, on_update)
 
         self.settings = settings
-        self.cur_price = cur_prices[exchange]
-
-    def on_open(self, ws):
-        super().on_open(ws)
+        self.prices = prices
+        self.books = books  # book.BookStore. Subscribes orderbook too when given.
+        self.tickers = tickers  # False when prices get Upbit tickers from elsewhere, only orderbook is subscribed.
+        self.recorder = recorder  # recorder.TickRecorder. Every price update is recorded when given.
+        self.loads = get_loads(settings.get("json_backend", "ujson"))
+
+        # Ticker has about 30 fields. Only these are used.
+        self.decoder = Decoder(
+            backend=settings.get("json_backend", "ujson"),
+            fields=("code", "trade_price", "trade_timestamp", "trade_volume"),
+            extract=settings.get("extract_fields", True)
+        )
 
+    def subscription(self):
         codes = ["KRW-" + m for m in self.settings["market_list"]]
 
-        params = dumps([{"ticket": "test"}, {"type": "ticker", "codes": codes}])
-        self.ws.send(params)
-
-    def on_message(self, ws, message):
-        data = loads(message)
-
-        # ex) code = KRW-ADA
-        self.cur_price[data["code"]] = data["trade_price"]
+        params = [{"ticket": "test"}]
+        if self.tickers:
+            params.append({"type": "ticker", "codes": codes})
+        if self.books:
+            params.append({"type": "orderbook", "codes": codes})
+        return [dumps(params)]
 
+    def handle(self, message):
+        # Orderbook messages are parsed whole. Ticker messages go through field extraction.
+        if self.books and message[:19] in (b'{"type":"orderbook"', '{"type":"orderbook"'):
+            self.books.apply_upbit(self.loads(message))
+            return None
 
-class BinanceWS(Client):
-    def __init__(self, exchange, cur_prices, settings):
-        url = "wss://stream.binance.com:9443/ws/"
+        data = self.decoder.decode(message)
+        if data is None:
+            return None
 
-        streams = [market.lower()+"usdt@aggTrade" for market in settings["market_list"]]
-        url = url + '/'.join(streams)
-
-        super().__init__(url, exchange)
+        # ex) code = KRW-ADA
+        code, trade_price, trade_timestamp, trade_volume = data
+        self.prices.set_upbit(code, trade_price, trade_timestamp / 1000)
+        self.feed_latency.record(time.time() - trade_timestamp / 1000)
+        if self.recorder:
+            self.recorder.record(self.exchange, code, trade_timestamp / 1000, trade_price, trade_volume)
 
-        self.cur_price = cur_prices[exchange]
+        if self.on_update:
+            self.on_update(self.exchange, code)
 
-    def on_open(self, ws):
-        super().on_open(ws)
 
-    def on_message(self, ws, message):
-        data = loads(message)
+class BinanceWS(Client):
+    def __init__(self, exchange, prices, settings, on_update=None, market_list=None, shard_id=0, recorder=None):
+        self.market_list = list(settings["market_list"] if market_list is None else market_list)
+        self.shard_id = shard_id
+        self.stats = ShardStats()
+        self.base_url = settings.get("binance_ws_url", "wss://stream.binance.com:9443/ws/")
+
+        super().__init__(self.stream_url(self.market_list), exchange, on_update)
+
+        self.prices = prices
+        self.recorder = recorder
+        self.decoder = Decoder(
+            backend=settings.get("json_backend", "ujson"),
+            fields=("s", "p", "T", "q")
+        )
 
-        # s is symbol ex) BTCUSDT, p is current price
-        self.cur_price[data["s"]] = float(data["p"])
+    def stream_url(self, market_list):
+        streams = [market.lower()+"usdt@aggTrade" for market in market_list]
+        return self.base_url + '/'.join(streams)
+
+    def set_market_list(self, market_list):
+        """
+        Move this shard to another set of symbols. Takes effect on reconnect.
+        """
+        self.market_list = list(market_list)
+        self.url = self.stream_url(self.market_list)
+        self.reconnect()
+
+    def handle(self, message):
+        data = self.decoder.decode(message)
+        if data is None:
+            return None
+
+        # s is symbol ex) BTCUSDT, p is current price, T is trade time, q is quantity
+        symbol, price, trade_time, quantity = data
+        self.prices.set_binance(symbol, float(price), trade_time / 1000)
+        latency = time.time() - trade_time / 1000
+        self.stats.add(symbol, latency)
+        self.feed_latency.record(latency)
+        if self.recorder:
+            self.recorder.record(self.exchange, symbol, trade_time / 1000, float(price), float(quantity))
+
+        if self.on_update:
+            self.on_update(self.exchange, symbol)
+
+
+class BinanceDepthWS(BinanceWS):
+    """
+    Binance diff depth streams of market_list. Updates go to book.BookStore.
+    Runs on BinanceShards like aggTrade streams.
+    """
+    def __init__(self, exchange, prices, settings, on_update=None, market_list=None, shard_id=0, books=None):
+        super().__init__(exchange, prices, settings, on_update, market_list, shard_id)
+
+        self.books = books
+        self.decoder = Decoder(backend=settings.get("json_backend", "ujson"))
+
+        # Kept apart from aggTrade streams of the same exchange.
+        self.handle_time = registry.histogram("on_message." + exchange + " depth")
+        self.feed_latency = registry.histogram("feed_latency." + exchange + " depth")
+
+    def stream_url(self, market_list):
+        streams = [market.lower()+"usdt@depth@100ms" for market in market_list]
+        return self.base_url + '/'.join(streams)
+
+    def handle(self, message):
+        data = self.decoder.decode(message)
+        if "e" not in data:
+            return None
+
+        self.books.apply_binance(data)
+        latency = time.time() - data["E"] / 1000
+        self.stats.add(data["s"], latency)
+        self.feed_latency.record(latency)
+
+
+snapshot_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="depth")
+
+
+def binance_depth_snapshot(books, symbol, base_url="https://api.binance.com"):
+    """
+    Load REST depth snapshot of symbol into books on another thread, so the feed thread doesn't wait.
+    """
+    def fetch():
+        try:
+            url = base_url + "/api/v3/depth"
+            snapshot = requests.get(url, params={"symbol": symbol+"USDT", "limit": 1000}).json()
+            books.load_binance_snapshot(symbol, snapshot)
+        except Exception as e:
+            books.snapshot_failed(symbol, repr(e))
+
+    snapshot_executor.submit(fetch)
+
+
+class ShardStats:
+    """
+    Message count and trade time to receive latency of one Binance shard.
+    Counts per symbol are kept for BinanceShards.rebalance.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.started = time.time()
+        self.count = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+        self.symbol_count = {}
+
+    def add(self, symbol, latency):
+        with self.lock:
+            self.count += 1
+            self.latency_sum += latency
+            if latency > self.latency_max:
+                self.latency_max = latency
+            self.symbol_count[symbol] = self.symbol_count.get(symbol, 0) + 1
+
+    def summary(self, reset=False):
+        with self.lock:
+            elapsed = max(time.time() - self.started, 1e-9)
+            summary = {
+                "count": self.count,
+                "rate": self.count / elapsed,
+                "latency_avg": self.latency_sum / self.count if self.count else 0.0,
+                "latency_max": self.latency_max,
+                "symbol_count": dict(self.symbol_count)
+            }
+            if reset:
+                self.reset()
+        return summary
+
+
+class BinanceShards:
+    """
+    Splits Binance aggTrade streams across several BinanceWS connections.
+
+    1. Shard count is settings binance_shards, or enough shards to keep each under binance_streams_per_shard.
+    2. Each shard has its own ShardStats.
+    3. rebalance() moves symbols by observed message count so heavy symbols like BTC and ETH
+        don't share a socket. Runs every binance_rebalance_interval seconds when started.
+    """
+    def __init__(self, prices, settings, on_update=None, ws_class=None, **ws_kwargs):
+        self.settings = settings
+        self.market_list = list(settings["market_list"])
+        self.streams_per_shard = settings.get("binance_streams_per_shard", 200)
+        self.rebalance_interval = settings.get("binance_rebalance_interval", 600)
+
+        n_shards = settings.get("binance_shards", -(-len(self.market_list) // self.streams_per_shard))
+        n_shards = max(1, min(n_shards, len(self.market_list)))
+
+        # Round robin until there are stats to balance with.
+        ws_class = ws_class or BinanceWS
+        self.shards = [
+            ws_class(
+                exchange="Binance",
+                prices=prices,
+                settings=settings,
+                on_update=on_update,
+                market_list=self.market_list[i::n_shards],
+                shard_id=i,
+                **ws_kwargs
+            )
+            for i in range(n_shards)
+        ]
+
+        self.running = False
+
+    def start(self):
+        for shard in self.shards:
+            shard.start()
+        self.start_rebalance()
+
+    def start_rebalance(self):
+        """
+        Only starts rebalancing. Used when shards run on feed.FeedManager instead of their own threads.
+        """
+        self.running = True
+        if len(self.shards) > 1 and self.rebalance_interval:
+            threading.Thread(target=self.rebalance_loop, daemon=True).start()
+
+    def stop(self):
+        self.running = False
+        for shard in self.shards:
+            shard.stop()
+
+    def rebalance_loop(self):
+        while self.running:
+            time.sleep(self.rebalance_interval)
+            try:
+                self.rebalance()
+            except Exception as e:
+                log.error(e)
+
+    def stats(self, reset=False):
+        return [shard.stats.summary(reset) for shard in self.shards]
+
+    def assign(self, symbol_count):
+        """
+        Longest processing time first. Heaviest symbol goes to the least loaded shard
+        that still has room for another stream.
+        """
+        heap = [(0, i) for i in range(len(self.shards))]
+        market_lists = [[] for _ in self.shards]
+
+        symbols = sorted(self.market_list, key=lambda m: symbol_count.get(m+"USDT", 0), reverse=True)
+        for symbol in symbols:
+            skipped = []
+            load, i = heapq.heappop(heap)
+            while len(market_lists[i]) >= self.streams_per_shard and heap:
+                skipped.append((load, i))
+                load, i = heapq.heappop(heap)
+            market_lists[i].append(symbol)
+            heapq.heappush(heap, (load + symbol_count.get(symbol+"USDT", 0), i))
+            for item in skipped:
+                heapq.heappush(heap, item)
+
+        return market_lists
+
+    def rebalance(self):
+        symbol_count = {}
+        for summary in self.stats(reset=True):
+            symbol_count.update(summary["symbol_count"])
+
+        market_lists = self.assign(symbol_count)
+        for shard, market_list in zip(self.shards, market_lists):
+            if set(market_list) != set(shard.market_list):
+                log.info("Binance shard " + str(shard.shard_id) + " rebalanced to " + str(len(market_list)) + " symbols")
+                shard.set_market_list(market_list)
 
 """
 class HuobiWS(threading.Thread):
@@ -102,26 +404,35 @@ class HuobiWS(threading.Thread):
 
 
 class HuobiWS(Client):
-    def __init__(self, cur_prices):
+    def __init__(self, prices, on_update=None, json_backend="ujson", recorder=None, url=None):
         self.host = "krapi-aws.huobi.pro"
-        url = "wss://"+self.host+"/ws" # if the host changes pre_sign host should be changed too
-        super().__init__(url, "Huobi")
-
-        self.cur_price = cur_prices["Huobi"]
+        url = url or "wss://"+self.host+"/ws" # if the host changes pre_sign host should be changed too
+        super().__init__(url, "Huobi", on_update)
 
-    def on_open(self, ws):
-        super().on_open(ws)
+        self.prices = prices
+        self.recorder = recorder
+        self.decoder = Decoder(backend=json_backend, gzip=True)
 
+    def subscription(self):
         data = {"sub": "market.usdtkrw.trade.detail"}
-        self.ws.send(dumps(data))
+        return [dumps(data)]
 
-    def on_message(self, ws, message):
-        data = loads(gzip.decompress(message))
+    def handle(self, message):
+        data = self.decoder.decode(message)
 
         if "ping" in data:
             params = {"pong": data['ping']}
-            self.ws.send(dumps(params))
+            return dumps(params)
         elif "tick" in data:
-            self.cur_price["usdt"] = data["tick"]["data"][0]["price"]
+            trade = data["tick"]["data"][0]
+            self.prices.set_usdt(trade["price"], trade["ts"] / 1000)
+            self.feed_latency.record(time.time() - trade["ts"] / 1000)
+            if self.recorder:
+                self.recorder.record(self.exchange, "usdt", trade["ts"] / 1000, trade["price"], trade["amount"])
+
+            if self.on_update:
+                self.on_update(self.exchange, "usdt")
         else:
             pass
+
+        return None